@@ -0,0 +1,95 @@
+"""Benchmark of keyword search over a large bill catalog
+
+Compares the BM25 inverted index, in memory and memory mapped, against substring matching every
+bill title and summary, which is what a search costs without the index. Also reports how long a
+worker takes to load the index file.
+
+Usage: POLITI_HACK_CONFIG_PATH=config.json python3 benchmarks/bench_bill_search.py [num_bills]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../"))
+
+import random
+import tempfile
+import time
+
+import sunlight_api.models.bill as bill
+import sunlight_api.search as search
+
+WORDS = ["health", "care", "tax", "farm", "energy", "veterans", "education", "highway", "water",
+    "defense", "immigration", "housing", "medicare", "student", "loan", "climate", "rural", "trade",
+    "small", "business", "insurance", "pension", "border", "security", "broadband", "opioid"]
+
+QUERIES = ["health care", "student loan", "rural broadband", "veterans housing", "tax", "opioid",
+    "small business trade", "nothing matches"]
+
+
+# Real bill text has a long tail of rare words, each word is weighted by 1 / rank
+VOCABULARY = WORDS + ["term{}".format(i) for i in range(5000)]
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+def make_bills(num_bills, rand):
+    def words(n):
+        return " ".join(rand.choices(VOCABULARY, WEIGHTS, k=n))
+
+    return [bill.Bill({
+        "bill_id": "hr{}-114".format(i),
+        "official_title": "To amend the {} act".format(words(rand.randint(3, 12))),
+        "summary_short": words(rand.randint(20, 60)),
+        "keywords": [word.title() for word in rand.choices(VOCABULARY, WEIGHTS, k=4)],
+    }) for i in range(num_bills)]
+
+
+def substring_search(bills, query, k=10):
+    terms = query.lower().split()
+    hits = [b.bill_id for b in bills
+        if all(term in "{} {}".format(b.title, b.summary).lower() for term in terms)]
+
+    return hits[:k]
+
+
+def time_queries(search_func, repeat=20):
+    """Returns the (median, worst) microseconds per query"""
+    samples = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            begin = time.perf_counter()
+            search_func(query)
+            samples.append((time.perf_counter() - begin) * 10**6)
+
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def main(num_bills):
+    bills = make_bills(num_bills, random.Random(0))
+
+    begin = time.perf_counter()
+    index = search.BillIndex()
+    for b in bills:
+        index.add_bill(b)
+    print("Indexed {} bills in {:.2f}s".format(num_bills, time.perf_counter() - begin))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bills.index")
+        index.save(path)
+
+        begin = time.perf_counter()
+        mapped = search.MappedBillIndex(path)
+        print("Loaded a {:.1f}MB index file in {:.1f}ms\n".format(
+            os.path.getsize(path) / 2**20, (time.perf_counter() - begin) * 10**3))
+
+        print("{:<22}{:>16}{:>16}".format("search", "median us", "worst us"))
+        for name, search_func in (
+            ("substring scan", lambda query: substring_search(bills, query)),
+            ("BM25 in memory", lambda query: index.search(query)),
+            ("BM25 memory mapped", lambda query: mapped.search(query)),
+        ):
+            median, worst = time_queries(search_func, repeat=3 if name == "substring scan" else 20)
+            print("{:<22}{:>16.0f}{:>16.0f}".format(name, median, worst))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,77 @@
+"""Benchmark of routing messages against hundreds of registered commands
+
+Compares `CommandRouter` against scanning every command alias for a match, which is what routing
+costs without the trie.
+
+Usage: POLITI_HACK_CONFIG_PATH=config.json python3 benchmarks/bench_command_router.py [num_commands]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../"))
+
+import random
+import timeit
+
+from decide_politics.transactions import router
+
+WORDS = ["VOTE", "BILL", "BILLS", "INFO", "REP", "STATUS", "HELP", "STOP", "ALERTS", "SEARCH",
+    "NEWS", "DISTRICT", "RESULTS", "SUBSCRIBE", "TOPIC", "HOUSE", "SENATE", "HISTORY"]
+
+
+class DummyTransaction:
+    def __init__(self, transaction_id, commands):
+        self.ID = transaction_id
+        self.COMMANDS = commands
+
+
+def make_transactions(num_commands, rand):
+    commands = set()
+    while len(commands) < num_commands:
+        commands.add(" ".join(rand.choice(WORDS) + str(rand.randrange(20)) for _ in range(rand.randint(1, 3))))
+
+    return [DummyTransaction("transaction_%d" % i, (command,)) for i, command in enumerate(sorted(commands))]
+
+
+def linear_route(transactions, message):
+    """Longest matching alias by scanning every command"""
+    words = message.split()
+    best = None
+    for transaction in transactions:
+        for command in transaction.COMMANDS:
+            command_words = command.split()
+            if words[:len(command_words)] == command_words and \
+                    (best is None or len(command_words) > len(best[1].split())):
+                best = (transaction, command)
+
+    return best
+
+
+def main(num_commands):
+    rand = random.Random(0)
+    transactions = make_transactions(num_commands, rand)
+    command_router = router.CommandRouter(transactions)
+
+    # Half of the messages are commands with arguments, the rest match nothing
+    messages = []
+    for i in range(1000):
+        if i % 2 == 0:
+            messages.append(rand.choice(transactions).COMMANDS[0] + " HR1234 YES")
+        else:
+            messages.append("WHAT IS THIS %d" % i)
+
+    for message in messages:
+        route = command_router.route(message)
+        linear = linear_route(transactions, message)
+        assert (route is None and linear is None) or route.transaction is linear[0]
+
+    trie_seconds = timeit.timeit(lambda: [command_router.route(m) for m in messages], number=20)
+    linear_seconds = timeit.timeit(lambda: [linear_route(transactions, m) for m in messages], number=2)
+
+    print("{} commands registered".format(num_commands))
+    print("{:<14}{:>14}".format("router", "us/message"))
+    print("{:<14}{:>14.2f}".format("trie", trie_seconds / 20 / len(messages) * 10**6))
+    print("{:<14}{:>14.2f}".format("linear scan", linear_seconds / 2 / len(messages) * 10**6))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
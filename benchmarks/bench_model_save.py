@@ -0,0 +1,121 @@
+"""Micro-benchmark of the allocations made by `Model.save`
+
+Compares the dirty tracking save path against the previous implementation, which validated a deep
+copy of the item (`get_data`) and let boto diff and deep copy the whole item (`Item.partial_save`).
+Reports the deep copies, the peak memory and the memory blocks a save leaves allocated (taken
+from a tracemalloc snapshot diff, so blocks that were freed again aren't counted). No requests are sent, dynamodb calls are answered by a null connection.
+
+Usage: POLITI_HACK_CONFIG_PATH=config.json python3 benchmarks/bench_model_save.py [iterations]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../"))
+
+import copy
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import boto.dynamodb2.fields as dynamo_fields
+import boto.dynamodb2.items as dynamo_items
+
+from decide_politics.core.models import CFields
+from decide_politics.core.models import Customer
+from shared.common import Errors, DecidePoliticsException
+
+# Leaves tracemalloc's own snapshots out of the allocations
+TRACE_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+class NullConnection:
+    """Accepts dynamodb writes without sending them anywhere"""
+    def put_item(self, *args, **kwargs):
+        return {}
+
+    def update_item(self, *args, **kwargs):
+        return {}
+
+
+def legacy_save(model):
+    """`Model.save` before dirty tracking"""
+    if not model.item.needs_save():
+        return True
+    elif any((val == "" for val in model.get_data().values())):
+        raise DecidePoliticsException(Errors.INVALID_DATA_PRESENT)
+
+    model.item.partial_save()
+    return True
+
+
+def dirty_tracking_save(model):
+    return model.save()
+
+
+def load_customer(i):
+    return Customer.load_from_cache_data({
+        CFields.UUID: "00000000-0000-0000-0000-%012d" % i,
+        CFields.VERSION: Customer.VERSION,
+        CFields.PHONE_NUMBER: "+1541967%04d" % (i % 10000),
+        CFields.FIRST_NAME: "Jane",
+        CFields.LAST_NAME: "Doe",
+        CFields.EMAIL: "jane@example.com",
+        CFields.ZIP_CODE: "94110",
+        CFields.CUR_TRANSACTION_ID: "AckBackTransaction",
+        CFields.TRANSACTION_STATE_ID: "enter",
+    })
+
+
+def run(save_func, iterations):
+    """Runs a message's worth of state changes followed by a save for each customer
+
+    :returns: (deep copies per save, peak bytes per save, allocated blocks per save,
+              microseconds per save)
+    """
+    customers = [load_customer(i) for i in range(iterations)]
+    deepcopy_calls = [0]
+    real_deepcopy = copy.deepcopy
+
+    def counting_deepcopy(*args, **kwargs):
+        deepcopy_calls[0] += 1
+        return real_deepcopy(*args, **kwargs)
+
+    peak_bytes = 0
+    allocated_blocks = 0
+    elapsed = 0.0
+    with patch.object(copy, "deepcopy", counting_deepcopy), \
+            patch.object(dynamo_items, "deepcopy", counting_deepcopy):
+        for customer in customers:
+            customer[CFields.TRANSACTION_STATE_ID] = "ack_back"
+
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+            tracemalloc.reset_peak()
+            begin = time.perf_counter()
+            save_func(customer)
+            elapsed += time.perf_counter() - begin
+            peak_bytes += tracemalloc.get_traced_memory()[1]
+            after = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+            allocated_blocks += sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+            tracemalloc.stop()
+
+    return (
+        deepcopy_calls[0] / iterations,
+        peak_bytes / iterations,
+        allocated_blocks / iterations,
+        elapsed / iterations * 10**6,
+    )
+
+
+def main(iterations):
+    Customer.TABLE.connection = NullConnection()
+    Customer.TABLE.schema = [dynamo_fields.HashKey(CFields.UUID)]
+
+    print("{:<22}{:>16}{:>18}{:>14}{:>14}".format(
+        "save path", "deepcopies/save", "peak bytes/save", "blocks/save", "us/save"))
+    for name, save_func in (("get_data + boto", legacy_save), ("dirty tracking", dirty_tracking_save)):
+        deepcopies, peak_bytes, allocated_blocks, micros = run(save_func, iterations)
+        print("{:<22}{:>16.1f}{:>18.0f}{:>14.1f}{:>14.1f}".format(
+            name, deepcopies, peak_bytes, allocated_blocks, micros))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,315 @@
+"""End to end benchmark of the SMS webhooks
+
+Drives scripted conversations through `/sms/handle_sms` and `/web/handle_message/<uuid>` with
+Flask's test client and reports, for each conversation, the throughput, the latency percentiles,
+the storage calls per message, the peak memory of a message and the memory blocks a message leaves
+allocated (tracemalloc can't count the blocks that were freed again). Twilio is mocked, and items
+are kept by the in-memory storage engine unless `--storage dynamodb` is given (e.g. to run
+against DynamoDB Local from the config). Each storage call is one DynamoDB request.
+
+Save the results of a release and compare the next one against them:
+
+    POLITI_HACK_CONFIG_PATH=config.json python3 benchmarks/bench_sms_pipeline.py --output before.json
+    POLITI_HACK_CONFIG_PATH=config.json python3 benchmarks/bench_sms_pipeline.py --baseline before.json
+
+Exits with status 1 when a metric regressed by more than `--tolerance`.
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../"))
+
+import argparse
+import collections
+import datetime
+import itertools
+import json
+import logging
+import platform
+import random
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import shared.config as config
+
+SMS_PATH = "/sms/handle_sms"
+WEB_PATH = "/web/handle_message/{}"
+
+# Whether a larger value of each compared metric is better
+HIGHER_IS_BETTER = {
+    "throughput_per_second": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "storage_calls_per_message": False,
+    "peak_bytes_per_message": False,
+    "allocated_blocks_per_message": False,
+}
+
+# Leaves tracemalloc's own snapshots out of the allocations
+TRACE_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+
+def configure(storage_engine):
+    """Overrides the config, before the app's modules create their services from it"""
+    config.store["storage"] = {"engine": storage_engine}
+    config.store["twilio"] = {"is_testing": True}
+    # Handle each message within its request, so that the latency is the whole message
+    config.store["inbound_pipeline"] = {"enabled": False}
+    config.store["profiler"] = {"enabled": False}
+
+
+class CountingEngine:
+    """Counts the calls made to a storage engine, by operation"""
+    def __init__(self, engine):
+        self.engine = engine
+        self.calls = collections.Counter()
+
+    def __getattr__(self, name):
+        func = getattr(self.engine, name)
+
+        def counted(*args, **kwargs):
+            self.calls[name] += 1
+            return func(*args, **kwargs)
+
+        return counted
+
+
+class Conversation:
+    """A script of messages, sent by every customer of a run
+
+    :ivar str name: The name the results are reported under
+    :ivar str path: SMS_PATH or WEB_PATH
+    :ivar list script: The bodies of the messages, in order
+    :ivar dict initial_state: (Optional) The attributes of customers that exist before the run,
+        None when the customers are new
+    """
+    def __init__(self, name, path, script, initial_state=None):
+        self.name = name
+        self.path = path
+        self.script = script
+        self.initial_state = initial_state
+
+
+CONVERSATIONS = [
+    # First messages from new phone numbers, the welcome and then an invalid command
+    Conversation("onboarding", SMS_PATH, ["WELCOME", "HELLO"]),
+    # Existing customers asking for the welcome message again
+    Conversation("welcome", SMS_PATH, ["WELCOME"] * 3, initial_state={}),
+    # Existing customers in the ack transaction, through the web endpoint
+    Conversation("ack_loop", WEB_PATH, ["ACK"] * 8 + ["EXIT"], initial_state={
+        "cur_transaction_id": "AckBackTransaction",
+        "transaction_state_id": "enter",
+    }),
+]
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest rank percentile"""
+    index = max(0, min(len(sorted_samples) - 1, int(round(fraction * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+class PipelineBenchmark:
+    def __init__(self, app, storage_engine, phone_numbers):
+        """
+        :param app: The Flask app
+        :param str storage_engine: "memory" or "dynamodb"
+        :param phone_numbers: An iterator of unused phone numbers
+        """
+        self.client = app.test_client()
+        self.storage_engine = storage_engine
+        self.phone_numbers = phone_numbers
+
+    def run(self, conversation, num_customers, trace_allocations=False):
+        """Runs the conversation of every customer, interleaving the customers message by message
+
+        :returns: (the latency of each message in seconds, the storage calls, the peak bytes of each
+            message, the blocks each message left allocated)
+        """
+        import decide_politics.core.models as models
+        import decide_politics.core.storage as storage
+
+        # Every run starts from an empty cache, and an empty store unless it is DynamoDB
+        engine = storage.MemoryEngine(models.SCHEMAS) if self.storage_engine == "memory" else models.engine
+        models.Customer.CACHE.clear()
+
+        with patch.object(models, "engine", CountingEngine(engine)) as counting_engine:
+            requests = self._make_requests(conversation, num_customers)
+            counting_engine.calls.clear()
+
+            latencies = []
+            peak_bytes = []
+            allocated_blocks = []
+            for path, kwargs in requests:
+                if trace_allocations:
+                    tracemalloc.start()
+                    before = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+                    tracemalloc.reset_peak()
+
+                begin = time.perf_counter()
+                response = self.client.post(path, **kwargs)
+                latencies.append(time.perf_counter() - begin)
+
+                if trace_allocations:
+                    peak_bytes.append(tracemalloc.get_traced_memory()[1])
+                    after = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+                    allocated_blocks.append(sum(stat.count_diff for stat in after.compare_to(before, "filename")))
+                    tracemalloc.stop()
+
+                if response.status_code != 200:
+                    raise RuntimeError("{} returned {}: {}".format(path, response.status_code, response.data))
+
+            return (latencies, counting_engine.calls, peak_bytes, allocated_blocks)
+
+    def _make_requests(self, conversation, num_customers):
+        import decide_politics.core.models as models
+
+        customers = []
+        for _ in range(num_customers):
+            phone_number = next(self.phone_numbers)
+            customer_uuid = None
+            if conversation.initial_state is not None:
+                customer = models.Customer.create_new(dict(conversation.initial_state, phone_number=phone_number))
+                customer.create()
+                customer_uuid = customer[models.CFields.UUID]
+            customers.append((phone_number, customer_uuid))
+
+        requests = []
+        for body in conversation.script:
+            for phone_number, customer_uuid in customers:
+                if conversation.path == SMS_PATH:
+                    requests.append((SMS_PATH, dict(data={"From": phone_number, "Body": body})))
+                else:
+                    requests.append((WEB_PATH.format(customer_uuid), dict(
+                        data=json.dumps({"message_body": body}),
+                        content_type="application/json",
+                    )))
+
+        return requests
+
+
+def summarize(latencies, calls, peak_bytes, allocated_blocks):
+    num_messages = len(latencies)
+    sorted_latencies = sorted(latencies)
+    total_calls = sum(calls.values())
+
+    return collections.OrderedDict([
+        ("messages", num_messages),
+        ("throughput_per_second", num_messages / sum(latencies)),
+        ("latency_mean_ms", sum(latencies) / num_messages * 1000),
+        ("latency_p50_ms", percentile(sorted_latencies, 0.50) * 1000),
+        ("latency_p95_ms", percentile(sorted_latencies, 0.95) * 1000),
+        ("latency_p99_ms", percentile(sorted_latencies, 0.99) * 1000),
+        ("latency_max_ms", sorted_latencies[-1] * 1000),
+        ("storage_calls_per_message", total_calls / num_messages),
+        ("storage_calls", {name: count / num_messages for name, count in sorted(calls.items())}),
+        ("peak_bytes_per_message", sum(peak_bytes) / len(peak_bytes)),
+        ("allocated_blocks_per_message", sum(allocated_blocks) / len(allocated_blocks)),
+    ])
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change of each metric from the baseline
+
+    :returns: The (conversation, metric) pairs that regressed by more than the tolerance
+    """
+    regressions = []
+    print("\n{:<14}{:<28}{:>12}{:>12}{:>10}".format("conversation", "metric", "baseline", "current", "change"))
+    for name, summary in results["conversations"].items():
+        baseline_summary = baseline["conversations"].get(name)
+        if baseline_summary is None:
+            continue
+
+        for metric, higher_is_better in HIGHER_IS_BETTER.items():
+            # Baselines saved before a metric was added don't have it
+            if metric not in baseline_summary:
+                continue
+
+            before, after = baseline_summary[metric], summary[metric]
+            change = (after - before) / before if before else 0.0
+            regressed = (-change if higher_is_better else change) > tolerance
+            if regressed:
+                regressions.append((name, metric))
+
+            print("{:<14}{:<28}{:>12.2f}{:>12.2f}{:>+9.1%}{}".format(
+                name, metric, before, after, change, " REGRESSED" if regressed else ""))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SMS webhooks end to end")
+    parser.add_argument("--customers", type=int, default=200, help="The number of customers per conversation")
+    parser.add_argument("--storage", choices=("memory", "dynamodb"), default="memory",
+        help="Keep items in memory, or in the DynamoDB of the config")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+        help="The fraction a metric can get worse than the baseline before it's a regression")
+    args = parser.parse_args()
+
+    configure(args.storage)
+
+    # Imported once the config is overridden
+    from decide_politics.flask import app
+    from decide_politics.transactions import router
+    from decide_politics.transactions.ack import AckBackTransaction
+    from decide_politics.transactions.transaction_manager import TransactionManager
+    from decide_politics.transactions.welcome import WelcomeTransaction
+
+    # Mock Twilio logs every message it sends
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Random phone numbers, so that runs against a persistent DynamoDB don't find earlier customers
+    phone_numbers = ("+1555{:07d}".format(i) for i in itertools.count(random.randrange(10**7 - 10**6)))
+    benchmark = PipelineBenchmark(app, args.storage, phone_numbers)
+
+    results = collections.OrderedDict([
+        ("created_at", datetime.datetime.utcnow().isoformat() + "Z"),
+        ("python", platform.python_version()),
+        ("storage", args.storage),
+        ("customers", args.customers),
+        ("conversations", collections.OrderedDict()),
+    ])
+
+    # The ack transaction has no command, so it's only routed to by the customers placed in it
+    with patch.object(TransactionManager, "ROUTER", router.CommandRouter([WelcomeTransaction(), AckBackTransaction()])):
+        print("{:<14}{:>10}{:>12}{:>10}{:>10}{:>10}{:>14}{:>14}{:>14}".format(
+            "conversation", "messages", "msgs/s", "p50 ms", "p95 ms", "p99 ms", "calls/msg", "peak KB/msg",
+            "blocks/msg"))
+        for conversation in CONVERSATIONS:
+            # Warm up the code paths, then time without tracing, then trace the allocations
+            benchmark.run(conversation, min(20, args.customers))
+            latencies, calls, _, _ = benchmark.run(conversation, args.customers)
+            _, _, peak_bytes, allocated_blocks = benchmark.run(
+                conversation, min(50, args.customers), trace_allocations=True)
+
+            summary = summarize(latencies, calls, peak_bytes, allocated_blocks)
+            results["conversations"][conversation.name] = summary
+            print("{:<14}{:>10}{:>12.0f}{:>10.2f}{:>10.2f}{:>10.2f}{:>14.2f}{:>14.1f}{:>14.1f}".format(
+                conversation.name,
+                summary["messages"],
+                summary["throughput_per_second"],
+                summary["latency_p50_ms"],
+                summary["latency_p95_ms"],
+                summary["latency_p99_ms"],
+                summary["storage_calls_per_message"],
+                summary["peak_bytes_per_message"] / 1024,
+                summary["allocated_blocks_per_message"],
+            ))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("\nSaved the results to {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,21 @@
-import boto.dynamodb2.exceptions as dynamo_exceptions
 import boto.dynamodb2.table as dynamo_table
+import collections
 import copy
 
 import jsonpickle
 
+import base64
 import json
 import time
 import uuid
 
+import shared.cache as cache
+import shared.capacity as capacity
 import shared.common as common
 import shared.config as config
 import shared.service as service
 import shared.version as version
+import decide_politics.core.storage as storage
 
 from shared.common import Errors, DecidePoliticsException
 
@@ -25,27 +29,119 @@ table_prefix = config.store["dynamodb"]["table_prefix"]
 class TableNames:
     CUSTOMERS       = table_prefix + "DecidePolitics_Customers"
     VOTES           = table_prefix + "DecidePolitics_Votes"
+    VOTE_TALLIES    = table_prefix + "DecidePolitics_VoteTallies"
+    PHONE_NUMBER_CLAIMS = table_prefix + "DecidePolitics_PhoneNumberClaims"
 
 # Tables
 customers       = dynamo_table.Table(TableNames.CUSTOMERS,       connection=service.dynamodb)
 votes           = dynamo_table.Table(TableNames.VOTES,           connection=service.dynamodb)
+vote_tallies    = dynamo_table.Table(TableNames.VOTE_TALLIES,    connection=service.dynamodb)
+phone_number_claims = dynamo_table.Table(TableNames.PHONE_NUMBER_CLAIMS, connection=service.dynamodb)
 
 # Use boolean for the tables
 customers.use_boolean()
 votes.use_boolean()
+vote_tallies.use_boolean()
+phone_number_claims.use_boolean()
+
+# The keys of each table, for engines that don't get them from dynamodb
+SCHEMAS = {
+    TableNames.CUSTOMERS: storage.TableSchema("uuid", None, {"phone_number-index": ("phone_number", None)}),
+    TableNames.VOTES: storage.TableSchema("customer_uuid", "bill_id", {"bill_id-index": ("bill_id", None)}),
+    TableNames.VOTE_TALLIES: storage.TableSchema("bill_id", "scope", {}),
+    TableNames.PHONE_NUMBER_CLAIMS: storage.TableSchema("phone_number", None, {}),
+}
+
+# Global storage engine the models read and write through. Initialized at bottom
+engine = None
+
+
+class ModelCache:
+    """Read-through cache of item snapshots keyed by primary key and by secondary fields
+
+    The cache stores shallow copies of the item data, so models handed out by the cache can be
+    mutated freely without affecting the cached snapshot. Secondary fields (e.g. phone number)
+    map to the primary key and are verified against the snapshot on lookup.
+    """
+    def __init__(self, key_field, index_fields=(), max_size=10000, ttl=300):
+        self.key_field = key_field
+        self.items = cache.LRUCache(max_size, ttl=ttl)
+        self.indexes = {field: cache.LRUCache(max_size, ttl=ttl) for field in index_fields}
+
+    def get(self, key):
+        snapshot = self.items.get(key)
+        return dict(snapshot) if snapshot is not None else None
+
+    def get_by(self, field, value):
+        key = self.indexes[field].get(value)
+        if key is None:
+            return None
+
+        snapshot = self.get(key)
+
+        # The index entry can outlive a change to the field it indexes
+        if snapshot is None or snapshot.get(field) != value:
+            self.indexes[field].pop(value)
+            return None
+
+        return snapshot
+
+    def put(self, data):
+        key = data.get(self.key_field)
+        if key is None:
+            return
+
+        self.items.put(key, dict(data))
+        for field, index in self.indexes.items():
+            if data.get(field) is not None:
+                index.put(data[field], key)
+
+    def invalidate(self, data):
+        self.items.pop(data.get(self.key_field))
+        for field, index in self.indexes.items():
+            index.pop(data.get(field))
+
+    def clear(self):
+        self.items.clear()
+        for index in self.indexes.values():
+            index.clear()
+
+    def stats(self):
+        stats = self.items.stats()
+        for field, index in self.indexes.items():
+            stats[field + "_index"] = index.stats()
+
+        return stats
 
 
 # Base class for all object models
 class Model:
+    # Subclasses may set a `ModelCache` to serve reads without a round trip to dynamodb
+    CACHE = None
+
+    # Maps the name of each secondary index to its key fields
+    INDEX_KEYS = {}
+
+    # Batch request limits imposed by dynamodb
+    MAX_BATCH_GET = 100
+    MAX_BATCH_WRITE = 25
+    MAX_BATCH_RETRIES = 8
+
     def __init__(self, item):
         if not self._atts_are_valid(item._data):
             raise DecidePoliticsException(Errors.INVALID_DATA_PRESENT)
 
         self.item = item
-        self.HANDLERS.migrate_forward_item(item)
+
+        # Attributes that differ from what is stored in dynamodb. Every attribute of an item that
+        # was never loaded from dynamodb is unsaved
+        self._dirty_keys = set() if item._loaded else set(item.keys())
+
+        self.HANDLERS.migrate_forward_item(self)
 
     # Factory methods
     @classmethod
+    @capacity.model_operation
     def load_from_db(cls, primary_key, range_key=None, consistent=True):
         """Load an ite from dynamodb
 
@@ -64,30 +160,218 @@ class Model:
         if primary_key is None:
             return None
 
-        item = None
-        try:
-            full_key = {}
-
-            # If there is a range_key for this item, then one must be passed in
-            if ("RANGE_KEY" in cls.__dict__) != (range_key is not None):
-                raise DecidePoliticsException(Errors.DATA_NOT_PRESENT)
-            elif range_key != None:
-                # Now it is safe to set the range key if there is one
-                full_key[cls.RANGE_KEY] = range_key
-
-            full_key[cls.KEY] = primary_key
-            item = cls(cls.TABLE.get_item(consistent=consistent, **full_key))
-
-            # Migrate the item forward if it is on an old version
-            if item["version"] <= cls.VERSION:
-                cls.HANDLERS.migrate_forward_item(item)
-                if not item.save():
-                    raise DecidePoliticsException(Errors.CONSISTENCY_ERROR)
-        except dynamo_exceptions.ItemNotFound:
+        # Only hash key models are cached
+        if cls.CACHE is not None and range_key is None:
+            cached_data = cls.CACHE.get(primary_key)
+            if cached_data is not None:
+                return cls.load_from_cache_data(cached_data)
+
+        full_key = {}
+
+        # If there is a range_key for this item, then one must be passed in
+        if ("RANGE_KEY" in cls.__dict__) != (range_key is not None):
+            raise DecidePoliticsException(Errors.DATA_NOT_PRESENT)
+        elif range_key != None:
+            # Now it is safe to set the range key if there is one
+            full_key[cls.RANGE_KEY] = range_key
+
+        full_key[cls.KEY] = primary_key
+        data = engine.get_item(cls.TABLE_NAME, full_key, consistent=consistent)
+        if data is None:
             raise DecidePoliticsException(cls.ITEM_NOT_FOUND_EX)
+        item = cls.load_from_storage_data(data)
+
+        # Migrate the item forward if it is on an old version
+        if item["version"] <= cls.VERSION:
+            cls.HANDLERS.migrate_forward_item(item)
+            if not item.save():
+                raise DecidePoliticsException(Errors.CONSISTENCY_ERROR)
+
+        item._cache_put()
 
         return item
 
+    @classmethod
+    @capacity.model_operation
+    def batch_load(cls, keys, consistent=False):
+        """Load many items from dynamodb using as few BatchGetItem requests as possible
+
+        Items are migrated forward like in `load_from_db`, but the migrated items are not saved
+        until the next call to `save`.
+
+        :param keys: The primary keys, or (primary key, range key) tuples for models with a range key
+        :param bool consistent: (Optional) Whether or not the reads should be consistent
+
+        :returns: A list of instances of `cls` for the keys that exist, in no particular order
+        """
+        models = []
+        pending_keys = {}
+        for key in keys:
+            key = cls._key_to_dict(key)
+
+            # Only hash key models are cached
+            cached_data = cls.CACHE.get(key[cls.KEY]) if cls.CACHE is not None else None
+            if cached_data is not None:
+                models.append(cls.load_from_cache_data(cached_data))
+            else:
+                # Dynamodb rejects requests that contain the same key twice
+                pending_keys[tuple(sorted(key.items()))] = key
+
+        pending_keys = list(pending_keys.values())
+        for i in range(0, len(pending_keys), cls.MAX_BATCH_GET):
+            request_keys = pending_keys[i : i + cls.MAX_BATCH_GET]
+
+            attempt = 0
+            while request_keys:
+                # The keys that were throttled are returned to be retried
+                items, request_keys = engine.batch_get(cls.TABLE_NAME, request_keys, consistent=consistent)
+
+                for data in items:
+                    model = cls.load_from_storage_data(data)
+                    model._cache_put()
+                    models.append(model)
+
+                if request_keys:
+                    cls._wait_before_retry(attempt)
+                    attempt += 1
+
+        return models
+
+    @classmethod
+    def query(cls, index=None, attributes=None, cursor=None, page_size=100, **filter_kwargs):
+        """Stream the items matching a key condition, reading one page at a time
+
+        Only the current page is held in memory. Resume a stream where it stopped by passing the
+        `get_cursor` of the last item consumed.
+
+        Example:
+            for vote in Votes.query(customer_uuid__eq=customer_uuid):
+                ...
+
+        :param str index: (Optional) The secondary index to query
+        :param attributes: (Optional) The attributes to read, the key and version are always read
+        :param str cursor: (Optional) The cursor of the last item of a previous query
+        :param int page_size: The number of items per request
+        :param filter_kwargs: The key conditions, e.g. bill_id__eq="hr1-114"
+
+        :returns: A generator of instances of `cls`
+        """
+        if attributes is not None:
+            attributes = list(set(attributes) | set(cls._index_key_fields(index)) | {"version"})
+
+        return cls._query_items(index, attributes, cls._decode_cursor(cursor), page_size, filter_kwargs)
+
+    @classmethod
+    def _query_items(cls, index, attributes, start_key, page_size, filter_kwargs):
+        while True:
+            with capacity.tracker.operation(cls.__name__, "query"):
+                page = engine.query(
+                    cls.TABLE_NAME,
+                    index=index,
+                    start_key=start_key,
+                    limit=page_size,
+                    attributes=attributes,
+                    **filter_kwargs
+                )
+            for data in page.items:
+                yield cls.load_from_storage_data(data)
+
+            start_key = page.last_key
+            if not start_key:
+                return
+
+    @classmethod
+    def scan_pages(cls, segment=None, total_segments=None, attributes=None, start_key=None, page_size=None,
+            **filter_kwargs):
+        """Scan the table, or one segment of a parallel scan, one page at a time
+
+        :param int segment: (Optional) The segment to scan, from 0 to `total_segments` - 1
+        :param int total_segments: (Optional) The number of segments of a parallel scan
+        :param attributes: (Optional) The attributes to read, the key and version are always read
+        :param dict start_key: (Optional) The last key of a previous page, to resume the scan
+        :param int page_size: (Optional) The number of items to read per request
+        :param filter_kwargs: Scan filters, e.g. zip_code__in=["94110"]
+
+        :returns: A generator of (instances of `cls`, the key to resume the scan after the page)
+            tuples. The last page's key is None
+        """
+        if attributes is not None:
+            attributes = list(set(attributes) | set(cls._index_key_fields()) | {"version"})
+
+        while True:
+            with capacity.tracker.operation(cls.__name__, "scan_pages"):
+                page = engine.scan(
+                    cls.TABLE_NAME,
+                    segment=segment,
+                    total_segments=total_segments,
+                    start_key=start_key,
+                    limit=page_size,
+                    attributes=attributes,
+                    **filter_kwargs
+                )
+            start_key = page.last_key
+            yield ([cls.load_from_storage_data(data) for data in page.items], start_key)
+
+            if not start_key:
+                return
+
+    def get_cursor(self, index=None):
+        """Returns an opaque cursor that resumes a query of `index` after this item"""
+        key = {field: self.item[field] for field in self._index_key_fields(index)}
+        return base64.urlsafe_b64encode(json.dumps(key, sort_keys=True).encode("utf-8")).decode("ascii")
+
+    @classmethod
+    def _decode_cursor(cls, cursor):
+        if cursor is None:
+            return None
+
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        except ValueError:
+            raise DecidePoliticsException(Errors.INVALID_DATA_PRESENT)
+
+    @classmethod
+    def _index_key_fields(cls, index=None):
+        """The fields of a page's last evaluated key: the item key plus the index's keys"""
+        fields = [cls.KEY, cls.RANGE_KEY] if cls.has_range_key() else [cls.KEY]
+        for field in cls.INDEX_KEYS.get(index, ()):
+            if field not in fields:
+                fields.append(field)
+
+        return fields
+
+    @classmethod
+    def batch_writer(cls):
+        """Returns a context manager that groups puts and deletes into BatchWriteItem requests
+
+        Example:
+            with Customer.batch_writer() as batch:
+                batch.put(customer)
+                batch.delete(other_customer)
+        """
+        return BatchWriter(cls)
+
+    @classmethod
+    def has_range_key(cls):
+        return "RANGE_KEY" in cls.__dict__
+
+    @classmethod
+    def _key_to_dict(cls, key):
+        if isinstance(key, dict):
+            return key
+        elif cls.has_range_key():
+            primary_key, range_key = key
+            return {cls.KEY: primary_key, cls.RANGE_KEY: range_key}
+
+        return {cls.KEY: key}
+
+    @classmethod
+    def _wait_before_retry(cls, attempt):
+        if attempt >= cls.MAX_BATCH_RETRIES:
+            raise DecidePoliticsException(Errors.BATCH_INCOMPLETE)
+
+        time.sleep(common.exponential_backoff(attempt))
+
     @classmethod
     def load_from_data(cls, data):
         if not issubclass(cls, Model):
@@ -95,6 +379,21 @@ class Model:
 
         return cls(dynamo_table.Item(cls.TABLE, data))
 
+    @classmethod
+    def load_from_storage_data(cls, data):
+        """Instantiate a model from an item read from the storage engine, which the model now owns"""
+        item = dynamo_table.Item(cls.TABLE, data)
+        item._loaded = True
+        # Attribute values are scalars, so a shallow copy is enough to diff against
+        item._orig_data = dict(data)
+
+        return cls(item)
+
+    @classmethod
+    def load_from_cache_data(cls, data):
+        """Instantiate a model from a cached snapshot of an item that exists in dynamodb"""
+        return cls(dynamo_table.Item(cls.TABLE, data, loaded=True))
+
     # Attribute access
     def __getitem__(self, key):
         return self.item[key]
@@ -105,6 +404,7 @@ class Model:
     def __setitem__(self, key, val):
         if key in self.VALID_KEYS:
             self.item[key] = val
+            self._dirty_keys.add(key)
         else:
             raise ValueError("Attribute %s is not valid." % key)
 
@@ -123,6 +423,31 @@ class Model:
 
         return True
 
+    def get_key(self):
+        """Returns the primary key (and range key if there is one) of this item"""
+        key = {self.KEY: self.item[self.KEY]}
+        if self.has_range_key():
+            key[self.RANGE_KEY] = self.item[self.RANGE_KEY]
+
+        return key
+
+    def needs_save(self):
+        return len(self._dirty_keys) > 0
+
+    def _mark_clean(self, keys):
+        """Record that the given attributes now match what is stored in dynamodb
+
+        NOTE that attribute values are scalars, so no copy of the value is needed
+        """
+        orig_data = self.item._orig_data
+        for key in keys:
+            if self.item._is_storable(self.item[key]):
+                orig_data[key] = self.item[key]
+            else:
+                orig_data.pop(key, None)
+
+        self._dirty_keys.difference_update(keys)
+
     def get_data(self, version=None):
         # Default to the latest version
         new_version = version if version is not None else self.VERSION
@@ -133,32 +458,160 @@ class Model:
 
         return data
 
+    # Cache Logic
+    def _cache_put(self):
+        if self.CACHE is not None:
+            self.CACHE.put(self.item._data)
+
+    def _cache_invalidate(self):
+        if self.CACHE is not None:
+            self.CACHE.invalidate(self.item._data)
+
+    # Storage Operations
+    def _storable_data(self):
+        return {key: val for key, val in self.item.items() if self.item._is_storable(val)}
+
+    def _build_expects(self, keys):
+        """Expect the given attributes to still hold the values last read, or to not exist"""
+        orig_data = self.item._orig_data
+        return {key: orig_data.get(key, storage.ABSENT) for key in keys}
+
+    def _put_item(self, expects):
+        engine.put_item(self.TABLE_NAME, self._storable_data(), expected=expects)
+
+    def _update_item(self, keys, expects):
+        updates = {}
+        for key in keys:
+            if self.item._is_storable(self.item[key]):
+                updates[key] = (storage.PUT, self.item[key])
+            else:
+                updates[key] = (storage.DELETE, None)
+
+        engine.update_item(self.TABLE_NAME, self.get_key(), updates, expected=expects)
+
     # Database Logic
+    @capacity.model_operation
     def save(self):
-        # Defauult dynamodb behavior returns false if no save was performed
-        if not self.item.needs_save():
+        # Only the attributes that changed are validated and written
+        dirty_keys = self._dirty_keys - set(self.get_key())
+        if not dirty_keys:
             return True
         # Don't allow empty keys to be saved
-        elif any((val == "" for val in self.get_data().values())):
+        elif any((self.item[key] == "" for key in dirty_keys)):
             raise DecidePoliticsException(Errors.INVALID_DATA_PRESENT)
 
-        if not self.item.partial_save():
+        try:
+            # Expect the attributes we change to still hold the values we last read
+            self._update_item(dirty_keys, self._build_expects(dirty_keys))
+        except storage.ConditionalCheckFailed:
+            # Our snapshot is stale, so the next read must go to dynamodb
+            self._cache_invalidate()
             raise DecidePoliticsException(Errors.CONSISTENCY_ERROR)
 
+        self._mark_clean(list(self._dirty_keys))
+        self._cache_put()
+
+        return True
+
+    @capacity.model_operation
     def create(self):
         # Don't allow empty keys to be saved
-        if any((val == "" for val in self.get_data().values())):
+        if any((val == "" for val in self.item.values())):
             raise DecidePoliticsException(Errors.INVALID_DATA_PRESENT)
 
         # Checks to make sure that the given model is valid
         self.check_validity()
 
-        if not self.item.save():
-            raise DecidePoliticsException(Errors.CONSISTENCY_ERROR)
+        # A new item expects none of its attributes to exist, so this is a conditional put that
+        # fails if an item with the same key was already written
+        try:
+            self._put_item({key: storage.ABSENT for key in self.item.keys()})
+        except storage.ConditionalCheckFailed:
+            raise DecidePoliticsException(self.ITEM_ALREADY_EXISTS_EX)
+
+        self._mark_clean(list(self.item.keys()))
+        self._cache_put()
 
+    @capacity.model_operation
     def delete(self):
-        if not self.item.delete():
-            raise DecidePoliticsException(ErrorType.CONSISTENCY_ERROR)
+        self._cache_invalidate()
+
+        engine.delete_item(self.TABLE_NAME, self.get_key())
+
+
+class BatchWriter:
+    """Buffers puts and deletes of a model class and sends them in BatchWriteItem requests
+
+    Requests are sent whenever a full batch is buffered and when the context exits without an
+    exception. A later write to the same key replaces an earlier buffered write.
+
+    NOTE that batched writes are unconditional, unlike `Model.create` and `Model.save`
+    """
+    def __init__(self, model_cls):
+        self.model_cls = model_cls
+
+        # Maps key -> (write request, model, is_delete)
+        self._pending = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def put(self, model):
+        if not isinstance(model, self.model_cls):
+            raise ValueError("Model must be an instance of %s" % self.model_cls.__name__)
+        # Don't allow empty keys to be saved
+        elif any((val == "" for val in model.item.values())):
+            raise DecidePoliticsException(Errors.INVALID_DATA_PRESENT)
+
+        elif not model.MANDATORY_KEYS <= model.item.keys():
+            raise DecidePoliticsException(Errors.MISSING_DATA)
+
+        self._add(model.get_key(), (storage.PUT_REQUEST, model._storable_data()), model, False)
+
+    def delete(self, model):
+        if not isinstance(model, self.model_cls):
+            raise ValueError("Model must be an instance of %s" % self.model_cls.__name__)
+
+        key = model.get_key()
+        self._add(key, (storage.DELETE_REQUEST, key), model, True)
+
+    def _add(self, key, write_request, model, is_delete):
+        key = tuple(sorted(key.items()))
+        self._pending.pop(key, None)
+        self._pending[key] = (write_request, model, is_delete)
+
+        if len(self._pending) >= self.model_cls.MAX_BATCH_WRITE:
+            self.flush()
+
+    def flush(self):
+        while self._pending:
+            batch = []
+            while self._pending and len(batch) < self.model_cls.MAX_BATCH_WRITE:
+                batch.append(self._pending.popitem(last=False)[1])
+
+            self._send([write_request for write_request, _, _ in batch])
+
+            for _, model, is_delete in batch:
+                if is_delete:
+                    model._cache_invalidate()
+                else:
+                    model._mark_clean(list(model.item.keys()))
+                    model._cache_put()
+
+    def _send(self, write_requests):
+        attempt = 0
+        while write_requests:
+            # The writes that were throttled are returned to be retried
+            with capacity.tracker.operation(self.model_cls.__name__, "batch_write"):
+                write_requests = engine.batch_write(self.model_cls.TABLE_NAME, write_requests)
+
+            if write_requests:
+                self.model_cls._wait_before_retry(attempt)
+                attempt += 1
 
 
 class CFields:
@@ -183,10 +636,14 @@ class Customer(Model):
     MANDATORY_KEYS = set([CFields.VERSION, CFields.PHONE_NUMBER])
     VERSION = 1
     ITEM_NOT_FOUND_EX = Errors.CUSTOMER_DOES_NOT_EXIST
+    ITEM_ALREADY_EXISTS_EX = Errors.CUSTOMER_ALREADY_EXISTS
 
     # Initialize the migration handlers
     HANDLERS = version.MigrationHandlers(VERSION)
 
+    # Customers are read on every message, so keep recently active ones in memory
+    CACHE = ModelCache(CFields.UUID, index_fields=[CFields.PHONE_NUMBER], max_size=10000, ttl=300)
+
     # Indeces
     PHONE_NUMBER_INDEX = "phone_number-index"
 
@@ -194,49 +651,166 @@ class Customer(Model):
     TRANSACTION_STATE_ID_SENTINEL = 0
     CUR_TRANSACTION_ID_SENTINEL = 0
 
+    # Each phone number is claimed by one customer with an item of the claims table, which maps
+    # the phone number -> the uuid of the customer. Without transactional writes in boto, the claim
+    # and the customer are two writes, see `create`
+    CLAIMS_TABLE_NAME = TableNames.PHONE_NUMBER_CLAIMS
+    CLAIM_CUSTOMER_UUID = "customer_uuid"
+
     def __init__(self, item):
         super().__init__(item)
 
     @classmethod
     def create_new(cls, attributes={}):
         # Default Values
+        # The uuid identifies the customer on the web endpoints, so it must stay unguessable
         attributes[CFields.UUID] = common.get_uuid()
         attributes[CFields.VERSION] = Customer.VERSION
 
         return cls.load_from_data(attributes)
 
     @classmethod
+    @capacity.model_operation
+    def get_claimed_uuid(cls, phone_number):
+        """Returns the uuid of the customer that claimed a phone number, None when it's unclaimed"""
+        claim = engine.get_item(cls.CLAIMS_TABLE_NAME, {CFields.PHONE_NUMBER: phone_number}, consistent=True)
+        return claim[cls.CLAIM_CUSTOMER_UUID] if claim is not None else None
+
+    @classmethod
+    @capacity.model_operation
+    def claim_phone_number(cls, phone_number, customer_uuid):
+        """Claims a phone number for a customer with a conditional put
+
+        :returns: Whether or not the customer holds the claim, which it does when it claimed the
+            phone number before (e.g. when its `create` is retried)
+        """
+        try:
+            engine.put_item(cls.CLAIMS_TABLE_NAME, {
+                CFields.PHONE_NUMBER: phone_number,
+                cls.CLAIM_CUSTOMER_UUID: customer_uuid,
+            }, expected={CFields.PHONE_NUMBER: storage.ABSENT})
+        except storage.ConditionalCheckFailed:
+            return cls.get_claimed_uuid(phone_number) == customer_uuid
+
+        return True
+
+    @classmethod
+    def get_or_create_by_phone_number(cls, phone_number):
+        """Retrieve the customer with the given phone number, creating them if necessary
+
+        :param str phone_number: The customer's phone number
+
+        :returns: (The customer, Whether or not the customer was created)
+        :rtype: (Customer, bool)
+        """
+        customer = cls.get_customer_by_phone_number(phone_number)
+        if customer is not None:
+            return (customer, False)
+
+        customer = cls.create_new({
+            CFields.PHONE_NUMBER: phone_number,
+        })
+
+        try:
+            customer.create()
+            return (customer, True)
+        except DecidePoliticsException as e:
+            if e.error_type is not Errors.CUSTOMER_ALREADY_EXISTS:
+                raise
+
+        # Lost the race against a concurrent first message, use the customer that claimed the number
+        claimed_uuid = cls.get_claimed_uuid(phone_number)
+        if claimed_uuid is None:
+            # The customer was deleted in the meantime
+            raise DecidePoliticsException(Errors.CONSISTENCY_ERROR)
+
+        try:
+            return (cls.load_from_db(claimed_uuid), False)
+        except DecidePoliticsException as e:
+            if e.error_type is not Errors.CUSTOMER_DOES_NOT_EXIST:
+                raise
+
+        # The claiming customer isn't written yet, or its write failed. Either way it's written
+        # once under the claimed uuid, by whichever request gets there first
+        customer[CFields.UUID] = claimed_uuid
+        try:
+            customer.create()
+            return (customer, True)
+        except DecidePoliticsException as e:
+            if e.error_type is not Errors.CUSTOMER_ALREADY_EXISTS:
+                raise
+
+        return (cls.load_from_db(claimed_uuid), False)
+
+    @classmethod
+    @capacity.model_operation
     def get_customer_by_phone_number(cls, phone_number):
-        query_result = list(common.convert_query(cls,
-            customers.query(
-                index=cls.PHONE_NUMBER_INDEX,
-                phone_number__eq=phone_number,
-            )
-        ))
+        cached_data = cls.CACHE.get_by(CFields.PHONE_NUMBER, phone_number)
+        if cached_data is not None:
+            return cls.load_from_cache_data(cached_data)
+
+        query_result = [cls.load_from_storage_data(data) for data in engine.query(
+            cls.TABLE_NAME,
+            index=cls.PHONE_NUMBER_INDEX,
+            phone_number__eq=phone_number,
+        ).items]
 
         # Sanity check that should never actually happen
         if len(query_result) > 1:
             raise Exception("Invalid state: database contains multiple customers")
+        elif len(query_result) == 0:
+            return None
 
-        return query_result[0] if len(query_result) == 1 else None
+        customer = query_result[0]
+        customer._cache_put()
 
-    def check_validity(self):
-        if not self.MANDATORY_KEYS <= set(self.get_data()):
-            raise DecidePoliticsException(Errors.MISSING_DATA)
+        return customer
+
+    @capacity.model_operation
+    def create(self):
+        """Claims the customer's phone number, then writes the customer
+
+        Raises CUSTOMER_ALREADY_EXISTS when another customer claimed the phone number. A claim
+        whose customer was never written is taken over by `get_or_create_by_phone_number`.
+        """
+        self.check_validity()
 
-        # Check to that there is no existing customer with this phone_number
-        if self.get_customer_by_phone_number(self[CFields.PHONE_NUMBER]) is not None:
+        if not self.claim_phone_number(self[CFields.PHONE_NUMBER], self[CFields.UUID]):
             raise DecidePoliticsException(Errors.CUSTOMER_ALREADY_EXISTS)
 
+        super().create()
+
+    @capacity.model_operation
+    def delete(self):
+        super().delete()
+
+        # Release the phone number, unless it was claimed by another customer since
+        try:
+            engine.delete_item(self.CLAIMS_TABLE_NAME, {CFields.PHONE_NUMBER: self[CFields.PHONE_NUMBER]},
+                expected={self.CLAIM_CUSTOMER_UUID: self[CFields.UUID]})
+        except storage.ConditionalCheckFailed:
+            pass
+
+    def check_validity(self):
+        if not self.MANDATORY_KEYS <= self.item.keys():
+            raise DecidePoliticsException(Errors.MISSING_DATA)
+
 
 class VFields:
     BILL_ID = "bill_id"
     CUSTOMER_UUID = "customer_uuid"
     VERSION = "version"
     VOTE_RESULT = "vote_result"
+    # The customer's zip code when they first voted, so changed votes are tallied in the same place
+    ZIP_CODE = "zip_code"
 
 
 class Votes(Model):
+    """A customer's vote on a bill
+
+    `create` and `save` keep the tallies of `decide_politics.logic.tallies` up to date. Batched
+    writes don't, so their writer updates the tallies, see `decide_politics.logic.vote_writer`.
+    """
     FIELDS = VFields
     VALID_KEYS = set([getattr(VFields, attr) for attr in vars(VFields)
         if not attr.startswith("__")])
@@ -247,6 +821,11 @@ class Votes(Model):
     MANDATORY_KEYS = set([VFields.CUSTOMER_UUID, VFields.BILL_ID, VFields.VOTE_RESULT])
     VERSION = 1
     ITEM_NOT_FOUND_EX = Errors.VOTE_DOES_NOT_EXIST
+    ITEM_ALREADY_EXISTS_EX = Errors.VOTE_ALREADY_EXISTS
+
+    # Global secondary index to look up votes by bill
+    BILL_INDEX = "bill_id-index"
+    INDEX_KEYS = {BILL_INDEX: [VFields.BILL_ID]}
 
     # Initialize the migration handlers
     HANDLERS = version.MigrationHandlers(VERSION)
@@ -262,5 +841,61 @@ class Votes(Model):
         return cls.load_from_data(attributes)
 
     def check_validity(self):
-        if self.MANDATORY_KEYS <= set(self.get_data()):
+        if not self.MANDATORY_KEYS <= self.item.keys():
             raise DecidePoliticsException(Errors.MISSING_DATA)
+
+    @capacity.model_operation
+    def create(self):
+        """Writes the vote if it doesn't exist yet, and counts it in the bill's tallies"""
+        super().create()
+        self._count_in_tallies(None)
+
+    @capacity.model_operation
+    def save(self):
+        """Writes the changed attributes, and moves the vote's count when its result changed
+
+        The update expects the result that was last read, so of two concurrent changes to a vote
+        only one is written and only it moves the count.
+        """
+        previous_result = self.item._orig_data.get(VFields.VOTE_RESULT)
+        result_changed = VFields.VOTE_RESULT in self._dirty_keys and self[VFields.VOTE_RESULT] != previous_result
+
+        super().save()
+        if result_changed:
+            self._count_in_tallies(previous_result)
+
+        return True
+
+    def _count_in_tallies(self, previous_result):
+        # Imported here, since the tallies module imports this one
+        import decide_politics.logic.tallies as tallies
+
+        tallies.count_vote(self[VFields.BILL_ID], self.get(VFields.ZIP_CODE), previous_result,
+            self[VFields.VOTE_RESULT])
+
+    @classmethod
+    def votes_for_customer(cls, customer_uuid, attributes=None, cursor=None, page_size=100):
+        """Stream a customer's votes, ordered by bill id. See `Model.query`"""
+        return cls.query(attributes=attributes, cursor=cursor, page_size=page_size,
+            customer_uuid__eq=customer_uuid)
+
+    @classmethod
+    def votes_for_bill(cls, bill_id, attributes=None, cursor=None, page_size=100):
+        """Stream the votes on a bill from the bill index. See `Model.query`
+
+        NOTE that reads of a global secondary index are eventually consistent
+        """
+        return cls.query(index=cls.BILL_INDEX, attributes=attributes, cursor=cursor,
+            page_size=page_size, bill_id__eq=bill_id)
+
+
+def _create_storage_engine():
+    cnfg = config.store.get("storage", {})
+    if cnfg.get("engine", "dynamodb") == "memory":
+        # Nothing is persisted, for tests and load tests
+        return storage.MemoryEngine(SCHEMAS)
+
+    return storage.DynamoDBEngine({table.table_name: table
+        for table in (customers, votes, vote_tallies, phone_number_claims)})
+
+engine = _create_storage_engine()
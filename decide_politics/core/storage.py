@@ -0,0 +1,537 @@
+"""Storage engines behind `Model`
+
+An engine stores the items of named tables and exchanges them as dicts of decoded attribute
+values. `DynamoDBEngine` talks to DynamoDB through boto's tables, `MemoryEngine` keeps the tables
+in memory for tests and load tests that run without any external service.
+
+Conditions on the stored item are given as a dict of attribute -> expected value, where
+`ABSENT` expects the attribute (or the whole item) not to exist. Query conditions and scan
+filters use boto's keyword syntax, e.g. `bill_id__eq="hr1-114"` or `zip_code__in=["94110"]`.
+"""
+import bisect
+import collections
+import operator
+import threading
+import zlib
+
+import boto.dynamodb2.exceptions as dynamo_exceptions
+
+
+class _Absent:
+    def __repr__(self):
+        return "ABSENT"
+
+# Expects an attribute not to exist
+ABSENT = _Absent()
+
+# Update actions
+PUT = "PUT"
+DELETE = "DELETE"
+ADD = "ADD"
+
+# A batch write request is (PUT_REQUEST, item data) or (DELETE_REQUEST, key)
+PUT_REQUEST = "put"
+DELETE_REQUEST = "delete"
+
+Page = collections.namedtuple("Page", ["items", "last_key"])
+Page.__doc__ = """A page of a query or scan
+
+:ivar list items: The items, as dicts
+:ivar dict last_key: The key to pass as `start_key` to read the next page, None after the last page
+"""
+
+TableSchema = collections.namedtuple("TableSchema", ["hash_key", "range_key", "indexes"])
+TableSchema.__doc__ = """The keys of a table, used by `MemoryEngine`
+
+:ivar str hash_key: The hash key attribute
+:ivar str range_key: The range key attribute, None when the table only has a hash key
+:ivar dict indexes: Maps the name of each secondary index -> its (hash key, range key or None)
+"""
+
+
+class ConditionalCheckFailed(Exception):
+    """Raised when a write's expected attribute values don't match the stored item"""
+
+
+class StorageEngine:
+    """The operations `Model` needs from a store"""
+
+    def get_item(self, table_name, key, consistent=False, attributes=None):
+        """
+        :param str table_name: The table to read
+        :param dict key: The item's hash key, and range key if the table has one
+        :param bool consistent: Whether or not the read should be consistent
+        :param attributes: (Optional) The attributes to read, every attribute by default
+
+        :returns: The item, or None when it doesn't exist
+        """
+        raise NotImplementedError()
+
+    def put_item(self, table_name, data, expected=None):
+        """Writes a whole item, replacing the stored one
+
+        :raises ConditionalCheckFailed: When the stored item doesn't match `expected`
+        """
+        raise NotImplementedError()
+
+    def update_item(self, table_name, key, updates, expected=None):
+        """Changes some of an item's attributes, creating the item when it doesn't exist
+
+        :param dict updates: Maps attribute -> (PUT, value), (DELETE, None) or (ADD, number)
+
+        :raises ConditionalCheckFailed: When the stored item doesn't match `expected`
+        """
+        raise NotImplementedError()
+
+    def delete_item(self, table_name, key, expected=None):
+        """
+        :raises ConditionalCheckFailed: When the stored item doesn't match `expected`
+        """
+        raise NotImplementedError()
+
+    def query(self, table_name, index=None, start_key=None, limit=None, attributes=None, **conditions):
+        """Reads a page of the items with a hash key, ordered by range key
+
+        :param str index: (Optional) The secondary index to query
+        :param dict start_key: (Optional) The `last_key` of the previous page
+        :param int limit: (Optional) The maximum number of items in the page
+        :param attributes: (Optional) The attributes to read
+        :param conditions: The key conditions, e.g. customer_uuid__eq="..."
+
+        :returns: A `Page`
+        """
+        raise NotImplementedError()
+
+    def scan(self, table_name, segment=None, total_segments=None, start_key=None, limit=None, attributes=None,
+            **filters):
+        """Reads a page of every item of a table, or of a segment of a parallel scan
+
+        :returns: A `Page`
+        """
+        raise NotImplementedError()
+
+    def batch_get(self, table_name, keys, consistent=False):
+        """Reads many items, in one request for DynamoDB (at most 100 keys)
+
+        :returns: (The items that exist, the keys that weren't read and should be retried)
+        """
+        raise NotImplementedError()
+
+    def batch_write(self, table_name, requests):
+        """Writes and deletes many items, in one request for DynamoDB (at most 25 requests)
+
+        :param requests: (PUT_REQUEST, item data) and (DELETE_REQUEST, key) tuples
+
+        :returns: The requests that weren't processed and should be retried
+        """
+        raise NotImplementedError()
+
+    def count(self, table_name):
+        """Returns the (for DynamoDB, approximate) number of items in a table"""
+        raise NotImplementedError()
+
+    def scan_items(self, table_name, **kwargs):
+        """Streams the items of a table, one page at a time. See `scan`"""
+        start_key = None
+        while True:
+            page = self.scan(table_name, start_key=start_key, **kwargs)
+            yield from page.items
+
+            start_key = page.last_key
+            if not start_key:
+                return
+
+
+class DynamoDBEngine(StorageEngine):
+    """Stores items in DynamoDB"""
+
+    def __init__(self, tables):
+        """
+        :param dict tables: Maps table name -> boto `Table`
+        """
+        self.tables = tables
+
+    def get_item(self, table_name, key, consistent=False, attributes=None):
+        try:
+            item = self.tables[table_name].get_item(consistent=consistent, attributes=attributes, **key)
+        except dynamo_exceptions.ItemNotFound:
+            return None
+
+        return item._data
+
+    def put_item(self, table_name, data, expected=None):
+        table = self.tables[table_name]
+        try:
+            table.connection.put_item(table_name, self._encode(table, data),
+                expected=self._encode_expected(table, expected))
+        except dynamo_exceptions.ConditionalCheckFailedException:
+            raise ConditionalCheckFailed()
+
+    def update_item(self, table_name, key, updates, expected=None):
+        table = self.tables[table_name]
+        encode = table._dynamizer.encode
+
+        attribute_updates = {}
+        for field, (action, value) in updates.items():
+            attribute_updates[field] = {"Action": action} if action == DELETE \
+                else {"Action": action, "Value": encode(value)}
+
+        try:
+            table.connection.update_item(table_name, self._encode(table, key), attribute_updates,
+                expected=self._encode_expected(table, expected))
+        except dynamo_exceptions.ConditionalCheckFailedException:
+            raise ConditionalCheckFailed()
+
+    def delete_item(self, table_name, key, expected=None):
+        table = self.tables[table_name]
+        try:
+            table.connection.delete_item(table_name, self._encode(table, key),
+                expected=self._encode_expected(table, expected))
+        except dynamo_exceptions.ConditionalCheckFailedException:
+            raise ConditionalCheckFailed()
+
+    def query(self, table_name, index=None, start_key=None, limit=None, attributes=None, **conditions):
+        # boto's `ResultSet` can't start from a key, so the pages are requested directly
+        page = self.tables[table_name]._query(
+            limit=limit,
+            index=index,
+            exclusive_start_key=start_key,
+            attributes_to_get=attributes,
+            **conditions
+        )
+        return Page([item._data for item in page["results"]], page["last_key"])
+
+    def scan(self, table_name, segment=None, total_segments=None, start_key=None, limit=None, attributes=None,
+            **filters):
+        page = self.tables[table_name]._scan(
+            limit=limit,
+            exclusive_start_key=start_key,
+            segment=segment,
+            total_segments=total_segments,
+            attributes=attributes,
+            **filters
+        )
+        return Page([item._data for item in page["results"]], page["last_key"])
+
+    def batch_get(self, table_name, keys, consistent=False):
+        table = self.tables[table_name]
+        response = table.connection.batch_get_item({
+            table_name: {"Keys": [self._encode(table, key) for key in keys], "ConsistentRead": consistent},
+        })
+
+        items = [self._decode(table, raw_item) for raw_item in response.get("Responses", {}).get(table_name, [])]
+        unprocessed = response.get("UnprocessedKeys", {}).get(table_name, {}).get("Keys") or []
+
+        return (items, [self._decode(table, key) for key in unprocessed])
+
+    def batch_write(self, table_name, requests):
+        table = self.tables[table_name]
+        write_requests = []
+        for request_type, data in requests:
+            if request_type == PUT_REQUEST:
+                write_requests.append({"PutRequest": {"Item": self._encode(table, data)}})
+            else:
+                write_requests.append({"DeleteRequest": {"Key": self._encode(table, data)}})
+
+        response = table.connection.batch_write_item({table_name: write_requests})
+
+        unprocessed = []
+        for write_request in response.get("UnprocessedItems", {}).get(table_name) or []:
+            if "PutRequest" in write_request:
+                unprocessed.append((PUT_REQUEST, self._decode(table, write_request["PutRequest"]["Item"])))
+            else:
+                unprocessed.append((DELETE_REQUEST, self._decode(table, write_request["DeleteRequest"]["Key"])))
+
+        return unprocessed
+
+    def count(self, table_name):
+        return self.tables[table_name].count()
+
+    @staticmethod
+    def _encode(table, data):
+        encode = table._dynamizer.encode
+        return {field: encode(value) for field, value in data.items()}
+
+    @staticmethod
+    def _decode(table, raw_data):
+        decode = table._dynamizer.decode
+        return {field: decode(value) for field, value in raw_data.items()}
+
+    @staticmethod
+    def _encode_expected(table, expected):
+        if not expected:
+            return None
+
+        encode = table._dynamizer.encode
+        return {field: {"Exists": False} if value is ABSENT else {"Exists": True, "Value": encode(value)}
+            for field, value in expected.items()}
+
+
+def _compare(compare):
+    # Comparisons with a missing attribute are false
+    return lambda value, operand: value is not ABSENT and compare(value, operand)
+
+_OPERATORS = {
+    "eq": _compare(operator.eq),
+    "ne": operator.ne,
+    "lt": _compare(operator.lt),
+    "lte": _compare(operator.le),
+    "gt": _compare(operator.gt),
+    "gte": _compare(operator.ge),
+    "in": _compare(lambda value, operand: value in operand),
+    "between": _compare(lambda value, operand: operand[0] <= value <= operand[1]),
+    "beginswith": _compare(lambda value, operand: value.startswith(operand)),
+    "contains": _compare(operator.contains),
+    "null": lambda value, operand: value is ABSENT,
+    "nnull": lambda value, operand: value is not ABSENT,
+}
+
+
+def _parse_conditions(conditions):
+    """Returns (field, operator name, operand) tuples"""
+    parsed = []
+    for name, operand in conditions.items():
+        field, operator_name = name.rsplit("__", 1)
+        if operator_name not in _OPERATORS:
+            raise ValueError("Unsupported operator %s" % operator_name)
+        parsed.append((field, operator_name, operand))
+
+    return parsed
+
+
+def _matches(item, conditions):
+    return all(_OPERATORS[operator_name](item.get(field, ABSENT), operand)
+        for field, operator_name, operand in conditions)
+
+
+def _project(item, attributes):
+    if attributes is None:
+        return dict(item)
+
+    return {field: item[field] for field in attributes if field in item}
+
+
+class _MemoryTable:
+    """The items of a table, plus every index kept sorted for queries and scans"""
+
+    def __init__(self, schema):
+        self.schema = schema
+        # Maps key tuple -> item
+        self.items = {}
+        # Every key tuple, sorted for scans
+        self.sorted_keys = []
+
+        # Maps index name (None for the table) -> (hash key, range key)
+        self.index_keys = dict(schema.indexes)
+        self.index_keys[None] = (schema.hash_key, schema.range_key)
+        # Maps index name -> {hash value: sorted list of (range value, key tuple) or (key tuple,)}
+        self.indexes = {index: {} for index in self.index_keys}
+
+    def key_of(self, data):
+        try:
+            if self.schema.range_key is None:
+                return (data[self.schema.hash_key],)
+            return (data[self.schema.hash_key], data[self.schema.range_key])
+        except KeyError:
+            raise ValueError("Items and keys must have the table's key attributes")
+
+    def key_dict(self, key):
+        if self.schema.range_key is None:
+            return {self.schema.hash_key: key[0]}
+        return {self.schema.hash_key: key[0], self.schema.range_key: key[1]}
+
+    def sort_key(self, index, data, key):
+        """Returns the position of an item in an index, None when the index doesn't cover the item"""
+        hash_key, range_key = self.index_keys[index]
+        if hash_key not in data:
+            return None
+        elif range_key is None:
+            return (key,)
+        elif range_key not in data:
+            return None
+
+        return (data[range_key], key)
+
+    def store(self, data):
+        key = self.key_of(data)
+        previous = self.items.get(key)
+        if previous is None:
+            bisect.insort(self.sorted_keys, key)
+        else:
+            self._unindex(previous, key)
+
+        self.items[key] = data
+        for index, entries in self.indexes.items():
+            sort_key = self.sort_key(index, data, key)
+            if sort_key is not None:
+                bisect.insort(entries.setdefault(data[self.index_keys[index][0]], []), sort_key)
+
+    def remove(self, key):
+        previous = self.items.pop(key, None)
+        if previous is None:
+            return
+
+        del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+        self._unindex(previous, key)
+
+    def _unindex(self, data, key):
+        for index, entries in self.indexes.items():
+            sort_key = self.sort_key(index, data, key)
+            if sort_key is None:
+                continue
+
+            hash_value = data[self.index_keys[index][0]]
+            sort_keys = entries[hash_value]
+            del sort_keys[bisect.bisect_left(sort_keys, sort_key)]
+            if not sort_keys:
+                del entries[hash_value]
+
+
+class MemoryEngine(StorageEngine):
+    """Stores items in memory, for tests and load tests. Thread safe
+
+    Queries and scans page through sorted indexes like DynamoDB does: a query reads the items of a
+    hash key in range key order, a scan reads the items in key order, and `limit` caps the items
+    read before the scan filters are applied. Reads are always consistent.
+    """
+
+    def __init__(self, schemas):
+        """
+        :param dict schemas: Maps table name -> `TableSchema`
+        """
+        self.tables = {table_name: _MemoryTable(schema) for table_name, schema in schemas.items()}
+        self._lock = threading.Lock()
+
+    def get_item(self, table_name, key, consistent=False, attributes=None):
+        table = self.tables[table_name]
+        with self._lock:
+            item = table.items.get(table.key_of(key))
+            return _project(item, attributes) if item is not None else None
+
+    def put_item(self, table_name, data, expected=None):
+        table = self.tables[table_name]
+        with self._lock:
+            self._check(table.items.get(table.key_of(data)), expected)
+            table.store(dict(data))
+
+    def update_item(self, table_name, key, updates, expected=None):
+        table = self.tables[table_name]
+        with self._lock:
+            previous = table.items.get(table.key_of(key))
+            self._check(previous, expected)
+
+            item = dict(previous) if previous is not None else dict(key)
+            for field, (action, value) in updates.items():
+                if action == PUT:
+                    item[field] = value
+                elif action == DELETE:
+                    item.pop(field, None)
+                elif action == ADD:
+                    item[field] = item.get(field, 0) + value
+                else:
+                    raise ValueError("Unsupported update action %s" % action)
+
+            table.store(item)
+
+    def delete_item(self, table_name, key, expected=None):
+        table = self.tables[table_name]
+        with self._lock:
+            key = table.key_of(key)
+            self._check(table.items.get(key), expected)
+            table.remove(key)
+
+    def query(self, table_name, index=None, start_key=None, limit=None, attributes=None, **conditions):
+        table = self.tables[table_name]
+        hash_key, range_key = table.index_keys[index]
+        conditions = _parse_conditions(conditions)
+
+        hash_conditions = [operand for field, operator_name, operand in conditions
+            if field == hash_key and operator_name == "eq"]
+        if not hash_conditions:
+            raise ValueError("Queries need an equality condition on %s" % hash_key)
+
+        with self._lock:
+            sort_keys = table.indexes[index].get(hash_conditions[0], [])
+
+            position = 0
+            if start_key:
+                position = bisect.bisect_right(sort_keys, table.sort_key(index, start_key, table.key_of(start_key)))
+            first = position
+
+            items = []
+            last = None
+            while position < len(sort_keys) and (limit is None or position - first < limit):
+                last = table.items[sort_keys[position][-1]]
+                position += 1
+                if _matches(last, conditions):
+                    items.append(_project(last, attributes))
+
+            last_key = None
+            if position < len(sort_keys) and last is not None:
+                last_key = table.key_dict(table.key_of(last))
+                for field in table.index_keys[index]:
+                    if field is not None:
+                        last_key[field] = last[field]
+
+        return Page(items, last_key)
+
+    def scan(self, table_name, segment=None, total_segments=None, start_key=None, limit=None, attributes=None,
+            **filters):
+        table = self.tables[table_name]
+        filters = _parse_conditions(filters)
+
+        with self._lock:
+            keys = table.sorted_keys
+            position = bisect.bisect_right(keys, table.key_of(start_key)) if start_key else 0
+
+            items = []
+            read = 0
+            last = None
+            while position < len(keys) and (limit is None or read < limit):
+                key = keys[position]
+                position += 1
+                if total_segments and self._segment_of(key, total_segments) != segment:
+                    continue
+
+                read += 1
+                last = key
+                item = table.items[key]
+                if _matches(item, filters):
+                    items.append(_project(item, attributes))
+
+        # Like DynamoDB, a full page has a last key even when no items are left, so the last page
+        # can be empty. It saves looking ahead for the next item of the segment
+        return Page(items, table.key_dict(last) if position < len(keys) and last is not None else None)
+
+    def batch_get(self, table_name, keys, consistent=False):
+        items = []
+        for key in keys:
+            item = self.get_item(table_name, key)
+            if item is not None:
+                items.append(item)
+
+        return (items, [])
+
+    def batch_write(self, table_name, requests):
+        for request_type, data in requests:
+            if request_type == PUT_REQUEST:
+                self.put_item(table_name, data)
+            else:
+                self.delete_item(table_name, data)
+
+        return []
+
+    def count(self, table_name):
+        with self._lock:
+            return len(self.tables[table_name].items)
+
+    @staticmethod
+    def _check(item, expected):
+        for field, value in (expected or {}).items():
+            stored = item.get(field, ABSENT) if item is not None else ABSENT
+            if value is ABSENT and stored is not ABSENT or value is not ABSENT and stored != value:
+                raise ConditionalCheckFailed()
+
+    @staticmethod
+    def _segment_of(key, total_segments):
+        return zlib.crc32(repr(key[0]).encode("utf-8")) % total_segments
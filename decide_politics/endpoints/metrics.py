@@ -0,0 +1,47 @@
+from decide_politics.flask import app
+
+import flask
+
+import decide_politics.logic.pipeline as pipeline
+import decide_politics.logic.vote_writer as vote_writer
+import shared.metrics as metrics
+import shared.outbound as outbound
+import shared.profiler as profiler
+import shared.sender_pool as sender_pool
+import shared.service as service
+from decide_politics.core.models import Customer
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Request latencies, dependency calls and component stats in the Prometheus text format"""
+    return flask.Response(metrics.registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def _register_stats_sources():
+    metrics.registry.register_stats("customer_cache", Customer.CACHE.stats)
+
+    # The SMS sender is wrapped by the dispatcher and the sender pool when they're enabled
+    sender = service.twilio
+    if isinstance(sender, outbound.OutboundDispatcher):
+        metrics.registry.register_stats("outbound_dispatcher", sender.stats)
+        sender = sender.sender
+    if isinstance(sender, sender_pool.SenderPool):
+        metrics.registry.register_stats("sender_pool", sender.stats)
+
+    if service.sunlight.response_cache is not None:
+        metrics.registry.register_stats("sunlight_cache", service.sunlight.response_cache.stats)
+
+    if pipeline.inbound is not None:
+        metrics.registry.register_stats("inbound_pipeline", pipeline.inbound.stats)
+
+    if profiler.profiler is not None:
+        metrics.registry.register_stats("profiler", profiler.profiler.stats)
+
+    if vote_writer.vote_writer is not None:
+        metrics.registry.register_stats("vote_writer", vote_writer.vote_writer.stats)
+
+
+_register_stats_sources()
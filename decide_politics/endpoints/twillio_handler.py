@@ -1,12 +1,13 @@
 from decide_politics.flask import app
+import decide_politics.flask as flask_app
 
 from flask import request
 import jsonpickle
 
-from decide_politics.core.models import CFields
-from decide_politics.core.models import Customer
 import decide_politics.logic.messaging as messaging
-import decide_politics.logic.customer_lifecycle as customer_lc
+import decide_politics.logic.pipeline as pipeline
+import shared.common as common
+from shared.common import Errors, DecidePoliticsException
 
 
 @app.route('/sms/handle_sms', methods=["POST"])
@@ -15,18 +16,22 @@ def handle_sms():
     customer_phone_number = request.values["From"]
     text_message_body = request.values["Body"]
 
-    # Retrieve the customer from the DB or create a new one
-    customer = Customer.get_customer_by_phone_number(customer_phone_number)
-    if not customer:
-        # Save the customer to the DB
-        customer = Customer.create_new({
-            CFields.PHONE_NUMBER: customer_phone_number,
-        })
-        customer.create()
-
-        customer_lc.on_new_customer()
-
-    messaging.on_message_recieve(customer, text_message_body)
+    if not customer_phone_number:
+        return common.error_to_json(Errors.DATA_NOT_PRESENT), 400
+
+    if pipeline.inbound is None:
+        messaging.on_sms_recieve(customer_phone_number, text_message_body)
+    else:
+        # Acknowledge Twilio right away and process the message in the background
+        try:
+            pipeline.inbound.enqueue(customer_phone_number, text_message_body,
+                request_labels=flask_app.request_labels())
+        except DecidePoliticsException as e:
+            # Twilio retries the webhook later
+            return common.error_to_json(e.error_type), 503
+
+        # The worker observes the DynamoDB calls of the message
+        flask_app.defer_request_calls()
 
     return jsonpickle.encode(dict(
         success=True
@@ -37,9 +37,7 @@ def handle_message(customer_uuid):
     data = jsonpickle.decode(request.data.decode("utf-8"))
     message_body = data["message_body"]
 
-    # Retrieve the message and create the customer
-    customer = Customer.load_from_db(customer_uuid)
-    messaging.on_message_recieve(customer, message_body)
+    messaging.on_customer_message_recieve(customer_uuid, message_body)
 
     return jsonpickle.encode(dict(
         success=True
@@ -1,10 +1,88 @@
 import flask
 import logging
+import time
+
+import shared.capacity as capacity
+import shared.metrics as metrics
+import shared.profiler as profiler
 
 app = flask.Flask(__name__)
 
 logging.getLogger().setLevel(logging.INFO)
 
+
+@app.before_request
+def _begin_request_metrics():
+    # Label by route rather than path, so that ids in the path don't each get their own metrics
+    rule = flask.request.url_rule
+    flask.g.request_endpoint = rule.rule if rule is not None else "unmatched"
+    flask.g.request_began_at = time.perf_counter()
+    flask.g.request_calls_deferred = False
+
+    metrics.registry.begin_request()
+    capacity.tracker.begin_request(flask.g.request_endpoint)
+
+    flask.g.profile_session = None
+    if profiler.profiler is not None \
+            and profiler.profiler.should_profile(flask.request.headers.get(profiler.TOKEN_HEADER)):
+        flask.g.profile_session = profiler.profiler.start(flask.g.request_endpoint)
+
+
+@app.after_request
+def _record_request_metrics(response):
+    _record_request(response.status_code)
+    return response
+
+
+@app.teardown_request
+def _record_failed_request_metrics(exception=None):
+    # An unhandled exception skips the after request hooks
+    if getattr(flask.g, "request_began_at", None) is not None:
+        _record_request(500)
+
+
+def request_labels():
+    """Returns the labels the metrics of the current request are recorded under"""
+    return (("endpoint", flask.g.request_endpoint), ("method", flask.request.method))
+
+
+def defer_request_calls():
+    """Leaves the DynamoDB calls of the current request to be observed by the code that does its
+    work in the background, e.g. the inbound pipeline, under the labels of `request_labels`
+    """
+    flask.g.request_calls_deferred = True
+
+
+def _record_request(status_code):
+    if flask.g.profile_session is not None:
+        profiler.profiler.stop(flask.g.profile_session)
+        flask.g.profile_session = None
+
+    latency = time.perf_counter() - flask.g.request_began_at
+    flask.g.request_began_at = None
+
+    labels = request_labels()
+
+    registry = metrics.registry
+    registry.observe(metrics.HTTP_REQUEST_DURATION, latency, labels)
+    registry.inc(metrics.HTTP_REQUESTS, labels + (("status", str(status_code)),))
+    calls = registry.end_request()
+    if not flask.g.request_calls_deferred:
+        registry.observe(
+            metrics.HTTP_REQUEST_DYNAMODB_CALLS,
+            calls["dynamodb"],
+            labels,
+            buckets=metrics.COUNT_BUCKETS,
+        )
+    capacity.tracker.end_request()
+
+
 import decide_politics.endpoints.general
+import decide_politics.endpoints.metrics
 import decide_politics.endpoints.twillio_handler
 import decide_politics.endpoints.web_handler
+
+from decide_politics.transactions.transaction_manager import TransactionManager
+
+# Catch messages that would be sent as UCS-2 or as several segments before they're sent
+TransactionManager.check_message_templates()
@@ -0,0 +1,376 @@
+"""Sends a message to every customer, or to the customers of some zip codes or districts
+
+    POLITI_HACK_CONFIG_PATH=config.json python3 -m decide_politics.logic.broadcast <broadcast id> <message>
+        [--zip 94110 ...] [--district CA-12 ...]
+
+Running a broadcast again with the same id resumes it from its checkpoint, and retries the sends that
+failed.
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import string
+import threading
+import time
+
+import decide_politics.core.models as models
+import shared.config as config
+import shared.outbound as outbound
+import shared.service as service
+import sunlight_api.districts as districts
+
+from decide_politics.core.models import CFields
+from decide_politics.core.models import Customer
+from shared.common import Errors, DecidePoliticsException
+
+log = logging.getLogger(__name__)
+
+
+class BroadcastCheckpoint:
+    """An append-only log of a broadcast's progress, used to resume it without double sending
+
+    Each customer is logged before the message is handed to the sender, so a customer is never
+    messaged twice, at the cost of missing the customers in flight when the process dies. A
+    scanned page is logged once every message in it was handed off, after which the customers of
+    that page are forgotten, so memory stays bounded by the page size. Sends that fail are logged
+    too, and are kept across pages until the broadcast is resumed and retries them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Maps segment -> the key to resume its scan from, None for a finished segment
+        self.start_keys = {}
+        # Maps segment -> the customers messaged since its last logged page
+        self.sent = {}
+        # Maps customer uuid -> segment, for the failed sends that weren't retried yet
+        self.failed = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            self._load()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._log = open(path, "a")
+
+    def is_done(self, segment):
+        return segment in self.start_keys and self.start_keys[segment] is None
+
+    def was_sent(self, segment, customer_uuid):
+        return customer_uuid in self.sent.get(segment, ())
+
+    def record_send(self, segment, customer_uuid):
+        with self._lock:
+            self.sent.setdefault(segment, set()).add(customer_uuid)
+            self.failed.pop(customer_uuid, None)
+        self._append({"segment": segment, "sent": customer_uuid})
+
+    def record_failure(self, segment, customer_uuid):
+        with self._lock:
+            self.sent.get(segment, set()).discard(customer_uuid)
+            self.failed[customer_uuid] = segment
+        self._append({"segment": segment, "failed": customer_uuid})
+
+    def record_skip(self, segment, customer_uuid):
+        """Forgets a failed send that won't be retried, e.g. when the customer was deleted"""
+        with self._lock:
+            self.failed.pop(customer_uuid, None)
+        self._append({"segment": segment, "skipped": customer_uuid})
+
+    def record_page(self, segment, start_key):
+        self.start_keys[segment] = start_key
+        self.sent.pop(segment, None)
+        self._append({"segment": segment, "start_key": start_key})
+
+    def close(self):
+        self._log.close()
+
+    def _append(self, entry):
+        with self._lock:
+            self._log.write(json.dumps(entry) + "\n")
+            # Reaches the OS before the message is sent, so it survives the process dying
+            self._log.flush()
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line can be cut short by a crash
+                    continue
+
+                segment = entry["segment"]
+                if "start_key" in entry:
+                    self.start_keys[segment] = entry["start_key"]
+                    self.sent.pop(segment, None)
+                elif "failed" in entry:
+                    self.sent.get(segment, set()).discard(entry["failed"])
+                    self.failed[entry["failed"]] = segment
+                elif "skipped" in entry:
+                    self.failed.pop(entry["skipped"], None)
+                else:
+                    self.sent.setdefault(segment, set()).add(entry["sent"])
+                    self.failed.pop(entry["sent"], None)
+
+
+class RatePacer:
+    """Spaces calls out so that at most `rate` happen per second, across threads"""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = self._clock()
+            wait_until = max(now, self._next_at)
+            self._next_at = wait_until + self.interval
+
+        if wait_until > now:
+            self._sleep(wait_until - now)
+
+
+class Broadcast:
+    """Streams customers with a parallel scan and sends each matching customer a message
+
+    The message is a template rendered once per distinct value of the placeholders it uses.
+    Templates can use {zip_code}, {district} and {legislators}. A customer's {district} is one of
+    the targeted districts when `district_ids` is given, and needs the district table.
+
+    Failed sends are retried when the broadcast is run again with the same id.
+
+    Example:
+        Broadcast("hr1-alert", "Vote on {district}'s bill today!", zip_codes=["94110"]).run()
+    """
+
+    ATTRIBUTES = [CFields.PHONE_NUMBER, CFields.ZIP_CODE]
+
+    def __init__(self, broadcast_id, template, zip_codes=None, district_ids=None, total_segments=8,
+            max_rate=50, page_size=100, checkpoint_dir=".", sender=None, report_interval=10):
+        """
+        :param str broadcast_id: Identifies the broadcast's checkpoint
+        :param str template: The message, see the class docstring
+        :param zip_codes: (Optional) Only message customers with these zip codes
+        :param district_ids: (Optional) Only message customers in these districts, e.g. "CA-12"
+        :param int total_segments: The number of segments scanned in parallel
+        :param float max_rate: The maximum number of messages sent per second
+        :param int page_size: The number of customers read per request
+        :param str checkpoint_dir: The directory of the checkpoint logs
+        :param sender: (Optional) The SMS service, `service.twilio` by default. Its `send_msg` must
+            raise when a message fails, so a sender that only queues messages, e.g. an
+            `outbound.OutboundDispatcher`, is replaced by the sender it wraps
+        :param float report_interval: Seconds between progress reports
+        """
+        self.broadcast_id = broadcast_id
+        self.template = template
+        self.zip_codes = list(zip_codes) if zip_codes else None
+        self.district_ids = set(district_ids) if district_ids else None
+        self.total_segments = total_segments
+        self.page_size = page_size
+        self.sender = sender if sender is not None else service.twilio
+        if isinstance(self.sender, outbound.OutboundDispatcher):
+            # The broadcast paces its own sends, and needs their failures to retry them
+            self.sender = self.sender.sender
+        self.report_interval = report_interval
+
+        self.checkpoint = BroadcastCheckpoint(os.path.join(checkpoint_dir, broadcast_id + ".checkpoint"))
+        self.pacer = RatePacer(max_rate)
+
+        # Maps the values of the template's placeholders -> rendered message
+        self._rendered = {}
+        self._placeholders = {field_name.split(".")[0].split("[")[0]
+            for _, field_name, _, _ in string.Formatter().parse(template) if field_name}
+        self._lock = threading.Lock()
+
+        self.scanned = 0
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+        self._started_at = None
+        self._reported_at = None
+        self._estimated_total = None
+
+    def run(self):
+        """Send the broadcast, resuming from the checkpoint
+
+        :returns: The progress, see `progress`
+        """
+        self._started_at = self._reported_at = time.monotonic()
+        try:
+            self._estimated_total = models.engine.count(Customer.TABLE_NAME)
+        except Exception:
+            log.exception("Failed to estimate the number of customers, no ETA will be reported")
+
+        try:
+            self._retry_failed_sends()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.total_segments) as executor:
+                segments = [segment for segment in range(self.total_segments)
+                    if not self.checkpoint.is_done(segment)]
+                # Raises the first segment's exception, if any
+                list(executor.map(self._run_segment, segments))
+        finally:
+            self.checkpoint.close()
+
+        if hasattr(self.sender, "flush"):
+            self.sender.flush()
+
+        progress = self.progress()
+        log.info("Broadcast {} done: {}".format(self.broadcast_id, progress))
+        return progress
+
+    def progress(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        scan_rate = self.scanned / elapsed if elapsed else 0.0
+
+        eta = None
+        if self._estimated_total is not None and scan_rate:
+            eta = max(0.0, (self._estimated_total - self.scanned) / scan_rate)
+
+        return dict(
+            scanned=self.scanned,
+            sent=self.sent,
+            skipped=self.skipped,
+            failed=self.failed,
+            elapsed=elapsed,
+            messages_per_second=self.sent / elapsed if elapsed else 0.0,
+            eta_seconds=eta,
+        )
+
+    def render(self, zip_code):
+        """Returns the message for customers in a zip code, or None when they aren't in the audience"""
+        district_list = districts.district_lookup.get_districts(zip_code) \
+            if districts.district_lookup is not None and zip_code else []
+        district_ids = ["{}-{}".format(state, district) for state, district in district_list]
+
+        if self.district_ids is not None and not self.district_ids.intersection(district_ids):
+            return None
+
+        targeted_ids = [district_id for district_id in district_ids
+            if self.district_ids is None or district_id in self.district_ids]
+        district = targeted_ids[0] if targeted_ids else ""
+
+        # Customers share a message when the placeholders the template uses have the same values
+        key = (
+            zip_code if "zip_code" in self._placeholders else None,
+            district if "district" in self._placeholders else None,
+            tuple(district_ids) if "legislators" in self._placeholders else None,
+        )
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            legislators = districts.district_lookup.get_legistlators(zip_code) \
+                if district_ids and "legislators" in self._placeholders else []
+            rendered = self.template.format(
+                zip_code=zip_code or "",
+                district=district,
+                legislators=", ".join("{} {}".format(l.first_name, l.last_name) for l in legislators),
+            )
+            self._rendered[key] = rendered
+
+        return rendered
+
+    def _run_segment(self, segment):
+        filters = {}
+        if self.zip_codes is not None:
+            filters["zip_code__in"] = self.zip_codes
+
+        pages = Customer.scan_pages(
+            segment=segment,
+            total_segments=self.total_segments,
+            attributes=self.ATTRIBUTES,
+            start_key=self.checkpoint.start_keys.get(segment),
+            page_size=self.page_size,
+            **filters
+        )
+        for customers, start_key in pages:
+            for customer in customers:
+                self._send(segment, customer)
+
+            self.checkpoint.record_page(segment, start_key)
+            self._report()
+
+    def _send(self, segment, customer):
+        customer_uuid = customer[CFields.UUID]
+        message = self.render(customer.get(CFields.ZIP_CODE))
+
+        with self._lock:
+            self.scanned += 1
+            if message is None or self.checkpoint.was_sent(segment, customer_uuid):
+                self.skipped += 1
+                return
+
+        self._deliver(segment, customer_uuid, customer[CFields.PHONE_NUMBER], message)
+
+    def _deliver(self, segment, customer_uuid, phone_number, message):
+        self.checkpoint.record_send(segment, customer_uuid)
+        self.pacer.wait()
+        try:
+            self.sender.send_msg(phone_number, message)
+        except Exception:
+            log.exception("Failed to send broadcast {} to {}".format(self.broadcast_id, customer_uuid))
+            self.checkpoint.record_failure(segment, customer_uuid)
+            with self._lock:
+                self.failed += 1
+        else:
+            with self._lock:
+                self.sent += 1
+
+    def _retry_failed_sends(self):
+        """Sends again to the customers whose send failed in an earlier run"""
+        for customer_uuid, segment in sorted(self.checkpoint.failed.items()):
+            try:
+                customer = Customer.load_from_db(customer_uuid)
+            except DecidePoliticsException as e:
+                if e.error_type is not Errors.CUSTOMER_DOES_NOT_EXIST:
+                    raise
+                customer = None
+
+            zip_code = customer.get(CFields.ZIP_CODE) if customer is not None else None
+            in_audience = customer is not None and (self.zip_codes is None or zip_code in self.zip_codes)
+            message = self.render(zip_code) if in_audience else None
+            if message is None:
+                self.checkpoint.record_skip(segment, customer_uuid)
+                with self._lock:
+                    self.skipped += 1
+                continue
+
+            self._deliver(segment, customer_uuid, customer[CFields.PHONE_NUMBER], message)
+
+    def _report(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._reported_at < self.report_interval:
+                return
+            self._reported_at = now
+
+        log.info("Broadcast {}: {}".format(self.broadcast_id, self.progress()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a message to every customer")
+    parser.add_argument("broadcast_id", help="Identifies the broadcast, reuse it to resume")
+    parser.add_argument("message", help="The message template, may use {zip_code}, {district} and {legislators}")
+    parser.add_argument("--zip", action="append", dest="zip_codes", help="Only message this zip code")
+    parser.add_argument("--district", action="append", dest="district_ids", help="Only message this district, e.g. CA-12")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    cnfg = config.store.get("broadcast", {})
+    Broadcast(
+        args.broadcast_id,
+        args.message,
+        zip_codes=args.zip_codes,
+        district_ids=args.district_ids,
+        total_segments=cnfg.get("total_segments", 8),
+        max_rate=cnfg.get("max_rate", 50),
+        checkpoint_dir=config.data_path(cnfg.get("checkpoint_dir", ".")),
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
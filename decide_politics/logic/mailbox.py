@@ -0,0 +1,97 @@
+import contextlib
+import threading
+
+
+class Mailbox:
+    """Serializes the messages of one customer, in the order they arrived"""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.next_ticket = 0
+        self.now_serving = 0
+        # Tickets whose wait was interrupted, e.g. by a request timeout, skipped when they're up
+        self.abandoned = set()
+        self.customer = None
+
+        # Number of messages delivered or waiting to be delivered, guarded by the registry lock
+        self.pending = 0
+
+    def advance(self):
+        """Serves the next ticket that is still waiting. Called with `condition` held"""
+        self.now_serving += 1
+        while self.now_serving in self.abandoned:
+            self.abandoned.remove(self.now_serving)
+            self.now_serving += 1
+
+        self.condition.notify_all()
+
+
+class MailboxRegistry:
+    """Per customer mailboxes that serialize message handling for a customer
+
+    Messages for one customer are handled one at a time, while different customers are handled
+    fully in parallel. A message that arrives while another message for the same customer is in
+    flight reuses the customer the in-flight message loaded, instead of reading it again. Mailboxes
+    only exist while messages are pending, so idle customers take no memory.
+
+    Example:
+        with mailboxes.deliver(customer_uuid, lambda: Customer.load_from_db(customer_uuid)) as customer:
+            TransactionManager.handle_message(customer, message_body)
+    """
+
+    def __init__(self):
+        self._mailboxes = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def deliver(self, customer_uuid, load_customer):
+        """Wait for the customer's earlier messages to be handled, then yield the customer
+
+        :param str customer_uuid: The UUID of the customer the message is for
+        :param load_customer: A function returning the `Customer`, only called when no message for
+            the customer is in flight
+        """
+        with self._lock:
+            mailbox = self._mailboxes.get(customer_uuid)
+            if mailbox is None:
+                mailbox = self._mailboxes[customer_uuid] = Mailbox()
+
+            mailbox.pending += 1
+
+        try:
+            with mailbox.condition:
+                ticket = mailbox.next_ticket
+                mailbox.next_ticket += 1
+                try:
+                    mailbox.condition.wait_for(lambda: mailbox.now_serving == ticket)
+                except BaseException:
+                    # Don't leave the later messages waiting on a ticket that is never served
+                    if mailbox.now_serving == ticket:
+                        mailbox.advance()
+                    else:
+                        mailbox.abandoned.add(ticket)
+                    raise
+
+            try:
+                if mailbox.customer is None:
+                    mailbox.customer = load_customer()
+
+                yield mailbox.customer
+            except BaseException:
+                # The customer may hold unsaved changes, so the next message must load it again
+                mailbox.customer = None
+                raise
+            finally:
+                with mailbox.condition:
+                    mailbox.advance()
+        finally:
+            with self._lock:
+                mailbox.pending -= 1
+                if mailbox.pending == 0:
+                    del self._mailboxes[customer_uuid]
+
+    def __len__(self):
+        return len(self._mailboxes)
+
+
+# Global mailboxes for all message handling
+mailboxes = MailboxRegistry()
@@ -1,7 +1,35 @@
 from decide_politics.core.models import CFields
+from decide_politics.core.models import Customer
 from decide_politics.transactions.transaction_manager import TransactionManager
+import decide_politics.logic.customer_lifecycle as customer_lc
+import decide_politics.logic.mailbox as mailbox
 import shared.service as service
 
+def on_sms_recieve(phone_number, message_body):
+    """Handler for SMS messages from a phone number, which may belong to a new customer
+
+    @param phone_number The phone number of the sender
+    @param message_body The text content of the message
+    """
+    # Retrieve the customer from the DB or create a new one
+    customer, is_new_customer = Customer.get_or_create_by_phone_number(phone_number)
+    if is_new_customer:
+        customer_lc.on_new_customer()
+
+    # Only the uuid is used: earlier messages may change the customer while this one waits in the
+    # mailbox, so it's loaded again once delivered, like messages from existing customers
+    on_customer_message_recieve(customer[CFields.UUID], message_body)
+
+def on_customer_message_recieve(customer_uuid, message_body):
+    """Handler for messages from an existing customer
+
+    @param customer_uuid The UUID of the sender
+    @param message_body The text content of the message
+    """
+    load_customer = lambda: Customer.load_from_db(customer_uuid)
+    with mailbox.mailboxes.deliver(customer_uuid, load_customer) as customer:
+        on_message_recieve(customer, message_body)
+
 def on_message_recieve(customer, message_body):
     """Handler for all recieved SMS messages
 
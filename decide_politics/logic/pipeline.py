@@ -0,0 +1,142 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+import decide_politics.logic.messaging as messaging
+import shared.config as config
+import shared.metrics as metrics
+import shared.workers as workers
+
+from shared.common import Errors, DecidePoliticsException
+
+log = logging.getLogger(__name__)
+
+# Global inbound pipeline, None when messages are processed within the request. Initialized at bottom
+inbound = None
+
+
+class InboundPipeline:
+    """Processes inbound SMS messages in the background so the webhook can answer Twilio immediately
+
+    Messages from one phone number are always handled by the same worker, in the order they were
+    received, while messages from different phone numbers are handled in parallel.
+    """
+
+    def __init__(self, handler, num_workers=8, max_queue_size=10000):
+        """
+        :param handler: The function called with (phone_number, message_body) for each message
+        :param int num_workers: The number of worker threads
+        :param int max_queue_size: The maximum number of unprocessed messages across all workers
+        """
+        self.handler = handler
+        self._pool = workers.ShardedWorkerPool(self._process, num_workers, max_queue_size, name="sms-in")
+        # Guards the counters and lag statistics, which every worker updates
+        self._lock = threading.Lock()
+
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def enqueue(self, phone_number, message_body, request_labels=None):
+        """Queue a message for processing without blocking
+
+        :param tuple request_labels: (Optional) The labels of the webhook request that received the
+            message. The DynamoDB calls made processing the message are observed under them, as
+            they would be if the request processed it
+
+        :raises DecidePoliticsException: When the queue is full
+        """
+        try:
+            self._pool.submit(phone_number, phone_number, message_body, time.monotonic(), request_labels,
+                timeout=0)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise DecidePoliticsException(Errors.INBOUND_QUEUE_FULL)
+
+        with self._lock:
+            self.received += 1
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been processed
+
+        :returns: Whether or not the queues were drained
+        """
+        return self._pool.flush(timeout)
+
+    def stop(self, timeout=None):
+        self._pool.stop(timeout)
+
+    def queue_depth(self):
+        return self._pool.queue_depth()
+
+    def stats(self):
+        with self._lock:
+            processed = self.processed + self.failed
+            counters = dict(
+                received=self.received,
+                processed=self.processed,
+                failed=self.failed,
+                rejected=self.rejected,
+                last_lag=self.last_lag,
+                max_lag=self.max_lag,
+                mean_lag=self.total_lag / processed if processed else 0.0,
+            )
+
+        return dict(queue_depth=self.queue_depth(), **counters)
+
+    def _process(self, phone_number, message_body, enqueued_at, request_labels):
+        # Time the message spent waiting in the queue
+        lag = time.monotonic() - enqueued_at
+        with self._lock:
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+
+        if request_labels is not None:
+            metrics.registry.begin_request()
+
+        try:
+            self.handler(phone_number, message_body)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            log.exception("Failed to process SMS from {}".format(phone_number))
+        else:
+            with self._lock:
+                self.processed += 1
+        finally:
+            if request_labels is not None:
+                metrics.registry.observe(
+                    metrics.HTTP_REQUEST_DYNAMODB_CALLS,
+                    metrics.registry.end_request()["dynamodb"],
+                    request_labels,
+                    buckets=metrics.COUNT_BUCKETS,
+                )
+
+
+def _create_inbound_pipeline():
+    cnfg = config.store.get("inbound_pipeline", {})
+    if not cnfg.get("enabled", False):
+        return None
+
+    log.info("Processing inbound SMS messages in {} background workers".format(cnfg["num_workers"]))
+    pipeline = InboundPipeline(
+        messaging.on_sms_recieve,
+        num_workers=cnfg["num_workers"],
+        max_queue_size=cnfg["max_queue_size"],
+    )
+
+    # Finish the accepted messages on shutdown
+    atexit.register(pipeline.stop, timeout=cnfg.get("shutdown_timeout", 10))
+
+    return pipeline
+
+
+inbound = _create_inbound_pipeline()
@@ -0,0 +1,223 @@
+"""Per bill vote counts, kept up to date as votes are recorded
+
+Rebuild every tally from the votes table with:
+
+    POLITI_HACK_CONFIG_PATH=config.json python3 -m decide_politics.logic.tallies [--segments 8]
+"""
+import argparse
+import boto.exception
+import collections
+import concurrent.futures
+import logging
+import time
+
+import decide_politics.core.models as models
+import decide_politics.core.storage as storage
+import shared.common as common
+import sunlight_api.districts as districts
+
+from decide_politics.core.models import VFields
+from shared.common import Errors, DecidePoliticsException
+
+log = logging.getLogger(__name__)
+
+class TFields:
+    BILL_ID = "bill_id"
+    # What the counts cover: every vote, a zip code or a congressional district
+    SCOPE = "scope"
+
+# Each vote result is counted in an attribute named COUNT_PREFIX + vote result
+COUNT_PREFIX = "count_"
+
+ALL_SCOPE = "all"
+
+MAX_VOTE_RETRIES = 5
+MAX_TALLY_RETRIES = 5
+
+
+def get_scopes(zip_code=None):
+    """Returns the tally scopes a vote from a zip code is counted in"""
+    scopes = [ALL_SCOPE]
+    if zip_code:
+        scopes.append("zip:" + zip_code)
+        if districts.district_lookup is not None:
+            scopes.extend("district:{}-{}".format(state, district)
+                for state, district in districts.district_lookup.get_districts(zip_code))
+
+    return scopes
+
+
+def record_vote(customer_uuid, bill_id, vote_result, zip_code=None):
+    """Creates or changes a customer's vote on a bill and updates the bill's tallies
+
+    The vote is written with a conditional put or update, so of two concurrent changes to the same
+    vote only one succeeds and only it updates the tallies, which `Votes.create` and `Votes.save`
+    do. Recording the same vote again doesn't change the tallies.
+
+    :param str customer_uuid: The customer voting
+    :param str bill_id: The bill being voted on
+    :param str vote_result: The customer's vote, e.g. "yes"
+    :param str zip_code: (Optional) The customer's zip code, only used for their first vote
+
+    :returns: Whether or not the vote changed
+    """
+    for _ in range(MAX_VOTE_RETRIES):
+        try:
+            vote = models.Votes.load_from_db(customer_uuid, bill_id)
+        except DecidePoliticsException as e:
+            if e.error_type is not Errors.VOTE_DOES_NOT_EXIST:
+                raise
+            vote = None
+
+        try:
+            if vote is None:
+                attributes = {
+                    VFields.CUSTOMER_UUID: customer_uuid,
+                    VFields.BILL_ID: bill_id,
+                    VFields.VOTE_RESULT: vote_result,
+                }
+                if zip_code:
+                    attributes[VFields.ZIP_CODE] = zip_code
+
+                vote = models.Votes.create_new(attributes)
+                vote.create()
+            elif vote[VFields.VOTE_RESULT] == vote_result:
+                return False
+            else:
+                vote[VFields.VOTE_RESULT] = vote_result
+                vote.save()
+        except DecidePoliticsException as e:
+            if e.error_type not in (Errors.VOTE_ALREADY_EXISTS, Errors.CONSISTENCY_ERROR):
+                raise
+
+            # A concurrent request changed the vote first, start over from its result
+            continue
+
+        return True
+
+    raise DecidePoliticsException(Errors.CONSISTENCY_ERROR)
+
+
+def get_tally(bill_id, scope=ALL_SCOPE):
+    """Returns the vote counts of a bill, a dict of vote result -> count, with a single read"""
+    item = models.engine.get_item(models.TableNames.VOTE_TALLIES, {TFields.BILL_ID: bill_id, TFields.SCOPE: scope})
+    if item is None:
+        return {}
+
+    return {key[len(COUNT_PREFIX):]: int(val) for key, val in item.items()
+        if key.startswith(COUNT_PREFIX) and val}
+
+
+def rebuild_tallies(total_segments=8):
+    """Recomputes every tally from a parallel scan of the votes table
+
+    Fixes tallies that drifted, e.g. when a vote was written but its tally update failed. Votes
+    recorded while the rebuild runs may be lost from the tallies, so run it when traffic is low.
+
+    :param int total_segments: The number of segments scanned in parallel
+
+    :returns: The number of tally items written
+    """
+    tallies = collections.defaultdict(collections.Counter)
+
+    def scan_segment(segment):
+        segment_tallies = collections.defaultdict(collections.Counter)
+        for vote in models.engine.scan_items(
+            models.TableNames.VOTES,
+            segment=segment,
+            total_segments=total_segments,
+            attributes=[VFields.BILL_ID, VFields.VOTE_RESULT, VFields.ZIP_CODE],
+        ):
+            for scope in get_scopes(vote.get(VFields.ZIP_CODE)):
+                segment_tallies[(vote[VFields.BILL_ID], scope)][vote[VFields.VOTE_RESULT]] += 1
+
+        return segment_tallies
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for segment_tallies in executor.map(scan_segment, range(total_segments)):
+            for key, counts in segment_tallies.items():
+                tallies[key].update(counts)
+
+    stale_keys = [(item[TFields.BILL_ID], item[TFields.SCOPE])
+        for item in models.engine.scan_items(models.TableNames.VOTE_TALLIES, attributes=[TFields.BILL_ID, TFields.SCOPE])
+        if (item[TFields.BILL_ID], item[TFields.SCOPE]) not in tallies]
+
+    write_requests = []
+    for (bill_id, scope), counts in tallies.items():
+        data = {COUNT_PREFIX + result: count for result, count in counts.items()}
+        data.update({TFields.BILL_ID: bill_id, TFields.SCOPE: scope})
+        write_requests.append((storage.PUT_REQUEST, data))
+
+    for bill_id, scope in stale_keys:
+        write_requests.append((storage.DELETE_REQUEST, {TFields.BILL_ID: bill_id, TFields.SCOPE: scope}))
+
+    for i in range(0, len(write_requests), models.Model.MAX_BATCH_WRITE):
+        _write_tallies(write_requests[i : i + models.Model.MAX_BATCH_WRITE])
+
+    log.info("Rebuilt {} vote tallies".format(len(tallies)))
+    return len(tallies)
+
+
+def update_tally(bill_id, scope, deltas):
+    """Atomically adds to the counts of a tally
+
+    Failures are retried with backoff and then logged, `rebuild_tallies` corrects the counts.
+
+    :param str bill_id: The bill of the tally
+    :param str scope: The scope of the tally, see `get_scopes`
+    :param dict deltas: Maps vote result -> the number to add to its count
+    """
+    key = {TFields.BILL_ID: bill_id, TFields.SCOPE: scope}
+    updates = {COUNT_PREFIX + result: (storage.ADD, delta) for result, delta in deltas.items() if delta}
+    if not updates:
+        return
+
+    attempt = 0
+    while True:
+        try:
+            models.engine.update_item(models.TableNames.VOTE_TALLIES, key, updates)
+            return
+        except (boto.exception.JSONResponseError, OSError):
+            if attempt >= MAX_TALLY_RETRIES:
+                log.exception("Failed to update the {} tally of {}".format(scope, bill_id))
+                return
+
+            time.sleep(common.exponential_backoff(attempt))
+            attempt += 1
+
+
+def _write_tallies(write_requests):
+    attempt = 0
+    while write_requests:
+        # The writes that were throttled are returned to be retried
+        write_requests = models.engine.batch_write(models.TableNames.VOTE_TALLIES, write_requests)
+        if write_requests:
+            models.Model._wait_before_retry(attempt)
+            attempt += 1
+
+
+def count_vote(bill_id, zip_code, previous_result, vote_result):
+    """Moves one count of a bill's tallies from the previous result of a vote to its new one
+
+    :param str zip_code: The zip code the vote is counted in, None for none
+    :param str previous_result: The result before, None for a new vote
+    """
+    deltas = {vote_result: 1}
+    if previous_result is not None:
+        deltas[previous_result] = -1
+
+    for scope in get_scopes(zip_code):
+        update_tally(bill_id, scope, deltas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the vote tallies from the votes table")
+    parser.add_argument("--segments", type=int, default=8, help="The number of parallel scan segments")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    rebuild_tallies(args.segments)
+
+
+if __name__ == "__main__":
+    main()
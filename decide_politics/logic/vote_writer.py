@@ -0,0 +1,293 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+
+import decide_politics.logic.tallies as tallies
+import shared.config as config
+
+from decide_politics.core.models import VFields
+from decide_politics.core.models import Votes
+
+log = logging.getLogger(__name__)
+
+# Global buffered vote writer, None when votes are written with `tallies.record_vote`. Initialized at bottom
+vote_writer = None
+
+
+class BufferedVoteWriter:
+    """Coalesces votes from many requests into BatchWriteItem requests
+
+    Votes are buffered and written when `max_batch_size` votes are pending or `flush_interval`
+    seconds after the oldest pending vote, whichever comes first. Votes of the same customer on the
+    same bill within that window are deduplicated, the last one wins. Pending votes are written on
+    shutdown, so at most `flush_interval` seconds of votes are lost if the process dies. Votes
+    recorded after `stop` are written in the caller.
+
+    Tallies are updated once per batch: the previous votes are read with a BatchGetItem and the
+    count changes of the whole batch are summed per tally. When a flush fails part way, some of its
+    votes may already be written, so the previous results read before it are kept and the retry
+    counts the changes from them rather than from what it reads back.
+
+    NOTE that, unlike `tallies.record_vote`, batched writes are unconditional. Two processes that
+    write the same customer's vote at once can skew the tallies until `tallies.rebuild_tallies`.
+    """
+
+    def __init__(self, max_batch_size=500, flush_interval=1.0, max_pending=10000, clock=time.monotonic):
+        """
+        :param int max_batch_size: The number of pending votes that triggers a flush
+        :param float flush_interval: The maximum number of seconds a vote stays pending
+        :param int max_pending: The number of pending votes at which `record` flushes in the caller
+        :param clock: (Optional) A function returning the current time in seconds
+        """
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._clock = clock
+
+        # Maps (customer uuid, bill id) -> (vote result, zip code), in the order first recorded
+        self._pending = collections.OrderedDict()
+        self._oldest_pending_at = None
+        self._condition = threading.Condition()
+        # Only one flush writes at a time, so a key's writes can't be reordered
+        self._flush_lock = threading.Lock()
+        # Maps (customer uuid, bill id) -> the vote result before a failed flush (None when there was
+        # no vote), until the vote is written and counted. Guarded by `_flush_lock`
+        self._unsettled = {}
+        self._flusher = None
+        self._stopped = False
+
+        self.recorded = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.written = 0
+        self.failed_flushes = 0
+        self.batches = 0
+        self.batched = 0
+        self.last_batch_size = 0
+        self.max_batch_size_seen = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def record(self, customer_uuid, bill_id, vote_result, zip_code=None):
+        """Buffer a customer's vote on a bill
+
+        :param str zip_code: (Optional) The customer's zip code, only used for their first vote
+
+        Once the writer is stopped, the vote is written before returning.
+        """
+        self._start_flusher()
+
+        with self._condition:
+            key = (customer_uuid, bill_id)
+            if key in self._pending:
+                self.coalesced += 1
+            elif self._oldest_pending_at is None:
+                self._oldest_pending_at = self._clock()
+
+            self._pending[key] = (vote_result, zip_code)
+            self.recorded += 1
+
+            num_pending = len(self._pending)
+            if num_pending >= self.max_batch_size:
+                self._condition.notify()
+            stopped = self._stopped
+
+        # Nothing flushes after `stop`, and apply backpressure rather than buffer without bound
+        if stopped or num_pending >= self.max_pending:
+            self.flush()
+
+    def flush(self):
+        """Write every pending vote
+
+        :returns: The number of votes written
+        """
+        with self._flush_lock:
+            with self._condition:
+                pending, self._pending = self._pending, collections.OrderedDict()
+                self._oldest_pending_at = None
+
+            if not pending:
+                return 0
+
+            begin = self._clock()
+            try:
+                written, tally_deltas = self._write(pending)
+            except Exception:
+                self.failed_flushes += 1
+                log.exception("Failed to write {} votes, retrying with the next flush".format(len(pending)))
+                self._requeue(pending)
+                return 0
+
+            # The votes are written, so they're counted now and never retried
+            for key in pending:
+                self._unsettled.pop(key, None)
+            self._update_tallies(tally_deltas)
+
+            latency = self._clock() - begin
+            self.batches += 1
+            self.batched += len(pending)
+            self.last_batch_size = len(pending)
+            self.max_batch_size_seen = max(self.max_batch_size_seen, len(pending))
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+            return written
+
+    def stop(self):
+        """Write the pending votes and stop the background flusher"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._pending)
+            oldest = self._oldest_pending_at
+
+        return dict(
+            pending=pending,
+            oldest_pending_age=self._clock() - oldest if oldest is not None else 0.0,
+            unsettled=len(self._unsettled),
+            recorded=self.recorded,
+            coalesced=self.coalesced,
+            unchanged=self.unchanged,
+            written=self.written,
+            failed_flushes=self.failed_flushes,
+            batches=self.batches,
+            last_batch_size=self.last_batch_size,
+            max_batch_size=self.max_batch_size_seen,
+            mean_batch_size=self.batched / self.batches if self.batches else 0.0,
+            last_flush_latency=self.last_flush_latency,
+            max_flush_latency=self.max_flush_latency,
+            mean_flush_latency=self.total_flush_latency / self.batches if self.batches else 0.0,
+        )
+
+    def _write(self, pending):
+        """Writes the changed votes
+
+        :returns: (The number of votes written, a dict of (bill id, scope) -> {vote result: count change})
+        """
+        previous_votes = {
+            (vote[VFields.CUSTOMER_UUID], vote[VFields.BILL_ID]): vote
+            for vote in Votes.batch_load(list(pending))
+        }
+
+        # Count from the results before an earlier failed flush, which may have written these votes
+        for key in pending:
+            if key not in self._unsettled:
+                vote = previous_votes.get(key)
+                self._unsettled[key] = vote[VFields.VOTE_RESULT] if vote is not None else None
+
+        # Maps (bill id, scope) -> {vote result: count change}
+        tally_deltas = collections.defaultdict(collections.Counter)
+        written = 0
+        with Votes.batch_writer() as batch:
+            for (customer_uuid, bill_id), (vote_result, zip_code) in pending.items():
+                previous_result = self._unsettled[(customer_uuid, bill_id)]
+                if previous_result == vote_result:
+                    self.unchanged += 1
+                    continue
+
+                vote = previous_votes.get((customer_uuid, bill_id))
+                if vote is None:
+                    attributes = {
+                        VFields.CUSTOMER_UUID: customer_uuid,
+                        VFields.BILL_ID: bill_id,
+                        VFields.VOTE_RESULT: vote_result,
+                    }
+                    if zip_code:
+                        attributes[VFields.ZIP_CODE] = zip_code
+                    vote = Votes.create_new(attributes)
+                else:
+                    vote[VFields.VOTE_RESULT] = vote_result
+
+                batch.put(vote)
+                written += 1
+
+                for scope in tallies.get_scopes(vote.get(VFields.ZIP_CODE)):
+                    deltas = tally_deltas[(bill_id, scope)]
+                    deltas[vote_result] += 1
+                    if previous_result is not None:
+                        deltas[previous_result] -= 1
+
+        self.written += written
+        return (written, tally_deltas)
+
+    def _update_tallies(self, tally_deltas):
+        for (bill_id, scope), deltas in tally_deltas.items():
+            try:
+                tallies.update_tally(bill_id, scope, deltas)
+            except Exception:
+                # The votes are written, `tallies.rebuild_tallies` corrects the counts
+                log.exception("Failed to update the {} tally of {}".format(scope, bill_id))
+
+    def _requeue(self, pending):
+        with self._condition:
+            for key, vote in pending.items():
+                # A vote recorded since the failed flush is newer
+                if key not in self._pending:
+                    self._pending[key] = vote
+
+            if self._pending and self._oldest_pending_at is None:
+                self._oldest_pending_at = self._clock()
+
+    def _start_flusher(self):
+        # Started lazily so that no threads exist before the server forks its workers
+        if self._flusher is not None:
+            return
+
+        with self._condition:
+            if self._flusher is not None or self._stopped:
+                return
+
+            self._flusher = threading.Thread(target=self._run_flusher, name="vote-writer", daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not self._is_due():
+                    oldest = self._oldest_pending_at
+                    timeout = self.flush_interval if oldest is None \
+                        else max(0.0, oldest + self.flush_interval - self._clock())
+                    self._condition.wait(timeout)
+
+                if self._stopped:
+                    return
+
+            self.flush()
+
+    def _is_due(self):
+        if len(self._pending) >= self.max_batch_size:
+            return True
+
+        oldest = self._oldest_pending_at
+        return oldest is not None and self._clock() - oldest >= self.flush_interval
+
+
+def _create_vote_writer():
+    cnfg = config.store.get("vote_writer", {})
+    if not cnfg.get("enabled", False):
+        return None
+
+    log.info("Buffering vote writes for up to {} seconds".format(cnfg["flush_interval"]))
+    writer = BufferedVoteWriter(
+        max_batch_size=cnfg["max_batch_size"],
+        flush_interval=cnfg["flush_interval"],
+        max_pending=cnfg["max_pending"],
+    )
+
+    # Write the pending votes on shutdown
+    atexit.register(writer.stop)
+
+    return writer
+
+vote_writer = _create_vote_writer()
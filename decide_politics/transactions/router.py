@@ -0,0 +1,111 @@
+class RouteMatch:
+    """The result of routing a message to a transaction"""
+    def __init__(self, transaction, command, args):
+        self.transaction = transaction
+        self.command = command
+        self.args = args
+
+
+class _TrieNode:
+    __slots__ = ("children", "transaction", "command")
+
+    def __init__(self):
+        self.children = {}
+        self.transaction = None
+        self.command = None
+
+
+class CommandRouter:
+    """Routes commands to transactions with a trie over the words of each command alias
+
+    Transactions declare their command aliases in `COMMANDS`. A message is routed to the longest
+    alias that its leading words match, and the remaining words are returned as arguments, so
+    routing takes time proportional to the length of the message no matter how many commands are
+    registered.
+
+    Example:
+        router = CommandRouter([VoteTransaction(), VoteInfoTransaction()])
+        router.route("VOTE INFO HR1234")  # -> VoteInfoTransaction, args ["HR1234"]
+        router.route("VOTE HR1234 YES")   # -> VoteTransaction, args ["HR1234", "YES"]
+    """
+
+    def __init__(self, transactions=()):
+        self._root = _TrieNode()
+        self._transactions_by_id = {}
+
+        for transaction in transactions:
+            self.register(transaction)
+
+    def register(self, transaction):
+        """Register a transaction under its ID and each of its command aliases
+
+        :raises ValueError: When the ID or one of the aliases is already registered
+        """
+        if transaction.ID in self._transactions_by_id:
+            raise ValueError("Transaction {} is already registered".format(transaction.ID))
+
+        # Every alias is checked before any is added, so a conflict leaves the router unchanged
+        aliases = {}
+        for command in transaction.COMMANDS:
+            words = tuple(command.split())
+            if not words:
+                raise ValueError("Transaction {} has an empty command".format(transaction.ID))
+            elif words in aliases:
+                raise ValueError("Transaction {} has the command {} twice".format(transaction.ID, command))
+
+            node = self._find(words)
+            if node is not None and node.transaction is not None:
+                raise ValueError("Command {} is already routed to {}".format(command, node.transaction.ID))
+
+            aliases[words] = command
+
+        for words, command in aliases.items():
+            node = self._root
+            for word in words:
+                node = node.children.setdefault(word, _TrieNode())
+
+            node.transaction = transaction
+            node.command = command
+
+        self._transactions_by_id[transaction.ID] = transaction
+
+    def route(self, message):
+        """Find the transaction for a formatted (stripped, upper cased) message
+
+        :returns: A `RouteMatch`, or None if the message is not a command
+        """
+        words = message.split()
+
+        node = self._root
+        match = None
+        for i, word in enumerate(words):
+            node = node.children.get(word)
+            if node is None:
+                break
+            elif node.transaction is not None:
+                match = (node, i + 1)
+
+        if match is None:
+            return None
+
+        node, num_command_words = match
+        return RouteMatch(node.transaction, node.command, words[num_command_words:])
+
+    def _find(self, words):
+        """Returns the node of exactly these words, or None"""
+        node = self._root
+        for word in words:
+            node = node.children.get(word)
+            if node is None:
+                return None
+
+        return node
+
+    def get_transaction(self, transaction_id):
+        return self._transactions_by_id[transaction_id]
+
+    def __iter__(self):
+        return iter(self._transactions_by_id.values())
+
+    def __len__(self):
+        return len(self._transactions_by_id)
@@ -1,3 +1,4 @@
+import re
 import uuid
 
 import shared.service as service
@@ -6,15 +7,24 @@ from decide_politics.core.models import Customer
 
 
 class TriggerData:
-    """Data passed into state node upon entering entering and exiting"""
-    def __init__(self, message=None):
+    """Data passed into state node upon entering entering and exiting
+
+    COMMAND and ARGS are set when a transaction is started by a command, e.g. "VOTE HR1234 YES"
+    has the command "VOTE" and the arguments ["HR1234", "YES"]
+    """
+    def __init__(self, message=None, command=None, args=()):
         self.MESSAGE = message
+        self.COMMAND = command
+        self.ARGS = args
 
 class TransactionBase:
     """Base class for transactions that manages transitioning to new state nodes"""
 
     ID = 'TransactionBase'
 
+    # The commands that start this transaction, see `CommandRouter`
+    COMMANDS = ()
+
     def __init__(self, begin_state_node):
         self.begin_state_node = begin_state_node
 
@@ -45,18 +55,23 @@ class TransactionBase:
         """
         return self.__class__.__name__
 
-    def start_transaction(self, customer):
-        """Transition the customer into this transaction"""
+    def start_transaction(self, customer, trigger_data=None):
+        """Transition the customer into this transaction
+
+        @param trigger_data (Optional) The command and arguments that started the transaction
+        """
+        trigger_data = trigger_data if trigger_data is not None else TriggerData()
+
         customer[CFields.CUR_TRANSACTION_ID] = self.ID
         customer[CFields.TRANSACTION_STATE_ID] = self.begin_state_node.ID
 
         # Call the handler for entering the first state
-        self.begin_state_node.enter(customer)
+        self.begin_state_node.enter(customer, trigger_data)
 
         # Advance to the next state if possible
         self.__advance_to_next_state(
             customer,
-            TriggerData(),
+            trigger_data,
             exit_on_failure=False
         )
 
@@ -88,19 +103,39 @@ class StateNode:
     """A class which manages the logic with traversing a finite state machine (FSM) representing
     the state of a conversation
 
+    Triggers are compiled into a dispatch table as they are registered. A message is matched
+    against, in order:
+        1. Keywords, the exact message, with a dictionary lookup
+        2. Prefixes, longest first
+        3. Regular expressions and arbitrary predicates, in the order they were registered
+        4. The catch-all trigger
+
+    Conflicting registrations raise a `ValueError` up front, so dispatch never has to check for
+    ambiguity: the same trigger twice, and a keyword that a prefix or regular expression also
+    matches. Overlaps that can't be checked when registering are resolved by the order above: a
+    longer prefix wins over a shorter one, a prefix wins over a regular expression or predicate
+    that also matches, and of those the one registered first wins.
+
     Example of Configuration:
-        upon_hello = lambda mc: mc == 'HELLO'
-        begin_state = StateNode("Welcome to the transaction")
-        end_state   = StateNode("Goodbye!")
-        begin_state.register_trigger(upon_hello, end_state)
+        begin_state = StateNode("begin")
+        end_state   = StateNode("end")
+        begin_state.register_keyword("HELLO", end_state)
 
-        begin_state.handle_message("HELLO") -> end_state
+        begin_state.handle_trigger_event(customer, TriggerData("HELLO")) -> (True, end_state)
     """
     def __init__(self, node_id):
         """Initialize state node with the message we are going to send to the user"""
         self.ID = node_id
 
-        self._trigger_map = {}
+        self._keyword_map = {}
+        # List of (prefix, target state node), longest prefix first
+        self._prefix_triggers = []
+        # List of (unary predicate, target state node), in registration order
+        self._ordered_triggers = []
+        # Maps pattern -> compiled regular expression
+        self._patterns = {}
+        self._has_default = False
+        self._default_target = None
 
     def enter(self, customer, trigger_data=TriggerData()):
         """Called when a given customer is transitioning to this state"""
@@ -112,45 +147,114 @@ class StateNode:
         Default behavior is to pass"""
         pass
 
+    def register_keyword(self, keyword, target_state_node):
+        """Register a trigger for messages that are exactly `keyword`
+
+        @param keyword The message that triggers the transition
+        @param target_state_node The next state node to transition to, None to exit
+        """
+        if keyword in self._keyword_map:
+            raise ValueError("State node {} already has a trigger for {}".format(self.ID, keyword))
+
+        for prefix, _ in self._prefix_triggers:
+            if keyword.startswith(prefix):
+                raise ValueError("State node {} has a trigger for prefix {}, which matches {}".format(
+                    self.ID, prefix, keyword))
+        for pattern, regex in self._patterns.items():
+            if regex.match(keyword):
+                raise ValueError("State node {} has a trigger for pattern {}, which matches {}".format(
+                    self.ID, pattern, keyword))
+
+        self._keyword_map[keyword] = target_state_node
+
+    def register_prefix(self, prefix, target_state_node):
+        """Register a trigger for messages that start with `prefix`
+
+        @param prefix The start of the messages that trigger the transition
+        @param target_state_node The next state node to transition to, None to exit
+        """
+        if any(prefix == registered_prefix for registered_prefix, _ in self._prefix_triggers):
+            raise ValueError("State node {} already has a trigger for prefix {}".format(self.ID, prefix))
+
+        for keyword in self._keyword_map:
+            if keyword.startswith(prefix):
+                raise ValueError("State node {} has a trigger for {}, which prefix {} matches".format(
+                    self.ID, keyword, prefix))
+
+        self._prefix_triggers.append((prefix, target_state_node))
+        self._prefix_triggers.sort(key=lambda trigger: len(trigger[0]), reverse=True)
+
+    def register_regex(self, pattern, target_state_node):
+        """Register a trigger for messages that match the regular expression `pattern`
+
+        @param pattern The regular expression, matched from the start of the message
+        @param target_state_node The next state node to transition to, None to exit
+        """
+        if pattern in self._patterns:
+            raise ValueError("State node {} already has a trigger for pattern {}".format(self.ID, pattern))
+
+        regex = re.compile(pattern)
+        for keyword in self._keyword_map:
+            if regex.match(keyword):
+                raise ValueError("State node {} has a trigger for {}, which pattern {} matches".format(
+                    self.ID, keyword, pattern))
+
+        self._patterns[pattern] = regex
+        self._ordered_triggers.append((
+            lambda trigger_data: trigger_data.MESSAGE is not None and regex.match(trigger_data.MESSAGE),
+            target_state_node,
+        ))
+
+    def register_default(self, target_state_node):
+        """Register a trigger for every message that no other trigger matches
+
+        @param target_state_node The next state node to transition to, None to exit
+        """
+        if self._has_default:
+            raise ValueError("State node {} already has a catch-all trigger".format(self.ID))
+
+        self._has_default = True
+        self._default_target = target_state_node
+
     def register_trigger(self, trigger_unary_predicate, target_state_node):
-        """Register a trigger function which accepts the message content and a target state node
+        """Register a trigger function which accepts the trigger data and a target state node
 
-        @param trigger_unary_predicate A function with signature (message_content) -> `bool`
+        Prefer the declarative `register_*` methods, which are matched without calling a function.
+
+        @param trigger_unary_predicate A function with signature (trigger_data) -> `bool`
         @param target_state_node The next state node to transition to
         """
-        self._trigger_map[trigger_unary_predicate] = target_state_node;
+        self._ordered_triggers.append((trigger_unary_predicate, target_state_node))
 
     def handle_trigger_event(self, customer, trigger_data):
-        """Handles a message by calling all the registered trigger functions. If the trigger returns
-        true, enter the target state and return the new state node.
+        """Handles a message by looking up the trigger that matches it. If there is one, returns
+        the target state node.
 
         NOTE that when a new state node is not found, returns None.
 
-        @param message_content The content of the message being handled
+        @param customer The customer who sent the message
         @param trigger_data The `TriggerData` object containing necessary information
         @returns (Success flag, The new state node or None)
         """
-        # Scan for triggers that are valid
-        valid_triggers = [trigger_up
-            for trigger_up in self._trigger_map
-            if trigger_up(trigger_data)
-        ]
-
-        # Handle case where state transition isn't clean
-        if len(valid_triggers) > 1:
-            raise Exception("State transition was invalid. {trigger_information}".format(dict(
-                trigger_information="More than one ({num_target_states}) target states were found.".format(
-                        num_target_states=len(valid_triggers)
-                    )
-            )))
-        elif len(valid_triggers) == 0:
-            # In this case we should just return none to signify that we are done
-            return (False, None)
-
-        # Call the handler for this trigger
-        next_state_node = self._trigger_map[valid_triggers[0]]
-
-        return (True, next_state_node)
+        message = getattr(trigger_data, "MESSAGE", None)
+
+        if message is not None:
+            if message in self._keyword_map:
+                return (True, self._keyword_map[message])
+
+            for prefix, target_state_node in self._prefix_triggers:
+                if message.startswith(prefix):
+                    return (True, target_state_node)
+
+        for trigger_up, target_state_node in self._ordered_triggers:
+            if trigger_up(trigger_data):
+                return (True, target_state_node)
+
+        if self._has_default:
+            return (True, self._default_target)
+
+        # In this case we should just return none to signify that we are done
+        return (False, None)
 
 
 class SendMessageStateNode(StateNode):
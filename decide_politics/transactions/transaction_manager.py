@@ -1,20 +1,22 @@
 from decide_politics.core.models import CFields
 from decide_politics.core.models import Customer
 
+from decide_politics.transactions import router
 from decide_politics.transactions import transaction_base as tb
 from decide_politics.transactions.welcome import WelcomeTransaction
 
+import shared.profiler as profiler
 import shared.service as service
+import shared.sms_encoding as sms_encoding
+
+INVALID_COMMAND_MESSAGE = "Invalid Command!"
 
 class TransactionManager:
     """Class that handles transaction lifecycles and delegates messages"""
-    COMMAND_TO_TRANSACTION_MAP = {
-        "WELCOME": WelcomeTransaction(),
-    }
-
-    TRANSACTION_ID_TO_TRANSACTION_MAP = {
-        WelcomeTransaction.ID: COMMAND_TO_TRANSACTION_MAP["WELCOME"],
-    }
+    # Routes commands and transaction IDs to the transactions, built once at import
+    ROUTER = router.CommandRouter([
+        WelcomeTransaction(),
+    ])
 
     @staticmethod
     def __format_message(message):
@@ -23,6 +25,23 @@ class TransactionManager:
 
         return message
 
+    @staticmethod
+    def __tag_profile(transaction_id):
+        # Profiles of messages are named after the transaction that handled them
+        if profiler.profiler is not None:
+            profiler.profiler.tag("transaction", transaction_id)
+
+    @classmethod
+    def check_message_templates(cls):
+        """Logs the encoding and segment count of every static message, see `sms_encoding.check_templates`"""
+        templates = {"invalid_command": INVALID_COMMAND_MESSAGE}
+        for transaction in cls.ROUTER:
+            for node_id, state_node in transaction.STATE_NODES.items():
+                if isinstance(state_node, tb.SendMessageStateNode):
+                    templates["{}.{}".format(transaction.ID, node_id)] = state_node._message_to_send
+
+        return sms_encoding.check_templates(templates)
+
     @classmethod
     def handle_message(cls, customer, message):
         message = cls.__format_message(message)
@@ -32,16 +51,24 @@ class TransactionManager:
 
         # Handle case where a customer is not in a transaction
         if customer_cur_trans_id is None or customer_cur_trans_id == Customer.CUR_TRANSACTION_ID_SENTINEL:
-            transaction = cls.COMMAND_TO_TRANSACTION_MAP.get(message)
+            route = cls.ROUTER.route(message)
 
             # Return if the command was invalid
-            if transaction is None:
-                service.twilio.send_msg(customer[CFields.PHONE_NUMBER], "Invalid Command!")
+            if route is None:
+                cls.__tag_profile("invalid_command")
+                service.twilio.send_msg(customer[CFields.PHONE_NUMBER], INVALID_COMMAND_MESSAGE)
                 return
 
-            transaction.start_transaction(customer)
+            cls.__tag_profile(route.transaction.ID)
+
+            # States read the parsed command instead of the raw message
+            route.transaction.start_transaction(
+                customer,
+                tb.TriggerData(command=route.command, args=route.args)
+            )
         else:
-            cls.TRANSACTION_ID_TO_TRANSACTION_MAP[customer_cur_trans_id].handle_trigger_event(
+            cls.__tag_profile(customer_cur_trans_id)
+            cls.ROUTER.get_transaction(customer_cur_trans_id).handle_trigger_event(
                 customer,
                 trigger_data
             )
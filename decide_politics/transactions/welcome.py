@@ -4,13 +4,11 @@ WELCOME_MESSAGE = "Welcome to DecidePolitics!"
 
 welcome_state_node = tb.SendMessageStateNode("welcome", WELCOME_MESSAGE)
 # Always exit state upon transitioning
-welcome_state_node.register_trigger(
-    lambda td: True,
-    None
-)
+welcome_state_node.register_default(None)
 
 class WelcomeTransaction(tb.TransactionBase):
     ID = "WelcomeTransaction"
+    COMMANDS = ("WELCOME",)
 
     STATE_NODES = {
         "welcome": welcome_state_node
@@ -0,0 +1,93 @@
+import collections
+import threading
+import time
+
+
+class LRUCache:
+    """A bounded, thread-safe least-recently-used cache with an optional time to live
+
+    Entries are evicted when the cache grows past `max_size` or when they are older than `ttl`
+    seconds. Expired entries are dropped lazily on access.
+
+    Example:
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.put("a", 1)
+        cache.get("a") -> 1
+        cache.get("b") -> None
+    """
+
+    def __init__(self, max_size, ttl=None, clock=time.monotonic):
+        """
+        :param int max_size: The maximum number of entries to keep
+        :param float ttl: (Optional) The number of seconds an entry stays fresh
+        :param clock: (Optional) A function returning the current time in seconds
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+
+        # Maps key -> (expiry time, value), ordered from least to most recently used
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value):
+        expires_at = self._clock() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Returns a snapshot of the cache counters"""
+        return dict(
+            size=len(self._entries),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+        )
@@ -0,0 +1,155 @@
+"""DynamoDB consumed capacity accounting
+
+Every DynamoDB request asks for its consumed capacity, which is counted per table, endpoint,
+model class and model operation in `metrics.registry`, e.g.
+
+    decide_politics_dynamodb_consumed_capacity_units_total{table="DecidePolitics_Customers",
+        kind="read",endpoint="/sms/handle_sms",model="Customer",operation="get_customer_by_phone_number"} 12.5
+
+Requests made outside of a Flask request (e.g. by the inbound pipeline's workers) are counted
+under the "background" endpoint, and requests made outside of a model operation (e.g. tally
+updates) under the "none" model and their DynamoDB action.
+"""
+import collections
+import functools
+import logging
+import threading
+
+import shared.config as config
+import shared.metrics as metrics
+
+log = logging.getLogger(__name__)
+
+# Global capacity tracker. Initialized at bottom
+tracker = None
+
+CONSUMED_CAPACITY = "dynamodb_consumed_capacity_units_total"
+HTTP_REQUEST_CONSUMED_CAPACITY = "http_request_consumed_capacity_units"
+CAPACITY_BUCKETS = (0, 0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+BACKGROUND_ENDPOINT = "background"
+NO_MODEL = "none"
+
+READ_ACTIONS = frozenset(("GetItem", "BatchGetItem", "Query", "Scan"))
+WRITE_ACTIONS = frozenset(("PutItem", "UpdateItem", "DeleteItem", "BatchWriteItem"))
+
+
+class CapacityTracker:
+    """Attributes the capacity consumed by DynamoDB requests to endpoints and model operations
+
+    The current endpoint and model operation are tracked per thread (green under eventlet).
+    """
+
+    def __init__(self, registry, log_threshold=None):
+        """
+        :param registry: The `MetricsRegistry` the consumed capacity is counted in
+        :param float log_threshold: (Optional) Requests that consume more capacity units are logged
+        """
+        self.registry = registry
+        self.log_threshold = log_threshold
+        self._context = threading.local()
+
+    def operation(self, model, operation):
+        """Returns a context manager that attributes the requests made within it to a model operation
+
+        Requests are attributed to the innermost operation, e.g. the requests of
+        `get_or_create_by_phone_number` to its `get_customer_by_phone_number` and `create`.
+
+        :param str model: The name of the model class
+        :param str operation: The name of the operation, e.g. "load_from_db"
+        """
+        return _Operation(self._context, model, operation)
+
+    def begin_request(self, endpoint):
+        self._context.endpoint = endpoint
+        # Maps (model, operation) -> capacity units consumed during the request
+        self._context.consumed = collections.Counter()
+
+    def end_request(self):
+        """Stops attributing capacity to the current request
+
+        :returns: The capacity units the request consumed
+        """
+        endpoint = getattr(self._context, "endpoint", None)
+        consumed = getattr(self._context, "consumed", None)
+        self._context.endpoint = self._context.consumed = None
+        if consumed is None:
+            return 0.0
+
+        total = sum(consumed.values())
+        self.registry.observe(HTTP_REQUEST_CONSUMED_CAPACITY, total, (("endpoint", endpoint),),
+            buckets=CAPACITY_BUCKETS)
+
+        if self.log_threshold is not None and total > self.log_threshold:
+            log.warning("Request to {} consumed {} capacity units: {}".format(endpoint, total, ", ".join(
+                "{}.{}={}".format(model, operation, units) for (model, operation), units in consumed.most_common())))
+
+        return total
+
+    def request_capacity(self, action, body):
+        """Adds ReturnConsumedCapacity to the JSON body of a DynamoDB request"""
+        if action not in READ_ACTIONS and action not in WRITE_ACTIONS:
+            return body
+
+        # Cheaper than decoding and encoding the body. Every one of these requests has a table
+        # name or request items, so the body is never an empty object
+        return '{"ReturnConsumedCapacity": "TOTAL", ' + body[1:]
+
+    def record(self, action, response):
+        """Counts the capacity consumed by a DynamoDB request from its response"""
+        consumed = response.get("ConsumedCapacity") if isinstance(response, dict) else None
+        if not consumed:
+            return
+
+        model, operation = getattr(self._context, "operation", None) or (NO_MODEL, action)
+        endpoint = getattr(self._context, "endpoint", None) or BACKGROUND_ENDPOINT
+        kind = "read" if action in READ_ACTIONS else "write"
+
+        # Batch requests report the capacity of each table
+        for table_consumed in consumed if isinstance(consumed, list) else (consumed,):
+            units = table_consumed.get("CapacityUnits", 0.0)
+            self.registry.inc(CONSUMED_CAPACITY, (
+                ("table", table_consumed.get("TableName", "")),
+                ("kind", kind),
+                ("endpoint", endpoint),
+                ("model", model),
+                ("operation", operation),
+            ), units)
+
+            request_consumed = getattr(self._context, "consumed", None)
+            if request_consumed is not None:
+                request_consumed[(model, operation)] += units
+
+
+class _Operation:
+    __slots__ = ("context", "operation", "outer")
+
+    def __init__(self, context, model, operation):
+        self.context = context
+        self.operation = (model, operation)
+
+    def __enter__(self):
+        self.outer = getattr(self.context, "operation", None)
+        self.context.operation = self.operation
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.context.operation = self.outer
+
+
+def model_operation(func):
+    """Decorates a `Model` method so that the requests it makes are attributed to it"""
+    @functools.wraps(func)
+    def wrapper(cls_or_self, *args, **kwargs):
+        cls = cls_or_self if isinstance(cls_or_self, type) else type(cls_or_self)
+        with tracker.operation(cls.__name__, func.__name__):
+            return func(cls_or_self, *args, **kwargs)
+
+    return wrapper
+
+
+def _create_tracker():
+    cnfg = config.store["dynamodb"].get("capacity", {})
+    return CapacityTracker(metrics.registry, log_threshold=cnfg.get("log_threshold"))
+
+tracker = _create_tracker()
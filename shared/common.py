@@ -1,5 +1,6 @@
 import re
 import decimal
+import random
 import uuid
 import time
 
@@ -36,6 +37,10 @@ class Errors():
     STALE_API_VERSION             = ErrorType(15, "The API is not up to date with the latest version")
     MISSING_DATA                  = ErrorType(16, "The given data is missing necessary keys")
     STATE_CHANGE_FAILED           = ErrorType(17, "Transitioning to the new state failed")
+    BATCH_INCOMPLETE              = ErrorType(18, "The batch request could not be completed")
+    OUTBOUND_QUEUE_FULL           = ErrorType(19, "Too many outbound messages are waiting to be sent")
+    INBOUND_QUEUE_FULL            = ErrorType(20, "Too many inbound messages are waiting to be processed")
+    SENDER_RATE_LIMITED           = ErrorType(21, "Every sending phone number is at its rate limit")
 
 
 def error_to_json(error):
@@ -92,6 +97,10 @@ def convert_query(cls, query):
     for item in query:
         yield cls(item)
 
+def exponential_backoff(attempt, base=0.05, cap=5.0):
+    """Returns the number of seconds to wait before retry number `attempt` (full jitter)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
 def get_current_timestamp():
     return int(time.time() * 10**6)
 
@@ -5,5 +5,21 @@ import os
 MAX_TWILIO_MSG_SIZE  = 1600
 SERVICE_PHONE_NUMBER = "+18554164150"
 
-with open(os.path.abspath(os.environ['POLITI_HACK_CONFIG_PATH']), "r") as f:
+CONFIG_PATH = os.path.abspath(os.environ['POLITI_HACK_CONFIG_PATH'])
+
+with open(CONFIG_PATH, "r") as f:
     store = json.loads(f.read())
+
+
+def data_path(path):
+    """Resolves a file the app writes, e.g. a cache, against the "data_dir" of the config
+
+    The data dir defaults to the directory of the config file, and relative data dirs are relative
+    to it too. The data dir is created when it doesn't exist.
+
+    :param str path: A path from the config, returned as is when it's absolute
+    """
+    data_dir = os.path.join(os.path.dirname(CONFIG_PATH), store.get("data_dir", ""))
+    os.makedirs(data_dir, exist_ok=True)
+
+    return os.path.join(data_dir, path)
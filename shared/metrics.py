@@ -0,0 +1,246 @@
+"""In-process metrics, exposed in the Prometheus text format
+
+Recording a sample is a lock, a bisect and a few additions, so instrumenting every request and
+dependency call costs a few microseconds. Each process keeps its own metrics, so run one gunicorn
+worker per scrape target.
+
+Example:
+    with metrics.registry.time_call("twilio", "send_chunk"):
+        client.messages.create(...)
+
+    metrics.registry.render() -> 'decide_politics_dependency_duration_seconds_bucket{...} 1\\n...'
+"""
+import bisect
+import collections
+import logging
+import math
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Global metrics registry. Initialized at bottom
+registry = None
+
+PREFIX = "decide_politics"
+
+# Seconds, from a cache hit to a request timing out
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+HTTP_REQUEST_DURATION = "http_request_duration_seconds"
+HTTP_REQUESTS = "http_requests_total"
+HTTP_REQUEST_DYNAMODB_CALLS = "http_request_dynamodb_calls"
+DEPENDENCY_DURATION = "dependency_duration_seconds"
+DEPENDENCY_ERRORS = "dependency_errors_total"
+
+_INVALID_NAME_CHARACTERS = re.compile("[^a-zA-Z0-9_]")
+
+
+class Histogram:
+    """Counts samples into buckets, each bucket counts the samples <= its upper bound"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last count is of the samples above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class _CallTimer:
+    __slots__ = ("registry", "dependency", "labels", "begin")
+
+    def __init__(self, registry, dependency, operation):
+        self.registry = registry
+        self.dependency = dependency
+        self.labels = (("dependency", dependency), ("operation", operation))
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(DEPENDENCY_DURATION, time.perf_counter() - self.begin, self.labels)
+        if exc_type is not None:
+            self.registry.inc(DEPENDENCY_ERRORS, self.labels)
+
+        self.registry.count_request_call(self.dependency)
+
+
+class MetricsRegistry:
+    """Counters, histograms and the `stats()` of long lived objects
+
+    Metrics are identified by a name and a tuple of (label, value) pairs. The calls made to each
+    dependency are also counted per request, between `begin_request` and `end_request`, in the
+    thread (green under eventlet) handling the request.
+    """
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+
+        # Maps name -> {labels: value}
+        self._counters = collections.defaultdict(dict)
+        # Maps name -> {labels: `Histogram`}
+        self._histograms = collections.defaultdict(dict)
+        # Maps name -> a function returning a dict of stats
+        self._stats_sources = {}
+        self._lock = threading.Lock()
+
+        self._request = threading.local()
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            counters = self._counters[name]
+            counters[labels] = counters.get(labels, 0) + value
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histograms = self._histograms[name]
+            histogram = histograms.get(labels)
+            if histogram is None:
+                histogram = histograms[labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def time_call(self, dependency, operation):
+        """Returns a context manager that records the latency and failures of a dependency call"""
+        return _CallTimer(self, dependency, operation)
+
+    def begin_request(self):
+        self._request.calls = collections.Counter()
+
+    def count_request_call(self, dependency):
+        calls = getattr(self._request, "calls", None)
+        if calls is not None:
+            calls[dependency] += 1
+
+    def end_request(self):
+        """Stops counting calls for the current request
+
+        :returns: A `Counter` of dependency -> the number of calls made since `begin_request`
+        """
+        calls = getattr(self._request, "calls", None)
+        self._request.calls = None
+        return calls if calls is not None else collections.Counter()
+
+    def register_stats(self, name, source):
+        """Exports the numbers of a `stats()` dict as gauges named `<prefix>_<name>_<key>`
+
+        Nested dicts extend the name when their keys are names (e.g. the indexes of a
+        `ModelCache`) and are exported with a "key" label otherwise (e.g. phone numbers).
+
+        :param str name: The name of the source, e.g. "vote_writer"
+        :param source: A function returning the stats dict, called on each `render`
+        """
+        self._stats_sources[name] = source
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            histograms = {
+                name: {labels: (histogram.buckets, list(histogram.cumulative_counts()), histogram.sum)
+                    for labels, histogram in values.items()}
+                for name, values in self._histograms.items()
+            }
+
+        for name, values in sorted(counters.items()):
+            full_name = self._full_name(name)
+            lines.append("# TYPE {} counter".format(full_name))
+            for labels, value in sorted(values.items()):
+                lines.append("{}{} {}".format(full_name, _format_labels(labels), _format_value(value)))
+
+        for name, values in sorted(histograms.items()):
+            full_name = self._full_name(name)
+            lines.append("# TYPE {} histogram".format(full_name))
+            for labels, (buckets, counts, total) in sorted(values.items()):
+                for bound, count in zip(buckets + (math.inf,), counts):
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append("{}_bucket{} {}".format(full_name, _format_labels(bucket_labels), count))
+                lines.append("{}_sum{} {}".format(full_name, _format_labels(labels), _format_value(total)))
+                lines.append("{}_count{} {}".format(full_name, _format_labels(labels), counts[-1]))
+
+        for name, source in sorted(self._stats_sources.items()):
+            try:
+                stats = source()
+            except Exception:
+                # One broken source shouldn't hide every other metric
+                log.exception("Failed to collect the {} stats".format(name))
+                continue
+
+            gauges = []
+            _flatten_stats(self._full_name(name), stats, (), gauges)
+            previous_name = None
+            for full_name, labels, value in gauges:
+                if full_name != previous_name:
+                    lines.append("# TYPE {} gauge".format(full_name))
+                    previous_name = full_name
+                lines.append("{}{} {}".format(full_name, _format_labels(labels), _format_value(value)))
+
+        lines.append("")
+        return "\n".join(lines)
+
+    def _full_name(self, name):
+        return "{}_{}".format(self.prefix, name)
+
+
+def _flatten_stats(name, stats, labels, gauges):
+    for key, value in sorted(stats.items(), key=lambda item: str(item[0])):
+        if isinstance(value, dict):
+            if all(_is_name(subkey) for subkey in value):
+                _flatten_stats("{}_{}".format(name, key), value, labels, gauges)
+            else:
+                for subkey, subvalue in sorted(value.items(), key=lambda item: str(item[0])):
+                    if _is_number(subvalue):
+                        gauges.append((_metric_name(name, key), labels + (("key", str(subkey)),), subvalue))
+        elif _is_number(value):
+            gauges.append((_metric_name(name, key), labels, value))
+
+
+def _metric_name(name, key):
+    return _INVALID_NAME_CHARACTERS.sub("_", "{}_{}".format(name, key))
+
+
+def _is_name(key):
+    return isinstance(key, str) and not _INVALID_NAME_CHARACTERS.search(key)
+
+
+def _is_number(value):
+    # Includes bools, exported as 0 or 1
+    return isinstance(value, (int, float))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(label, _escape(value)) for label, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+registry = MetricsRegistry()
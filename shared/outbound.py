@@ -0,0 +1,105 @@
+import logging
+import queue
+import threading
+import time
+
+import shared.common as common
+import shared.config as config
+import shared.workers as workers
+
+from shared.common import Errors, DecidePoliticsException
+
+log = logging.getLogger(__name__)
+
+
+class OutboundDispatcher:
+    """Sends SMS messages from a pool of worker threads so that requests don't wait on the SMS API
+
+    Wraps an SMS service (e.g. `TwilioService`) and exposes the same `send_msg` interface. Each
+    recipient is assigned to a single worker, so messages to one recipient are sent in order.
+    Under the eventlet gunicorn worker the threads and queues are green.
+
+    Example:
+        dispatcher = OutboundDispatcher(TwilioService(sid, token), num_workers=4)
+        dispatcher.send_msg("+15419670010", "Hello!")  # Returns immediately
+        dispatcher.flush()                             # Waits for the message to be sent
+    """
+
+    def __init__(self, sender, num_workers=4, max_queue_size=1000, max_retries=5, enqueue_timeout=5.0):
+        """
+        :param sender: The SMS service that sends the messages
+        :param int num_workers: The number of worker threads
+        :param int max_queue_size: The maximum number of unsent messages across all workers
+        :param int max_retries: The number of times a throttled or failed chunk is retried
+        :param float enqueue_timeout: Seconds `send_msg` blocks on a full queue before giving up
+        """
+        self.sender = sender
+        self.max_retries = max_retries
+        self.enqueue_timeout = enqueue_timeout
+
+        self._pool = workers.ShardedWorkerPool(self._deliver, num_workers, max_queue_size, name="sms-out")
+
+        # Guards the counters, which every worker updates
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def is_connected(self):
+        return self.sender.is_connected()
+
+    def send_msg(self, to, body, from_=config.SERVICE_PHONE_NUMBER):
+        """Queue a message to be sent
+
+        Blocks for at most `enqueue_timeout` seconds when the recipient's queue is full.
+        """
+        try:
+            self._pool.submit(to, to, body, from_, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise DecidePoliticsException(Errors.OUTBOUND_QUEUE_FULL)
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been sent or has failed
+
+        :param float timeout: (Optional) The maximum number of seconds to wait
+
+        :returns: Whether or not the queues were drained
+        """
+        return self._pool.flush(timeout)
+
+    def stop(self, timeout=None):
+        """Send the queued messages and stop the workers"""
+        self._pool.stop(timeout)
+
+    def queue_depth(self):
+        return self._pool.queue_depth()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(sent=self.sent, retried=self.retried, failed=self.failed, rejected=self.rejected)
+        return dict(queue_depth=self.queue_depth(), **counters)
+
+    def _deliver(self, to, body, from_):
+        for chunk in self.sender.split_msg(body):
+            attempt = 0
+            while True:
+                try:
+                    self.sender.send_chunk(to, chunk, from_)
+                    with self._lock:
+                        self.sent += 1
+                    break
+                except Exception as e:
+                    if attempt >= self.max_retries or not self.sender.is_retryable(e):
+                        with self._lock:
+                            self.failed += 1
+                        log.exception("Failed to send SMS to {}".format(to))
+                        # The rest of the message makes no sense without this chunk
+                        return
+
+                    with self._lock:
+                        self.retried += 1
+                    time.sleep(common.exponential_backoff(attempt, base=0.5, cap=30.0))
+                    attempt += 1
@@ -0,0 +1,253 @@
+"""Wall clock sampling profiler for live requests
+
+A sampled request's stack is recorded every `interval` seconds, whether it is running or waiting
+on IO, and written when the request ends as a collapsed stack file, one "frame;frame;frame count"
+line per distinct stack, which flamegraph.pl and speedscope read directly.
+
+Requests are profiled at random with `sample_rate`, or when they carry the configured token:
+
+    curl -H "X-Profile-Token: <token>" ...
+
+Under the eventlet worker every request is a greenlet on the same OS thread, so the sampler runs
+in a real OS thread and reads the frame of each profiled greenlet. It never touches eventlet's hub:
+stacks are only collected there, and written by the request itself.
+"""
+import collections
+import hmac
+import importlib
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+import shared.config as config
+
+log = logging.getLogger(__name__)
+
+# Global profiler, None when profiling is disabled. Initialized at bottom
+profiler = None
+
+TOKEN_HEADER = "X-Profile-Token"
+
+MAX_STACK_DEPTH = 128
+
+_UNSAFE_FILENAME_CHARACTERS = re.compile("[^a-zA-Z0-9_.-]+")
+
+
+def _original(module_name):
+    """Returns a module as it was before eventlet monkey patched it"""
+    try:
+        import eventlet.patcher
+    except ImportError:
+        return importlib.import_module(module_name)
+
+    return eventlet.patcher.original(module_name)
+
+
+def _current_greenlet():
+    """Returns the running greenlet when threads are green, None otherwise"""
+    try:
+        import eventlet.patcher
+        import greenlet
+    except ImportError:
+        return None
+
+    return greenlet.getcurrent() if eventlet.patcher.is_monkey_patched("thread") else None
+
+
+class ProfileSession:
+    """The samples of one profiled request"""
+
+    def __init__(self, name, thread_id, greenlet):
+        self.id = None
+        self.name = name
+        self.thread_id = thread_id
+        self.greenlet = greenlet
+        self.tags = collections.OrderedDict()
+        self.began_at = time.time()
+
+        # Maps a tuple of code objects, outermost first -> the number of samples
+        self.stacks = collections.Counter()
+        self.num_samples = 0
+
+    def sample(self, current_frames):
+        # A waiting greenlet keeps its frame, the running one is the thread's current frame
+        frame = self.greenlet.gr_frame if self.greenlet is not None else None
+        if frame is None:
+            frame = current_frames.get(self.thread_id)
+        if frame is None:
+            return
+
+        codes = []
+        while frame is not None and len(codes) < MAX_STACK_DEPTH:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+
+        self.stacks[tuple(reversed(codes))] += 1
+        self.num_samples += 1
+
+
+class SamplingProfiler:
+    """Samples the stacks of profiled requests from a background OS thread
+
+    Example:
+        session = profiler.start("/sms/handle_sms")
+        ...
+        profiler.stop(session) -> "profiles/20161018T120000_sms_handle_sms_WelcomeTransaction_1.collapsed"
+    """
+
+    def __init__(self, output_dir, interval=0.005, sample_rate=0.0, token=None):
+        """
+        :param str output_dir: The directory the collapsed stack files are written to
+        :param float interval: Seconds between samples
+        :param float sample_rate: The fraction of requests profiled, from 0 to 1
+        :param str token: (Optional) Requests with this token in the `TOKEN_HEADER` header are profiled
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.token = token
+
+        # The sampler must be a real thread and sleep without yielding to eventlet's hub
+        self._threading = _original("threading")
+        self._time = _original("time")
+        self._lock = self._threading.Lock()
+        self._sampler = None
+
+        # Maps id -> the `ProfileSession` being sampled
+        self._sessions = {}
+        self._next_id = 0
+        # The current thread's session (a greenlet's, under eventlet)
+        self._current = threading.local()
+
+        self.profiled = 0
+
+    def should_profile(self, token=None):
+        """Whether or not to profile a request
+
+        :param str token: (Optional) The request's `TOKEN_HEADER` header
+        """
+        if token is not None and self.token is not None and hmac.compare_digest(token, self.token):
+            return True
+
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, name):
+        """Starts sampling the current thread
+
+        :param str name: What is profiled, e.g. the endpoint
+
+        :returns: The `ProfileSession`
+        """
+        session = ProfileSession(name, self._threading.get_ident(), _current_greenlet())
+
+        with self._lock:
+            self._next_id += 1
+            session.id = self._next_id
+            self._sessions[session.id] = session
+
+        self._current.session = session
+        self._start_sampler()
+
+        return session
+
+    def tag(self, key, value):
+        """Tags the current thread's profile, e.g. with the customer's transaction. Does nothing when
+        the thread isn't profiled"""
+        session = getattr(self._current, "session", None)
+        if session is not None:
+            session.tags[key] = value
+
+    def stop(self, session):
+        """Stops sampling and writes the collapsed stacks
+
+        :returns: The path of the written file, None when no samples were taken
+        """
+        with self._lock:
+            self._sessions.pop(session.id, None)
+        self._current.session = None
+
+        if not session.num_samples:
+            return None
+
+        parts = [time.strftime("%Y%m%dT%H%M%S", time.gmtime(session.began_at)), session.name]
+        parts.extend(str(value) for value in session.tags.values())
+        parts.append(str(session.id))
+        filename = "_".join(_UNSAFE_FILENAME_CHARACTERS.sub("_", part).strip("_") for part in parts) + ".collapsed"
+        path = os.path.join(self.output_dir, filename)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(path, "w") as f:
+            for codes, count in session.stacks.most_common():
+                f.write("{} {}\n".format(";".join(_format_code(code) for code in codes), count))
+
+        self.profiled += 1
+        log.info("Wrote {} samples of {} to {}".format(session.num_samples, session.name, path))
+
+        return path
+
+    def stats(self):
+        with self._lock:
+            active = len(self._sessions)
+
+        return dict(active=active, profiled=self.profiled)
+
+    def _start_sampler(self):
+        # Started lazily so that no threads exist before the server forks its workers
+        if self._sampler is not None:
+            return
+
+        with self._lock:
+            if self._sampler is not None:
+                return
+
+            self._sampler = self._threading.Thread(target=self._run_sampler, name="profiler", daemon=True)
+            self._sampler.start()
+
+    def _run_sampler(self):
+        while True:
+            self._time.sleep(self.interval)
+
+            # Held while sampling, so a stopped session is never sampled while it's written
+            with self._lock:
+                if not self._sessions:
+                    continue
+
+                current_frames = sys._current_frames()
+                for session in self._sessions.values():
+                    session.sample(current_frames)
+
+
+def _format_code(code):
+    filename = code.co_filename
+    # Keep the path readable, e.g. "decide_politics/core/models.py" and "boto/dynamodb2/table.py"
+    for marker in ("site-packages" + os.sep, os.getcwd() + os.sep):
+        index = filename.find(marker)
+        if index != -1:
+            filename = filename[index + len(marker):]
+            break
+
+    return "{}:{}".format(filename, code.co_name)
+
+
+def _create_profiler():
+    cnfg = config.store.get("profiler", {})
+    if not cnfg.get("enabled", False):
+        return None
+
+    log.info("Profiling {:.2%} of requests".format(cnfg.get("sample_rate", 0.0)))
+    # Created up front, so that a directory that can't be written fails at startup
+    output_dir = config.data_path(cnfg["output_dir"])
+    os.makedirs(output_dir, exist_ok=True)
+
+    return SamplingProfiler(
+        output_dir,
+        interval=cnfg.get("interval", 0.005),
+        sample_rate=cnfg.get("sample_rate", 0.0),
+        token=cnfg.get("token"),
+    )
+
+profiler = _create_profiler()
@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """A thread-safe token bucket: `rate` tokens are added per second, up to `capacity`
+
+    Example:
+        bucket = TokenBucket(rate=1, capacity=5)  # Bursts of 5, then 1 per second
+        if bucket.try_acquire():
+            send()
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        """
+        :param float rate: The number of tokens added per second
+        :param float capacity: The maximum number of tokens, i.e. the largest burst
+        :param clock: (Optional) A function returning the current time in seconds
+        """
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("rate and capacity must be positive")
+
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if there are enough, without waiting
+
+        :returns: Whether or not the tokens were taken
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+
+            self._tokens -= tokens
+            return True
+
+    def time_until_available(self, tokens=1):
+        """Returns the number of seconds until `tokens` tokens can be taken"""
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
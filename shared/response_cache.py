@@ -0,0 +1,125 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import shared.cache as cache
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Two level cache of API responses: an in-memory LRU backed by an optional SQLite file
+
+    Entries are stored with the time they were fetched, and callers decide whether an entry is
+    fresh enough. The SQLite file survives restarts and can be shared by the server's processes.
+    Rows older than `max_age` are deleted when the file is opened and then every `PRUNE_INTERVAL`
+    seconds, so the file doesn't grow with every response ever fetched. Values must be JSON
+    serializable.
+    """
+
+    PRUNE_INTERVAL = 600
+
+    def __init__(self, max_size=1000, disk_path=None, max_age=None, clock=time.time):
+        """
+        :param int max_size: The maximum number of responses kept in memory
+        :param str disk_path: (Optional) The SQLite file to persist responses to
+        :param float max_age: (Optional) Seconds a response is kept on disk, forever when None
+        :param clock: (Optional) A function returning the current wall clock time in seconds
+        """
+        self.memory = cache.LRUCache(max_size)
+        self.max_age = max_age
+        self._clock = clock
+        self._disk = None
+        self._disk_lock = threading.Lock()
+        self._pruned_at = None
+
+        self.disk_hits = 0
+        self.pruned = 0
+
+        if disk_path is not None:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            with self._disk_lock, self._disk:
+                self._disk.execute("""CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    fetched_at REAL NOT NULL,
+                    value TEXT NOT NULL
+                )""")
+                self._disk.execute("CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at)")
+
+            self.prune()
+
+    def get(self, key):
+        """Returns (seconds since the value was fetched, value), or None if the key is not cached"""
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = self._disk_get(key)
+            if entry is None:
+                return None
+
+            self.memory.put(key, entry)
+
+        fetched_at, value = entry
+        return (self._clock() - fetched_at, value)
+
+    def put(self, key, value):
+        entry = (self._clock(), value)
+        self.memory.put(key, entry)
+
+        if self._disk is not None:
+            try:
+                with self._disk_lock, self._disk:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO responses (key, fetched_at, value) VALUES (?, ?, ?)",
+                        (key, entry[0], json.dumps(value)),
+                    )
+            except sqlite3.Error:
+                # The memory cache still has the value
+                log.exception("Failed to persist cached response")
+
+            if self._pruned_at is not None and self._clock() - self._pruned_at >= self.PRUNE_INTERVAL:
+                self.prune()
+
+    def prune(self):
+        """Deletes the rows older than `max_age` from the disk cache
+
+        :returns: The number of rows deleted
+        """
+        if self._disk is None or self.max_age is None:
+            return 0
+
+        self._pruned_at = self._clock()
+        try:
+            with self._disk_lock, self._disk:
+                deleted = self._disk.execute(
+                    "DELETE FROM responses WHERE fetched_at < ?", (self._pruned_at - self.max_age,)
+                ).rowcount
+        except sqlite3.Error:
+            log.exception("Failed to prune cached responses")
+            return 0
+
+        self.pruned += deleted
+        return deleted
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["pruned"] = self.pruned
+
+        return stats
+
+    def _disk_get(self, key):
+        if self._disk is None:
+            return None
+
+        with self._disk_lock:
+            row = self._disk.execute(
+                "SELECT fetched_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        self.disk_hits += 1
+        return (row[0], json.loads(row[1]))
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+import zlib
+
+import shared.rate_limit as rate_limit
+
+from shared.common import Errors, DecidePoliticsException
+
+log = logging.getLogger(__name__)
+
+
+class SenderPool:
+    """Sends SMS messages from a pool of phone numbers, each rate limited by a token bucket
+
+    Wraps an SMS service (e.g. `TwilioService`) and exposes the same interface, so it can be used
+    directly or behind an `OutboundDispatcher`. Each recipient is assigned a number by rendezvous
+    hashing, so they always hear from the same number and adding a number only moves the
+    recipients it takes over.
+
+    When the recipient's number is out of tokens the send waits for one, for at most `max_wait`
+    seconds. When `strict_sticky` is off the next number in the recipient's ranking is used
+    instead of waiting, if it has a token. Sends that can't get a token in time are rejected.
+    """
+
+    def __init__(self, sender, numbers, rate_per_number=1.0, burst=1, max_wait=5.0, strict_sticky=True,
+            clock=time.monotonic, sleep=time.sleep):
+        """
+        :param sender: The SMS service that sends the messages
+        :param numbers: The phone numbers to send from
+        :param float rate_per_number: The messages per second each number can send
+        :param int burst: The number of messages a number can send at once after being idle
+        :param float max_wait: The maximum number of seconds a send waits for a token
+        :param bool strict_sticky: Whether or not recipients only ever hear from their own number
+        :param clock: (Optional) A function returning the current time in seconds
+        :param sleep: (Optional) A function that waits a number of seconds
+        """
+        if not numbers:
+            raise ValueError("A sender pool needs at least one phone number")
+
+        self.sender = sender
+        self.numbers = list(numbers)
+        self.max_wait = max_wait
+        self.strict_sticky = strict_sticky
+        self._clock = clock
+        self._sleep = sleep
+
+        self.buckets = {number: rate_limit.TokenBucket(rate_per_number, burst, clock=clock)
+            for number in self.numbers}
+        self._lock = threading.Lock()
+
+        self.sent = {number: 0 for number in self.numbers}
+        self.delayed = 0
+        self.fallbacks = 0
+        self.rejected = 0
+
+    def is_connected(self):
+        return self.sender.is_connected()
+
+    def split_msg(self, body):
+        return self.sender.split_msg(body)
+
+    def is_retryable(self, exception):
+        # Worth retrying once the buckets refill
+        if isinstance(exception, DecidePoliticsException):
+            return exception.error_type is Errors.SENDER_RATE_LIMITED
+
+        return self.sender.is_retryable(exception)
+
+    def get_number(self, to):
+        """Returns the number a recipient hears from"""
+        return self._rank_numbers(to)[0]
+
+    def send_chunk(self, to, body, from_=None):
+        """Send a chunk from the recipient's number, `from_` is ignored
+
+        :raises DecidePoliticsException: When no number has a token within `max_wait` seconds
+        """
+        number = self._acquire(to)
+        self.sender.send_chunk(to, body, number)
+
+        with self._lock:
+            self.sent[number] += 1
+
+    def send_msg(self, to, body, from_=None):
+        for chunk in self.split_msg(body):
+            self.send_chunk(to, chunk)
+
+    def stats(self):
+        return dict(
+            sent=dict(self.sent),
+            tokens={number: bucket.available() for number, bucket in self.buckets.items()},
+            delayed=self.delayed,
+            fallbacks=self.fallbacks,
+            rejected=self.rejected,
+        )
+
+    def _rank_numbers(self, to):
+        # Rendezvous hashing: every recipient ranks every number, highest score first
+        key = to.encode("utf-8")
+        return sorted(self.numbers, key=lambda number: zlib.crc32(key + number.encode("utf-8")), reverse=True)
+
+    def _acquire(self, to):
+        ranked = self._rank_numbers(to)
+        candidates = ranked[:1] if self.strict_sticky else ranked
+        deadline = self._clock() + self.max_wait
+
+        while True:
+            for i, number in enumerate(candidates):
+                if self.buckets[number].try_acquire():
+                    if i > 0:
+                        with self._lock:
+                            self.fallbacks += 1
+                    return number
+
+            wait = min(self.buckets[number].time_until_available() for number in candidates)
+            if self._clock() + wait > deadline:
+                with self._lock:
+                    self.rejected += 1
+                raise DecidePoliticsException(Errors.SENDER_RATE_LIMITED)
+
+            with self._lock:
+                self.delayed += 1
+            self._sleep(wait)
@@ -1,14 +1,25 @@
+import atexit
 import enum
 import json
 import logging
 import os
 import requests
+import requests.adapters
+import threading
+import time
 
 import boto.dynamodb2
 from boto.dynamodb2.layer1 import DynamoDBConnection
+from twilio import TwilioRestException
 from twilio.rest import TwilioRestClient
 
+import shared.capacity as capacity
 import shared.config as config
+import shared.metrics as metrics
+import shared.outbound as outbound
+import shared.response_cache as response_cache
+import shared.sender_pool as sender_pool
+import shared.sms_encoding as sms_encoding
 
 log = logging.getLogger(__name__)
 
@@ -23,11 +34,31 @@ twilio = None
 #######################
 
 class MockTwillioService:
+    def __init__(self, latency=0):
+        """
+        :param float latency: (Optional) Seconds each chunk takes to send, to simulate the Twilio API
+        """
+        self.latency = latency
+
     def is_connected(self):
         return True
 
-    def send_msg(self, to, body, _from=config.SERVICE_PHONE_NUMBER):
-        log.info("TEST: Sent SMS to {} from {} with body: {}".format(to, _from, body))
+    def split_msg(self, body):
+        return TwilioService.split_msg(body)
+
+    def is_retryable(self, exception):
+        return False
+
+    def send_chunk(self, to, body, from_=config.SERVICE_PHONE_NUMBER):
+        with metrics.registry.time_call("twilio", "send_chunk"):
+            if self.latency:
+                time.sleep(self.latency)
+
+        log.info("TEST: Sent SMS to {} from {} with body: {}".format(to, from_, body))
+
+    def send_msg(self, to, body, from_=config.SERVICE_PHONE_NUMBER):
+        for msg in self.split_msg(body):
+            self.send_chunk(to, msg, from_)
 
 
 class TwilioService:
@@ -37,25 +68,57 @@ class TwilioService:
     def is_connected(self):
         return len(self.twilio.accounts.list()) > 0
 
-    def send_msg(self, to, body, from_=config.SERVICE_PHONE_NUMBER):
-        sms_chunks = [body[i : i + config.MAX_TWILIO_MSG_SIZE]
-                for i in range(0, len(body), config.MAX_TWILIO_MSG_SIZE)];
+    @staticmethod
+    def split_msg(body):
+        """Split a message into chunks that each fit in a single API call
+
+        The body is transliterated to GSM-7 when possible and split at whitespace into chunks of
+        whole segments, see `sms_encoding.encode`.
+        """
+        return sms_encoding.encode(body).chunks
+
+    def is_retryable(self, exception):
+        """Whether or not a failed `send_chunk` is worth retrying (throttling and server errors)"""
+        if isinstance(exception, TwilioRestException):
+            return exception.status == 429 or exception.status >= 500
+
+        # Connection errors
+        return isinstance(exception, OSError)
 
-        for msg in sms_chunks:
-            self.twilio.messages.create(body=msg, to=to, from_=from_)
+    def send_chunk(self, to, body, from_=config.SERVICE_PHONE_NUMBER):
+        with metrics.registry.time_call("twilio", "send_chunk"):
+            self.twilio.messages.create(body=body, to=to, from_=from_)
+
+    def send_msg(self, to, body, from_=config.SERVICE_PHONE_NUMBER):
+        for msg in self.split_msg(body):
+            self.send_chunk(to, msg, from_)
 
 
 class SunlightFoundationService:
-    """Creates a hybrid service for interacting with both the sunlight REST API and python client"""
+    """Creates a hybrid service for interacting with both the sunlight REST API and python client
+
+    REST requests share a pooled keep-alive session. GET responses are cached per (api, path,
+    params) with a time to live per endpoint (the first segment of the path). A stale response is
+    still served for `stale_ttl` seconds while it is refreshed in the background, and when the API
+    is unreachable.
+    """
 
     TIMEOUT = 5
+    POOL_SIZE = 10
 
     class SunlightAPIs(enum.Enum):
         # Map to the base URL of the API
         CONGRESS = 'congress.api.sunlightfoundation.com'
         OPEN_STATES = 'openstates.org'
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, response_cache=None, default_ttl=300, stale_ttl=3600, ttls=None):
+        """
+        :param str api_key: The Sunlight API key
+        :param response_cache: (Optional) The `ResponseCache` for GET responses, None disables caching
+        :param int default_ttl: Seconds a response stays fresh when its endpoint has no TTL
+        :param int stale_ttl: Seconds past its TTL that a response is served while it is refreshed
+        :param dict ttls: (Optional) Maps an endpoint, e.g. "bills", to the seconds its responses stay fresh
+        """
         self.api_key = api_key
         import sunlight
         self.sunlight_python_client = sunlight
@@ -63,7 +126,20 @@ class SunlightFoundationService:
         # Set up python client with API key
         self.sunlight_python_client.config.API_KEY = self.api_key
 
-    def send_api_request(self, api, method, path, data={}, version=None, **kwargs):
+        # Reuse connections across requests
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE)
+        self.session.mount("https://", adapter)
+
+        self.response_cache = response_cache
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.ttls = ttls or {}
+
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+
+    def send_api_request(self, api, method, path, data={}, version=None, use_cache=True, **kwargs):
         """Send an request to the Sunlight REST API
 
         :param api: The sunlight API to use
@@ -72,38 +148,87 @@ class SunlightFoundationService:
         :param str path: The path to append to the API
         :param dict data: The data to be sent as JSON with the request
         :param int version: The version of this API
+        :param bool use_cache: Whether or not a GET can be answered from the response cache. Reads
+            that must see the latest data, e.g. the bill sync, send the request and skip the cache
         :param kwargs: Optional query parameters
 
         NOTE that if path doesn't have a leading / one will added
 
-        :returns: (status, )
-        :rtype: (int, )
+        :returns: The decoded JSON response
+        :raises requests.exceptions.RequestException: When the request fails
         """
         # Normalizing path
         path = "/{path}/".format(path=path.strip('/'))
 
+        if method != "GET" or self.response_cache is None or not use_cache:
+            return self._send(api, method, path, data, version, kwargs)
+
+        cache_key = json.dumps([api.value, path, version, sorted(kwargs.items())])
+        ttl = self.ttls.get(path.strip("/").split("/")[0], self.default_ttl)
+
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            age, body = cached
+            if age < ttl:
+                return body
+            elif age < ttl + self.stale_ttl:
+                # Serve the stale response and refresh it in the background
+                self._refresh_in_background(cache_key, api, path, version, kwargs)
+                return body
+
+        try:
+            body = self._send(api, method, path, data, version, kwargs)
+        except requests.exceptions.RequestException:
+            if cached is None:
+                raise
+
+            log.exception("Sunlight API request failed, serving a stale response")
+            return cached[1]
+
+        self.response_cache.put(cache_key, body)
+        return body
+
+    def _send(self, api, method, path, data, version, params):
+        params = dict(params)
+
         # Update the query params w/ the right key
         if api == self.SunlightAPIs.CONGRESS:
-            kwargs.update(dict(apikey=self.api_key))
+            params.update(dict(apikey=self.api_key))
         elif api == self.SunlightAPIs.OPEN_STATES:
-            kwargs.update(dict(key=self.api_key))
+            params.update(dict(key=self.api_key))
 
         url = self._create_url(api, path, version=version)
 
-        method_to_request_funcs = dict(
-            GET=requests.get,
-            PUT=requests.put,
-            POST=requests.post,
-        )
+        # Choose a method and send the request, timed per endpoint, e.g. "bills"
+        with metrics.registry.time_call("sunlight", path.strip("/").split("/")[0]):
+            resp = self.session.request(
+                method,
+                url=url,
+                params=params,
+                data=data,
+                timeout=self.TIMEOUT
+            )
+            resp.raise_for_status()
 
-        # Choose a method and send the request
-        http_method_request_func = method_to_request_funcs[method]
-        resp = http_method_request_func(
-            url=url,
-            params=kwargs,
-            data=data,
-            timeout=self.TIMEOUT
-        )
+        return resp.json()
+
+    def _refresh_in_background(self, cache_key, api, path, version, params):
+        with self._refreshing_lock:
+            # Only one refresh per response at a time
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+
+        def refresh():
+            try:
+                self.response_cache.put(cache_key, self._send(api, "GET", path, {}, version, params))
+            except requests.exceptions.RequestException:
+                log.exception("Failed to refresh a Sunlight API response")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(cache_key)
+
+        threading.Thread(target=refresh, daemon=True).start()
 
     def _create_url(self, api, path, version=None):
         """Create the URL for an API request"""
@@ -129,12 +254,13 @@ class GoogleShortenUrlService(object):
         headers = {'Content-Type': 'application/json'}
 
         try:
-            resp = requests.post(
-                self.api_url,
-                data=data,
-                headers=headers,
-                timeout=2.0
-            )
+            with metrics.registry.time_call("shorturl", "shorten_url"):
+                resp = requests.post(
+                    self.api_url,
+                    data=data,
+                    headers=headers,
+                    timeout=2.0
+                )
         except requests.exceptions.RequestException:
             log.exception("Google URL shortener encountered an unexpected exception")
         else:
@@ -153,18 +279,35 @@ class GoogleShortenUrlService(object):
 # Service Initialization #
 ##########################
 
+def _instrument_dynamodb(connection):
+    """Times every request made through a connection, by action (e.g. "Query", "UpdateItem"), and
+    counts the capacity it consumes"""
+    make_request = connection.make_request
+
+    def timed_make_request(action, body):
+        body = capacity.tracker.request_capacity(action, body)
+        with metrics.registry.time_call("dynamodb", action):
+            response = make_request(action, body)
+
+        capacity.tracker.record(action, response)
+        return response
+
+    connection.make_request = timed_make_request
+    return connection
+
+
 def _create_dynamodb():
     cnfg = config.store["dynamodb"]
     if not cnfg["is_testing"]:
         log.info("Creating client for AWS dynamodb instance")
-        return boto.dynamodb2.connect_to_region(
+        connection = boto.dynamodb2.connect_to_region(
             cnfg["region"],
             aws_access_key_id=cnfg["access_key"],
             aws_secret_access_key=cnfg["secret_key"],
         )
     else:
         log.info("Creating client for local dynamodb instance")
-        return DynamoDBConnection(
+        connection = DynamoDBConnection(
             aws_access_key_id='foo',
             aws_secret_access_key='bar',
             host=cnfg["endpoint"]["hostname"],
@@ -172,12 +315,34 @@ def _create_dynamodb():
             is_secure=False
         )
 
+    return _instrument_dynamodb(connection)
+
 
 def _create_sunlight():
     cnfg = config.store["sunlight"]
+    cache_cnfg = cnfg.get("cache")
 
     log.info("Creating client for Sunlight Foundation API")
-    return SunlightFoundationService(cnfg["api_key"])
+    if cache_cnfg is None:
+        return SunlightFoundationService(cnfg["api_key"])
+
+    # Responses past every endpoint's stale window are never served again, unless the API is down
+    ttls = cache_cnfg.get("ttls") or {}
+    max_ttl = max([cache_cnfg["default_ttl"]] + list(ttls.values()))
+    max_age = cache_cnfg.get("max_age", max_ttl + cache_cnfg["stale_ttl"])
+    disk_path = cache_cnfg.get("disk_path")
+
+    return SunlightFoundationService(
+        cnfg["api_key"],
+        response_cache=response_cache.ResponseCache(
+            max_size=cache_cnfg["max_size"],
+            disk_path=config.data_path(disk_path) if disk_path else None,
+            max_age=max_age,
+        ),
+        default_ttl=cache_cnfg["default_ttl"],
+        stale_ttl=cache_cnfg["stale_ttl"],
+        ttls=cache_cnfg.get("ttls"),
+    )
 
 
 def _create_urlshortener():
@@ -193,10 +358,39 @@ def _create_twilio():
     cnfg = config.store["twilio"]
     if not cnfg["is_testing"]:
         log.info("Creating client for Twilio API")
-        return TwilioService(cnfg["account_sid"], cnfg["auth_token"])
+        sender = TwilioService(cnfg["account_sid"], cnfg["auth_token"])
     else:
         log.info("Creating client for mock Twillio")
-        return MockTwillioService()
+        sender = MockTwillioService(latency=cnfg.get("mock_latency", 0))
+
+    pool_cnfg = cnfg.get("sender_pool", {})
+    if pool_cnfg.get("enabled", False):
+        log.info("Sending SMS messages from {} phone numbers".format(len(pool_cnfg["numbers"])))
+        sender = sender_pool.SenderPool(
+            sender,
+            pool_cnfg["numbers"],
+            rate_per_number=pool_cnfg["rate_per_number"],
+            burst=pool_cnfg["burst"],
+            max_wait=pool_cnfg["max_wait"],
+            strict_sticky=pool_cnfg.get("strict_sticky", True),
+        )
+
+    dispatcher_cnfg = cnfg.get("dispatcher", {})
+    if not dispatcher_cnfg.get("enabled", False):
+        return sender
+
+    log.info("Sending SMS messages from {} background workers".format(dispatcher_cnfg["num_workers"]))
+    dispatcher = outbound.OutboundDispatcher(
+        sender,
+        num_workers=dispatcher_cnfg["num_workers"],
+        max_queue_size=dispatcher_cnfg["max_queue_size"],
+        max_retries=dispatcher_cnfg["max_retries"],
+    )
+
+    # Don't drop queued messages on shutdown
+    atexit.register(dispatcher.stop, timeout=dispatcher_cnfg.get("shutdown_timeout", 10))
+
+    return dispatcher
 
 
 # Initialize global services
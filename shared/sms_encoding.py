@@ -0,0 +1,165 @@
+"""SMS encoding and segmentation
+
+Carriers bill and deliver SMS messages in segments. A message that only uses the GSM 03.38
+alphabet is sent as GSM-7 with 160 characters in a single segment, or 153 per segment when it is
+split. A single character outside the alphabet (e.g. a smart quote) turns the whole message into
+UCS-2, with 70 UTF-16 code units in a single segment or 67 per segment.
+"""
+import collections
+import logging
+
+import shared.config as config
+
+log = logging.getLogger(__name__)
+
+GSM7 = "GSM-7"
+UCS2 = "UCS-2"
+
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Sent as an escape character followed by the character, so they take two septets
+GSM7_EXTENSION = frozenset("\f^{}\\[~]|€")
+
+# Characters without a GSM-7 equivalent, mapped to the closest GSM-7 text
+TRANSLITERATIONS = {
+    "‘": "'", "’": "'", "‚": "'", "‛": "'", "′": "'",
+    "“": '"', "”": '"', "„": '"', "‟": '"', "″": '"',
+    "–": "-", "—": "-", "―": "-", "−": "-", "‐": "-", "‑": "-",
+    "…": "...",
+    "\u00a0": " ", "\u2002": " ", "\u2003": " ", "\u2009": " ", "\u200b": "",
+    "•": "-", "·": "-",
+    "\t": " ",
+    "á": "a", "â": "a", "ã": "a", "í": "i", "î": "i", "ï": "i",
+    "ó": "o", "ô": "o", "õ": "o", "ú": "u", "û": "u", "ç": "c",
+    "ê": "e", "ë": "e", "Á": "A", "Í": "I", "Ó": "O", "Ú": "U",
+    "©": "(c)", "®": "(R)", "™": "TM",
+}
+_TRANSLATION_TABLE = str.maketrans(TRANSLITERATIONS)
+
+# (single segment capacity, capacity of each segment of a split message)
+SEGMENT_SIZES = {GSM7: (160, 153), UCS2: (70, 67)}
+
+# Twilio accepts up to 1600 characters per message, but recommends at most 10 segments
+MAX_SEGMENTS_PER_CHUNK = 10
+
+EncodedMessage = collections.namedtuple("EncodedMessage", ["encoding", "chunks", "segments"])
+EncodedMessage.__doc__ = """A message prepared for sending
+
+:ivar str encoding: GSM7 or UCS2
+:ivar list chunks: The bodies to send, one API call each
+:ivar int segments: The number of billed segments across the chunks
+"""
+
+
+def is_gsm7(text):
+    return all(c in GSM7_BASIC or c in GSM7_EXTENSION for c in text)
+
+
+def transliterate(text):
+    """Replaces common characters that aren't in the GSM-7 alphabet, e.g. smart quotes"""
+    return text.translate(_TRANSLATION_TABLE)
+
+
+def _unit_cost(c, encoding):
+    if encoding == GSM7:
+        return 2 if c in GSM7_EXTENSION else 1
+
+    # Characters outside the basic multilingual plane are a UTF-16 surrogate pair
+    return 2 if ord(c) > 0xFFFF else 1
+
+
+def count_segments(text, encoding=None):
+    """Returns the number of segments a message is billed as"""
+    encoding = encoding or (GSM7 if is_gsm7(text) else UCS2)
+    single, multi = SEGMENT_SIZES[encoding]
+
+    units = sum(_unit_cost(c, encoding) for c in text)
+    if units <= single:
+        return 1 if text else 0
+
+    # Escape sequences and surrogate pairs are never split across segments
+    segments = 1
+    used = 0
+    for c in text:
+        cost = _unit_cost(c, encoding)
+        if used + cost > multi:
+            segments += 1
+            used = 0
+        used += cost
+
+    return segments
+
+
+def encode(body, transliterate_text=True, max_segments_per_chunk=MAX_SEGMENTS_PER_CHUNK):
+    """Prepares a message body for sending with as few segments and API calls as possible
+
+    The body is transliterated to GSM-7 when possible, then split into chunks of at most
+    `max_segments_per_chunk` full segments, breaking at whitespace when there is any.
+
+    :returns: An `EncodedMessage`
+    """
+    if transliterate_text:
+        transliterated = transliterate(body)
+        if is_gsm7(transliterated):
+            body = transliterated
+
+    encoding = GSM7 if is_gsm7(body) else UCS2
+    chunks = _split(body, encoding, max_segments_per_chunk)
+
+    return EncodedMessage(encoding, chunks, sum(count_segments(chunk, encoding) for chunk in chunks))
+
+
+def _split(body, encoding, max_segments):
+    single, multi = SEGMENT_SIZES[encoding]
+    capacity = max(single, multi * max_segments)
+
+    chunks = []
+    start = 0
+    while start < len(body):
+        # Find the furthest end that fits, in code units and in Twilio's character limit
+        end = start
+        units = 0
+        while end < len(body) and end - start < config.MAX_TWILIO_MSG_SIZE:
+            cost = _unit_cost(body[end], encoding)
+            if units + cost > capacity:
+                break
+            units += cost
+            end += 1
+
+        if end < len(body):
+            # Break after the last whitespace, unless the chunk is one long word
+            space = max(body.rfind(" ", start, end), body.rfind("\n", start, end))
+            if space > start:
+                end = space + 1
+
+        chunks.append(body[start:end])
+        start = end
+
+    return chunks
+
+
+def check_templates(templates, max_segments=1):
+    """Logs the encoding and segment count of outbound message templates
+
+    Run at startup so the cost and throughput of each message is known before it is sent.
+
+    :param dict templates: Maps a template name -> the message template
+    :param int max_segments: Templates with more segments are logged as warnings
+
+    :returns: A dict of template name -> `EncodedMessage`
+    """
+    report = {}
+    for name, template in sorted(templates.items()):
+        encoded = encode(template)
+        report[name] = encoded
+
+        if encoded.encoding == UCS2:
+            log.warning("Message template {} is sent as UCS-2: {}".format(name, template))
+        elif encoded.segments > max_segments:
+            log.warning("Message template {} is {} segments".format(name, encoded.segments))
+        else:
+            log.info("Message template {} is {} {} segment(s)".format(name, encoded.segments, encoded.encoding))
+
+    return report
@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+# Tells a worker to exit
+_STOP = object()
+
+
+class ShardedWorkerPool:
+    """A pool of worker threads, each draining its own bounded queue
+
+    Work is assigned to a worker by hashing a shard key, so all work with the same key (e.g. a
+    phone number) is handled in submission order by a single worker while different keys are
+    handled in parallel. Under the eventlet gunicorn worker the threads and queues are green.
+
+    Example:
+        pool = ShardedWorkerPool(send, num_workers=4)
+        pool.submit("+15419670010", "+15419670010", "Hello!")  # Calls send("+15419670010", "Hello!")
+        pool.flush()
+    """
+
+    def __init__(self, handler, num_workers=4, max_queue_size=1000, name="worker"):
+        """
+        :param handler: The function called with the arguments of each submission
+        :param int num_workers: The number of worker threads
+        :param int max_queue_size: The maximum number of pending submissions across all workers
+        :param str name: The prefix of the worker thread names
+        """
+        self.handler = handler
+        self.num_workers = num_workers
+        self.name = name
+
+        self._queues = [queue.Queue(maxsize=max(1, max_queue_size // num_workers))
+            for _ in range(num_workers)]
+        self._workers = []
+        self._workers_lock = threading.Lock()
+
+    def submit(self, shard_key, *args, timeout=None):
+        """Queue `handler(*args)` on the worker that owns `shard_key`
+
+        :raises queue.Full: When the worker's queue stays full for `timeout` seconds
+        """
+        self._start_workers()
+
+        work_queue = self._queues[zlib.crc32(shard_key.encode("utf-8")) % self.num_workers]
+        work_queue.put(args, timeout=timeout)
+
+    def flush(self, timeout=None):
+        """Wait until every submission has been handled
+
+        :param float timeout: (Optional) The maximum number of seconds to wait
+
+        :returns: Whether or not the queues were drained
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for work_queue in self._queues:
+            # `Queue.join` has no timeout, so poll the unfinished task count instead
+            while work_queue.unfinished_tasks:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.005)
+
+        return True
+
+    def stop(self, timeout=None):
+        """Handle the pending submissions and stop the workers"""
+        self.flush(timeout)
+
+        with self._workers_lock:
+            for work_queue in self._queues[:len(self._workers)]:
+                work_queue.put(_STOP)
+            self._workers = []
+
+    def queue_depth(self):
+        return sum(work_queue.qsize() for work_queue in self._queues)
+
+    def _start_workers(self):
+        # Started lazily so that no threads exist before the server forks its workers
+        if self._workers:
+            return
+
+        with self._workers_lock:
+            if self._workers:
+                return
+
+            for i, work_queue in enumerate(self._queues):
+                worker = threading.Thread(
+                    target=self._run_worker,
+                    args=(work_queue,),
+                    name="{}-{}".format(self.name, i),
+                    daemon=True,
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _run_worker(self, work_queue):
+        while True:
+            args = work_queue.get()
+            try:
+                if args is _STOP:
+                    return
+
+                self.handler(*args)
+            except Exception:
+                log.exception("Unhandled exception in {}".format(threading.current_thread().name))
+            finally:
+                work_queue.task_done()
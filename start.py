@@ -11,4 +11,8 @@ FLASK_COMMAND = "python3 -m flask run --host={host_name} --port={port}".format(
     port=config.store['api_host']['port'],
 )
 
+# Keeps the local bill catalog up to date
+SYNC_COMMAND = "python3 -m sunlight_api.sync"
+
 print ("Flask Command: \"{flask_command}\"".format(flask_command=FLASK_COMMAND))
+print ("Bill Sync Command: \"{sync_command}\"".format(sync_command=SYNC_COMMAND))
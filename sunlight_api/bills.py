@@ -1,7 +1,86 @@
-import models.bill as bill
-from sunlight import congress
+import concurrent.futures
+import itertools
 
-def get_recent_bills():
-    bills_list = congress.bills()
+import shared.service as service
+import sunlight_api.catalog as catalog
+import sunlight_api.models.bill as bill
 
-    return [ bill.Bill(bill_json) for bill_json in bills_list ]
+# The largest page the Congress API serves
+MAX_PAGE_SIZE = 50
+
+
+def get_recent_bills(limit=20):
+    # Read the local copy when there is one
+    if catalog.bill_catalog is not None:
+        return catalog.bill_catalog.get_recent_bills(limit)
+
+    return list(itertools.islice(iter_bills(order="last_action_at__desc"), limit))
+
+
+def iter_bills(updated_since=None, page_size=MAX_PAGE_SIZE, prefetch=True, order="last_action_at__asc",
+        use_cache=True, **filters):
+    """Lazily yields every bill matching the filters, one page of the API at a time
+
+    Only the current page (and the next one, when prefetching) is held in memory. Stop iterating
+    or close the generator to stop fetching pages.
+
+    Example:
+        for b in iter_bills(updated_since="2016-01-01", congress=114):
+            ...
+
+    :param str updated_since: (Optional) Only yield bills with an action on or after this ISO 8601 date
+    :param int page_size: The number of bills per request
+    :param bool prefetch: Whether or not the next page is fetched while the current one is consumed
+    :param str order: The order of the bills, ascending by last action so `updated_since` can be resumed
+    :param bool use_cache: Whether or not pages can be served from the Sunlight response cache
+    :param filters: Optional query parameters of the bills endpoint
+
+    :returns: A generator of `bill.Bill`
+    """
+    params = dict(filters)
+    params.update(order=order, per_page=min(page_size, MAX_PAGE_SIZE), fields=",".join(bill.Bill.FIELDS))
+    if updated_since is not None:
+        params["last_action_at__gte"] = updated_since
+
+    for page in _iter_pages(params, prefetch, use_cache):
+        for bill_json in page:
+            yield bill.Bill(bill_json)
+
+
+def _fetch_page(params, page, use_cache=True):
+    resp = service.sunlight.send_api_request(
+        service.SunlightFoundationService.SunlightAPIs.CONGRESS, "GET", "bills", use_cache=use_cache, page=page, **params)
+
+    return resp["results"]
+
+
+def _iter_pages(params, prefetch, use_cache):
+    if not prefetch:
+        page = 1
+        while True:
+            results = _fetch_page(params, page, use_cache)
+            if results:
+                yield results
+            if len(results) < params["per_page"]:
+                return
+            page += 1
+
+    # A single worker bounds the prefetch to one page
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    page = 1
+    next_results = executor.submit(_fetch_page, params, page, use_cache)
+    try:
+        while True:
+            results = next_results.result()
+            if len(results) < params["per_page"]:
+                if results:
+                    yield results
+                return
+
+            page += 1
+            next_results = executor.submit(_fetch_page, params, page, use_cache)
+            yield results
+    finally:
+        # Runs when the caller stops early too, an in flight fetch is left to finish on its own
+        next_results.cancel()
+        executor.shutdown(wait=False)
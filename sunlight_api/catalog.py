@@ -0,0 +1,125 @@
+import logging
+import sqlite3
+import threading
+
+import shared.config as config
+import sunlight_api.models.bill as bill
+
+log = logging.getLogger(__name__)
+
+# Global catalog, None when it isn't configured. Initalized at bottom
+bill_catalog = None
+
+
+class BillCatalog:
+    """A local SQLite copy of the bills, kept up to date by `sunlight_api.sync`
+
+    Bill lookups read the catalog instead of waiting on the Sunlight API. The catalog also stores
+    the sync's high-water mark: the latest `last_action_at` that has been synced.
+    """
+
+    HIGH_WATER_MARK = "bills_high_water_mark"
+
+    def __init__(self, path):
+        """
+        :param str path: The SQLite file, ":memory:" for a throwaway catalog
+        """
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        columns = ", ".join(bill.Bill.__slots__[1:])
+        self._upsert_sql = "INSERT OR REPLACE INTO bills (bill_id, {}) VALUES ({})".format(
+            columns, ", ".join("?" * len(bill.Bill.__slots__)))
+        self._select_sql = "SELECT bill_id, {} FROM bills".format(columns)
+
+        with self._lock, self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS bills (
+                bill_id TEXT PRIMARY KEY,
+                {}
+            )""".format(columns))
+            self._db.execute("CREATE INDEX IF NOT EXISTS bills_last_action_at ON bills (last_action_at)")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )""")
+
+            # Catalogs created before a column was added to `bill.Bill` are migrated in place. Their
+            # bills have no value for it, so the high-water mark is reset to sync every bill again
+            existing_columns = {row[1] for row in self._db.execute("PRAGMA table_info(bills)")}
+            missing_columns = [name for name in bill.Bill.__slots__ if name not in existing_columns]
+            for name in missing_columns:
+                self._db.execute("ALTER TABLE bills ADD COLUMN {}".format(name))
+            if missing_columns:
+                log.info("Added the columns {} to the bill catalog".format(", ".join(missing_columns)))
+                self._db.execute("DELETE FROM sync_state WHERE name = ?", (self.HIGH_WATER_MARK,))
+
+    def upsert_bills(self, bills, high_water_mark=None):
+        """Inserts or replaces bills, and the high-water mark, in a single transaction
+
+        :param bills: An iterable of `bill.Bill`
+        :param str high_water_mark: (Optional) The new high-water mark
+        """
+        with self._lock, self._db:
+            self._db.executemany(self._upsert_sql, (b.to_row() for b in bills))
+            if high_water_mark is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)",
+                    (self.HIGH_WATER_MARK, high_water_mark),
+                )
+
+    def get_high_water_mark(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM sync_state WHERE name = ?", (self.HIGH_WATER_MARK,)
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def get_bill(self, bill_id):
+        """Returns the `bill.Bill` with this id, or None"""
+        with self._lock:
+            row = self._db.execute(self._select_sql + " WHERE bill_id = ?", (bill_id,)).fetchone()
+
+        return None if row is None else bill.Bill.from_row(row)
+
+    def get_recent_bills(self, limit=20):
+        """Returns the bills with the latest actions, latest first"""
+        with self._lock:
+            rows = self._db.execute(
+                self._select_sql + " ORDER BY last_action_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+        return [bill.Bill.from_row(row) for row in rows]
+
+    def iter_bills(self, batch_size=1000):
+        """Yields every bill, reading `batch_size` bills at a time"""
+        last_bill_id = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    self._select_sql + " WHERE bill_id > ? ORDER BY bill_id LIMIT ?",
+                    (last_bill_id, batch_size),
+                ).fetchall()
+
+            for row in rows:
+                yield bill.Bill.from_row(row)
+
+            if len(rows) < batch_size:
+                return
+            last_bill_id = rows[-1][0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM bills").fetchone()[0]
+
+
+def _create_bill_catalog():
+    cnfg = config.store.get("bill_catalog")
+    if cnfg is None:
+        return None
+
+    path = config.data_path(cnfg["path"])
+    log.info("Using the local bill catalog at {}".format(path))
+    return BillCatalog(path)
+
+bill_catalog = _create_bill_catalog()
@@ -0,0 +1,255 @@
+"""Precomputed lookup from zip code to congressional districts to legislators
+
+The lookup is built offline into a file that the server memory maps:
+
+    POLITI_HACK_CONFIG_PATH=config.json python3 -m sunlight_api.districts zips.csv legislators.csv districts.bin
+
+`zips.csv` has the columns zip, state and district, one row per district a zip code overlaps.
+`legislators.csv` is the current legislators file of github.com/unitedstates/congress-legislators,
+only the first_name, last_name, type, state, district and bioguide_id columns are used.
+
+The server reloads the file when a new one is moved into place.
+"""
+import argparse
+import array
+import bisect
+import csv
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import shared.config as config
+import sunlight_api.models.legistlator as legistlator
+
+log = logging.getLogger(__name__)
+
+# Global lookup, None when it isn't configured. Initalized at bottom
+district_lookup = None
+
+# File layout: header, the sorted zip codes, the offsets of each zip code's districts, the
+# district numbers, then the districts and their legislators as JSON. Arrays are native uint32.
+MAGIC = b"ZDL1"
+HEADER = struct.Struct("<4sIIII")  # magic, byte order, num zip codes, num district refs, JSON size
+BYTE_ORDER = 1 if sys.byteorder == "little" else 2
+
+
+class DistrictTable:
+    """A read only, memory mapped zip code -> districts -> legislators table
+
+    Example:
+        table = DistrictTable("districts.bin")
+        table.get_districts("94110") -> [("CA", 12)]
+        table.get_legistlators("94110") -> [Legistlator(Nancy Pelosi), ...]
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, byte_order, num_zips, num_refs, json_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or byte_order != BYTE_ORDER:
+            raise ValueError("{} is not a district table for this machine".format(path))
+
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        self._zips = view[offset : offset + 4 * num_zips].cast("I")
+        offset += 4 * num_zips
+        self._offsets = view[offset : offset + 4 * (num_zips + 1)].cast("I")
+        offset += 4 * (num_zips + 1)
+        self._refs = view[offset : offset + 4 * num_refs].cast("I")
+        offset += 4 * num_refs
+
+        # A few hundred districts, decoded once so lookups don't create objects
+        districts = json.loads(bytes(view[offset : offset + json_size]).decode("utf-8"))
+        self._districts = [(d["state"], d["district"]) for d in districts]
+        # Senators are shared by every district of their state
+        shared = {}
+        self._legistlators = [
+            tuple(shared.setdefault(json.dumps(l, sort_keys=True), legistlator.Legistlator(l))
+                for l in d["legislators"])
+            for d in districts
+        ]
+
+    def _district_numbers(self, zip_code):
+        try:
+            key = int(zip_code[:5])
+        except (TypeError, ValueError):
+            return ()
+
+        i = bisect.bisect_left(self._zips, key)
+        if i == len(self._zips) or self._zips[i] != key:
+            return ()
+
+        return self._refs[self._offsets[i] : self._offsets[i + 1]]
+
+    def get_districts(self, zip_code):
+        """Returns the (state, district) pairs overlapping a zip code, [] for unknown zip codes"""
+        return [self._districts[number] for number in self._district_numbers(zip_code)]
+
+    def get_legistlators(self, zip_code):
+        """Returns the representatives and senators of a zip code, [] for unknown zip codes"""
+        result = []
+        for number in self._district_numbers(zip_code):
+            for l in self._legistlators[number]:
+                # Districts in the same state share senators
+                if l not in result:
+                    result.append(l)
+
+        return result
+
+    def __len__(self):
+        return len(self._zips)
+
+
+class DistrictLookup:
+    """Serves lookups from the current `DistrictTable`, reloading it when the file is replaced
+
+    The file is checked at most every `reload_interval` seconds. A new table is loaded before it
+    replaces the current one, so lookups never see a partially loaded table.
+    """
+
+    def __init__(self, path, reload_interval=60, clock=time.monotonic):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._file_id = self._stat()
+        self.table = DistrictTable(path)
+        self._checked_at = clock()
+
+    def get_districts(self, zip_code):
+        return self._current_table().get_districts(zip_code)
+
+    def get_legistlators(self, zip_code):
+        return self._current_table().get_legistlators(zip_code)
+
+    def reload_if_changed(self):
+        """Loads the file if it was replaced since it was last loaded
+
+        :returns: Whether or not a new table was loaded
+        """
+        with self._lock:
+            self._checked_at = self._clock()
+            try:
+                file_id = self._stat()
+                if file_id == self._file_id:
+                    return False
+
+                table = DistrictTable(self.path)
+            except (OSError, ValueError):
+                log.exception("Failed to reload the district table, still using the previous one")
+                return False
+
+            self.table, self._file_id = table, file_id
+            log.info("Reloaded the district table at {}".format(self.path))
+
+            return True
+
+    def _current_table(self):
+        if self._clock() - self._checked_at >= self.reload_interval:
+            self.reload_if_changed()
+
+        return self.table
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def build_table(zip_rows, legislator_rows, path):
+    """Writes a district table file, replacing `path` atomically
+
+    :param zip_rows: An iterable of dicts with zip, state and district keys
+    :param legislator_rows: An iterable of dicts in the congress-legislators CSV format
+    :param str path: The file to write
+    """
+    senators = {}
+    representatives = {}
+    for row in legislator_rows:
+        info = dict(
+            first_name=row["first_name"],
+            last_name=row["last_name"],
+            bioguide_id=row.get("bioguide_id"),
+            state=row["state"],
+        )
+        if row["type"] == "sen":
+            senators.setdefault(row["state"], []).append(dict(info, chamber="senate"))
+        else:
+            district = int(row["district"] or 0)
+            representatives.setdefault((row["state"], district), []).append(
+                dict(info, chamber="house", district=district))
+
+    districts = []
+    district_numbers = {}
+    zip_districts = {}
+    for row in zip_rows:
+        district = (row["state"], int(row["district"] or 0))
+        if district not in district_numbers:
+            district_numbers[district] = len(districts)
+            districts.append(dict(
+                state=district[0],
+                district=district[1],
+                legislators=representatives.get(district, []) + senators.get(district[0], []),
+            ))
+
+        numbers = zip_districts.setdefault(int(row["zip"]), [])
+        if district_numbers[district] not in numbers:
+            numbers.append(district_numbers[district])
+
+    zips = array.array("I", sorted(zip_districts))
+    offsets = array.array("I", [0])
+    refs = array.array("I")
+    for zip_code in zips:
+        refs.extend(zip_districts[zip_code])
+        offsets.append(len(refs))
+    districts_json = json.dumps(districts).encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, BYTE_ORDER, len(zips), len(refs), len(districts_json)))
+        f.write(zips.tobytes())
+        f.write(offsets.tobytes())
+        f.write(refs.tobytes())
+        f.write(districts_json)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Servers pick up the new file on their next check
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the zip code to legislator lookup table")
+    parser.add_argument("zips", help="CSV with zip, state and district columns")
+    parser.add_argument("legislators", help="congress-legislators CSV of the current legislators")
+    parser.add_argument("output", help="The table file to write")
+    args = parser.parse_args()
+
+    with open(args.zips, newline="") as zips, open(args.legislators, newline="") as legislators:
+        build_table(csv.DictReader(zips), csv.DictReader(legislators), args.output)
+
+
+def _create_district_lookup():
+    cnfg = config.store.get("districts")
+    if cnfg is None:
+        return None
+
+    path = config.data_path(cnfg["path"])
+    if not os.path.exists(path):
+        log.warning("There is no district table at {}, districts won't be looked up".format(path))
+        return None
+
+    log.info("Using the district table at {}".format(path))
+    return DistrictLookup(path, cnfg.get("reload_interval", 60))
+
+district_lookup = _create_district_lookup()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,62 @@
 class Bill(object):
+    """A compact view of a bill from the Sunlight Congress API
+
+    Only the fields DecidePolitics uses are kept, the rest of the API's JSON is dropped.
+    """
+
+    # The fields requested from the API
+    FIELDS = (
+        "bill_id",
+        "congress",
+        "chamber",
+        "official_title",
+        "short_title",
+        "popular_title",
+        "summary_short",
+        "keywords",
+        "sponsor_id",
+        "introduced_on",
+        "last_action_at",
+        "urls",
+    )
+
+    __slots__ = (
+        "bill_id",
+        "congress",
+        "chamber",
+        "title",
+        "summary",
+        "subjects",
+        "sponsor_id",
+        "introduced_on",
+        "last_action_at",
+        "url",
+    )
 
     def __init__(self, json):
+        self.bill_id = json['bill_id']
+        self.congress = json.get('congress')
+        self.chamber = json.get('chamber')
+        self.title = json.get('short_title') or json.get('popular_title') or json.get('official_title')
+        self.summary = json.get('summary_short')
+        # Stored as one string, a list per bill costs more memory than the rest of the bill
+        self.subjects = "; ".join(json.get('keywords') or ())
+        self.sponsor_id = json.get('sponsor_id')
+        self.introduced_on = json.get('introduced_on')
+        self.last_action_at = json.get('last_action_at')
+        self.url = (json.get('urls') or {}).get('congress')
+
+    @classmethod
+    def from_row(cls, row):
+        """Creates a bill from a tuple of its attributes, in `__slots__` order"""
+        b = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, row):
+            setattr(b, name, value)
+
+        return b
+
+    def to_row(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
 
+    def __repr__(self):
+        return "Bill({})".format(self.bill_id)
@@ -1,6 +1,23 @@
 class Legistlator(object):
 
+    __slots__ = (
+        "first_name",
+        "last_name",
+        "email",
+        "bioguide_id",
+        "chamber",
+        "state",
+        "district",
+    )
+
     def __init__(self, json):
         self.first_name = json['first_name']
         self.last_name = json['last_name']
-        self.email = json['oc_email']
+        self.email = json.get('oc_email')
+        self.bioguide_id = json.get('bioguide_id')
+        self.chamber = json.get('chamber')
+        self.state = json.get('state')
+        self.district = json.get('district')
+
+    def __repr__(self):
+        return "Legistlator({} {})".format(self.first_name, self.last_name)
@@ -1,12 +1,24 @@
-import models.legistlator as legistlator
-
-from sunlight import congress
+import shared.service as service
+import sunlight_api.districts as districts
+import sunlight_api.models.legistlator as legistlator
 
 def get_legistlator(last_name):
-    results = congress.legislators(last_name=last_name)
+    resp = service.sunlight.send_api_request(
+        service.SunlightFoundationService.SunlightAPIs.CONGRESS, "GET", "legislators", last_name=last_name)
+    results = resp["results"]
 
     if results:
         return legistlator.Legistlator(results[0])
     else:
         # TODO: throw exception
         return False
+
+def get_legistlators_for_zip(zip_code):
+    """Returns the representatives and senators of a zip code without any API calls
+
+    Returns [] when the zip code is unknown or the district table isn't configured.
+    """
+    if districts.district_lookup is None:
+        return []
+
+    return districts.district_lookup.get_legistlators(zip_code)
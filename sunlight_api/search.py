@@ -0,0 +1,298 @@
+import array
+import heapq
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+import shared.config as config
+
+log = logging.getLogger(__name__)
+
+# Global read only index, reloaded when the sync replaces the file. None when there is no index
+# file. Initalized at bottom
+bill_index = None
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_REGEX = re.compile("[a-z0-9]+")
+STOP_WORDS = frozenset((
+    "a", "an", "and", "act", "as", "at", "be", "bill", "by", "for", "from", "in", "is", "it", "of",
+    "on", "or", "other", "purposes", "the", "to", "with",
+))
+
+# File layout: header, then each section padded to 4 bytes. Arrays are native uint32.
+MAGIC = b"BIX1"
+HEADER = struct.Struct("<4sIIIId")  # magic, num docs, num terms, num postings, byte order, avg doc length
+BYTE_ORDER = 1 if sys.byteorder == "little" else 2
+
+
+def tokenize(text):
+    """Lower cases text and splits it into searchable terms"""
+    return [token for token in TOKEN_REGEX.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def bill_terms(b):
+    return tokenize(" ".join(filter(None, (b.title, b.summary, b.subjects))))
+
+
+def _idf(num_docs, doc_freq):
+    return math.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def _top_k(scores, k):
+    return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class BillIndex:
+    """An in-memory inverted index over bill titles, summaries and subjects, ranked with BM25
+
+    Bills can be added, replaced and removed as they sync in. `save` writes a compact file that
+    `MappedBillIndex` memory maps, so the server's workers share one copy of the postings.
+
+    Example:
+        index = BillIndex()
+        index.add_bill(b)
+        index.search("health care", k=5) -> [(bill_id, score), ...]
+    """
+
+    def __init__(self):
+        # Maps term -> {bill_id: term frequency}
+        self.postings = {}
+        # Maps bill_id -> (doc length, unique terms), the terms are kept to remove the bill
+        self.docs = {}
+        self.total_length = 0
+
+    def add_bill(self, b):
+        """Indexes a bill, replacing the previous version of it"""
+        self.remove_bill(b.bill_id)
+
+        terms = bill_terms(b)
+        freqs = {}
+        for term in terms:
+            freqs[term] = freqs.get(term, 0) + 1
+
+        for term, freq in freqs.items():
+            self.postings.setdefault(term, {})[b.bill_id] = freq
+
+        self.docs[b.bill_id] = (len(terms), tuple(freqs))
+        self.total_length += len(terms)
+
+    def remove_bill(self, bill_id):
+        doc = self.docs.pop(bill_id, None)
+        if doc is None:
+            return
+
+        length, terms = doc
+        self.total_length -= length
+        for term in terms:
+            posting = self.postings[term]
+            del posting[bill_id]
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query, k=10):
+        """Returns the ids and scores of the `k` best matching bills, best first"""
+        num_docs = len(self.docs)
+        if not num_docs:
+            return []
+
+        length_weight = B / ((self.total_length / num_docs) or 1)
+        docs = self.docs
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+
+            idf = _idf(num_docs, len(posting)) * (K1 + 1)
+            for bill_id, freq in posting.items():
+                norm = K1 * (1 - B + length_weight * docs[bill_id][0])
+                scores[bill_id] = scores.get(bill_id, 0.0) + idf * freq / (freq + norm)
+
+        return _top_k(scores, k)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def save(self, path):
+        """Writes the index for `MappedBillIndex`, replacing the file atomically"""
+        bill_ids = sorted(self.docs)
+        doc_numbers = {bill_id: i for i, bill_id in enumerate(bill_ids)}
+        terms = sorted(self.postings)
+
+        lengths = array.array("I", (self.docs[bill_id][0] for bill_id in bill_ids))
+        offsets = array.array("I", [0])
+        docs = array.array("I")
+        freqs = array.array("I")
+        for term in terms:
+            for bill_id, freq in sorted(self.postings[term].items()):
+                docs.append(doc_numbers[bill_id])
+                freqs.append(freq)
+            offsets.append(len(docs))
+
+        num_docs = len(bill_ids)
+        avg_length = self.total_length / num_docs if num_docs else 0.0
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, num_docs, len(terms), len(docs), BYTE_ORDER, avg_length))
+            for section in (
+                "\n".join(bill_ids).encode("utf-8"),
+                "\n".join(terms).encode("utf-8"),
+                lengths.tobytes(),
+                offsets.tobytes(),
+                docs.tobytes(),
+                freqs.tobytes(),
+            ):
+                f.write(struct.pack("<I", len(section)))
+                f.write(section)
+                f.write(b"\0" * (-len(section) % 4))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+
+
+class MappedBillIndex:
+    """A read only `BillIndex` served from a memory mapped file
+
+    Only the term and bill id tables are decoded on load. The postings are read in place, so
+    loading is fast and every process mapping the file shares the same pages.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_docs, num_terms, num_postings, byte_order, self.avg_length = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or byte_order != BYTE_ORDER:
+            raise ValueError("{} is not a bill index for this machine".format(path))
+
+        view = memoryview(self._mmap)
+        sections = []
+        offset = HEADER.size
+        for _ in range(6):
+            (size,) = struct.unpack_from("<I", self._mmap, offset)
+            offset += 4
+            sections.append(view[offset : offset + size])
+            offset += size + (-size % 4)
+
+        bill_ids, terms, lengths, offsets, docs, freqs = sections
+        self.bill_ids = bytes(bill_ids).decode("utf-8").split("\n") if self.num_docs else []
+        self.terms = {term: i for i, term in enumerate(bytes(terms).decode("utf-8").split("\n"))} \
+            if num_terms else {}
+        self.lengths = lengths.cast("I")
+        self.offsets = offsets.cast("I")
+        self.docs = docs.cast("I")
+        self.freqs = freqs.cast("I")
+
+        # The BM25 length normalization of each bill, it never changes for a read only index
+        length_weight = B / (self.avg_length or 1)
+        self.norms = array.array("d", (K1 * (1 - B + length_weight * length) for length in self.lengths))
+
+    def search(self, query, k=10):
+        """Returns the ids and scores of the `k` best matching bills, best first"""
+        scores = {}
+        for term in set(tokenize(query)):
+            term_number = self.terms.get(term)
+            if term_number is None:
+                continue
+
+            start, end = self.offsets[term_number], self.offsets[term_number + 1]
+            idf = _idf(self.num_docs, end - start) * (K1 + 1)
+            norms = self.norms
+            for doc, freq in zip(self.docs[start:end], self.freqs[start:end]):
+                scores[doc] = scores.get(doc, 0.0) + idf * freq / (freq + norms[doc])
+
+        return [(self.bill_ids[doc], score) for doc, score in _top_k(scores, k)]
+
+    def __len__(self):
+        return self.num_docs
+
+
+class BillIndexLookup:
+    """Serves searches from the current `MappedBillIndex`, reloading it when the file is replaced
+
+    The sync saves a new index file after every run. The file is checked at most every
+    `reload_interval` seconds, and a new index is loaded before it replaces the current one.
+    """
+
+    def __init__(self, path, reload_interval=60, clock=time.monotonic):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._file_id = self._stat()
+        self.index = MappedBillIndex(path)
+        self._checked_at = clock()
+
+    def search(self, query, k=10):
+        return self._current_index().search(query, k)
+
+    def reload_if_changed(self):
+        """Loads the file if it was replaced since it was last loaded
+
+        :returns: Whether or not a new index was loaded
+        """
+        with self._lock:
+            self._checked_at = self._clock()
+            try:
+                file_id = self._stat()
+                if file_id == self._file_id:
+                    return False
+
+                index = MappedBillIndex(self.path)
+            except (OSError, ValueError, struct.error):
+                log.exception("Failed to reload the bill index, still using the previous one")
+                return False
+
+            self.index, self._file_id = index, file_id
+            log.info("Reloaded the bill index at {}".format(self.path))
+
+            return True
+
+    def _current_index(self):
+        if self._clock() - self._checked_at >= self.reload_interval:
+            self.reload_if_changed()
+
+        return self.index
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def __len__(self):
+        return len(self._current_index())
+
+
+def search_bills(query, k=10):
+    """Returns the ids of the bills best matching a query, or [] when there is no index"""
+    if bill_index is None:
+        return []
+
+    return [bill_id for bill_id, _ in bill_index.search(query, k)]
+
+
+def _load_bill_index():
+    cnfg = config.store.get("bill_catalog", {})
+    if cnfg.get("index_path") is None:
+        return None
+
+    path = config.data_path(cnfg["index_path"])
+    if not os.path.exists(path):
+        return None
+
+    log.info("Loading the bill index at {}".format(path))
+    return BillIndexLookup(path, cnfg.get("index_reload_interval", 60))
+
+bill_index = _load_bill_index()
@@ -0,0 +1,102 @@
+"""Copies the bills that changed since the last sync into the local bill catalog
+
+Usage: POLITI_HACK_CONFIG_PATH=config.json python3 -m sunlight_api.sync [--once]
+"""
+import argparse
+import logging
+import time
+
+import shared.config as config
+import sunlight_api.bills as bills
+import sunlight_api.catalog as catalog
+import sunlight_api.search as search
+
+log = logging.getLogger(__name__)
+
+# The number of bills written per transaction
+BATCH_SIZE = 500
+
+
+def sync_bills(bill_catalog, bill_index=None, batch_size=BATCH_SIZE):
+    """Upserts every bill with an action since the catalog's high-water mark
+
+    Bills are streamed in ascending `last_action_at` order and the high-water mark is saved with
+    each batch, so an interrupted sync resumes where it stopped. Pages skip the response cache,
+    since a cached page could hide changed bills that the high-water mark then moves past. Bills at the high-water mark
+    itself are fetched again, which is harmless since upserts are idempotent.
+
+    :param bill_catalog: The `catalog.BillCatalog` to update
+    :param bill_index: (Optional) A `search.BillIndex` to add the synced bills to
+    :param int batch_size: The number of bills written per transaction
+
+    :returns: The number of bills synced
+    """
+    high_water_mark = bill_catalog.get_high_water_mark()
+    log.info("Syncing bills with actions since {}".format(high_water_mark))
+
+    synced = 0
+    batch = []
+    for b in bills.iter_bills(updated_since=high_water_mark, use_cache=False):
+        batch.append(b)
+        if bill_index is not None:
+            bill_index.add_bill(b)
+        if b.last_action_at is not None:
+            high_water_mark = max(high_water_mark or "", b.last_action_at)
+
+        if len(batch) >= batch_size:
+            bill_catalog.upsert_bills(batch, high_water_mark)
+            synced += len(batch)
+            batch = []
+
+    bill_catalog.upsert_bills(batch, high_water_mark)
+    synced += len(batch)
+
+    log.info("Synced {} bills, high-water mark is now {}".format(synced, high_water_mark))
+    return synced
+
+
+def build_bill_index(bill_catalog):
+    bill_index = search.BillIndex()
+    for b in bill_catalog.iter_bills():
+        bill_index.add_bill(b)
+
+    return bill_index
+
+
+def run_forever(bill_catalog, interval, index_path=None):
+    # Built once, then kept up to date with the synced bills
+    bill_index = build_bill_index(bill_catalog) if index_path else None
+
+    while True:
+        try:
+            sync_bills(bill_catalog, bill_index)
+            if bill_index is not None:
+                bill_index.save(index_path)
+        except Exception:
+            log.exception("Bill sync failed, retrying next interval")
+
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync bills into the local bill catalog")
+    parser.add_argument("--once", action="store_true", help="Sync once and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if catalog.bill_catalog is None:
+        parser.error("The bill catalog isn't configured, add a \"bill_catalog\" section to the config")
+
+    cnfg = config.store["bill_catalog"]
+    index_path = config.data_path(cnfg["index_path"]) if cnfg.get("index_path") else None
+    if args.once:
+        sync_bills(catalog.bill_catalog)
+        if index_path:
+            build_bill_index(catalog.bill_catalog).save(index_path)
+    else:
+        run_forever(catalog.bill_catalog, cnfg["sync_interval"], index_path)
+
+
+if __name__ == "__main__":
+    main()
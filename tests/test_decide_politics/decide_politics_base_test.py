@@ -1,3 +1,9 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + "../../../"))
+
+import tempfile
+import shared.config as config
+
+# Files the modules write when they're imported, e.g. the response cache, go to a throwaway directory
+config.store["data_dir"] = tempfile.mkdtemp(prefix="decide_politics_test_")
@@ -0,0 +1,154 @@
+import decide_politics_base_test
+
+import pytest
+from unittest.mock import patch
+
+import decide_politics.logic.broadcast as broadcast
+import shared.outbound as outbound
+import sunlight_api.districts as districts
+from decide_politics.core.models import CFields
+from decide_politics.core.models import Customer
+
+
+class FakeSender:
+    def __init__(self, fail_after=None, failing=()):
+        self.sent = []
+        self.fail_after = fail_after
+        self.failing = set(failing)
+
+    def send_msg(self, to, body):
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            raise KeyboardInterrupt()
+        if to in self.failing:
+            raise OSError("Twilio is down")
+        self.sent.append((to, body))
+
+
+class FakeDistrictLookup:
+    """94110 spans CA-12 and CA-14, 94103 is in CA-12"""
+    DISTRICTS = {"94110": [("CA", 12), ("CA", 14)], "94103": [("CA", 12)]}
+
+    def get_districts(self, zip_code):
+        return self.DISTRICTS.get(zip_code, [])
+
+    def get_legistlators(self, zip_code):
+        return []
+
+
+def make_customer(i, zip_code):
+    return Customer.load_from_cache_data({
+        CFields.UUID: "customer-%d" % i,
+        CFields.VERSION: Customer.VERSION,
+        CFields.PHONE_NUMBER: "+1541967%04d" % i,
+        CFields.ZIP_CODE: zip_code,
+    })
+
+
+@pytest.fixture
+def customers():
+    """Two segments of two pages of customers"""
+    customers = [make_customer(i, "94110" if i % 2 else "10001") for i in range(8)]
+
+    def scan_pages(segment, total_segments, attributes, start_key, page_size, **filters):
+        pages = [customers[segment * 4 : segment * 4 + 2], customers[segment * 4 + 2 : segment * 4 + 4]]
+        start = 0 if start_key is None else start_key["page"]
+        for i in range(start, len(pages)):
+            yield (pages[i], {"page": i + 1} if i + 1 < len(pages) else None)
+
+    with patch.object(Customer, "scan_pages", side_effect=scan_pages), \
+            patch.object(Customer.TABLE, "count", return_value=8):
+        yield customers
+
+
+def make_broadcast(tmpdir, sender, total_segments=2, **kwargs):
+    return broadcast.Broadcast("alert", "Vote today in {zip_code}!", total_segments=total_segments,
+        max_rate=0, checkpoint_dir=str(tmpdir), sender=sender, **kwargs)
+
+
+class TestBroadcast:
+    def test_every_customer_is_messaged(self, customers, tmpdir):
+        sender = FakeSender()
+        progress = make_broadcast(tmpdir, sender).run()
+
+        assert sorted(to for to, _ in sender.sent) == sorted(c[CFields.PHONE_NUMBER] for c in customers)
+        assert ("+15419670001", "Vote today in 94110!") in sender.sent
+        assert progress["sent"] == 8
+        assert progress["eta_seconds"] == 0
+
+    def test_message_is_rendered_once_per_audience_segment(self, customers, tmpdir):
+        b = make_broadcast(tmpdir, FakeSender())
+        b.run()
+
+        assert sorted(b._rendered.values()) == ["Vote today in 10001!", "Vote today in 94110!"]
+
+    def test_rendered_messages_are_shared_only_when_the_placeholders_match(self, tmpdir):
+        b = broadcast.Broadcast("alert", "{district} vote in {zip_code}", max_rate=0,
+            checkpoint_dir=str(tmpdir), sender=FakeSender())
+
+        with patch.object(districts, "district_lookup", FakeDistrictLookup()):
+            assert b.render("94110") == "CA-12 vote in 94110"
+            assert b.render("94103") == "CA-12 vote in 94103"
+
+    def test_district_is_the_targeted_one(self, tmpdir):
+        b = broadcast.Broadcast("alert", "Vote in {district}", district_ids=["CA-14"], max_rate=0,
+            checkpoint_dir=str(tmpdir), sender=FakeSender())
+
+        with patch.object(districts, "district_lookup", FakeDistrictLookup()):
+            assert b.render("94110") == "Vote in CA-14"
+            assert b.render("94103") is None
+
+    def test_zip_codes_are_filtered_by_the_scan(self, customers, tmpdir):
+        make_broadcast(tmpdir, FakeSender(), zip_codes=["94110"]).run()
+
+        assert Customer.scan_pages.call_args[1]["zip_code__in"] == ["94110"]
+
+    def test_interrupted_broadcast_resumes_without_double_sending(self, customers, tmpdir):
+        sender = FakeSender(fail_after=3)
+        with pytest.raises(KeyboardInterrupt):
+            make_broadcast(tmpdir, sender, total_segments=1).run()
+        # The customer in flight when it was interrupted is not retried
+        assert len(sender.sent) == 3
+
+        sender.fail_after = None
+        make_broadcast(tmpdir, sender, total_segments=1).run()
+
+        phone_numbers = [to for to, _ in sender.sent]
+        assert len(phone_numbers) == len(set(phone_numbers)) == 3
+        # Only segment 0 is scanned with a single segment
+        assert set(phone_numbers) == {c[CFields.PHONE_NUMBER] for c in customers[:4]} - {customers[3][CFields.PHONE_NUMBER]}
+
+    def test_failed_sends_are_retried_when_resumed(self, customers, tmpdir):
+        failing = customers[1][CFields.PHONE_NUMBER]
+        sender = FakeSender(failing=[failing])
+        progress = make_broadcast(tmpdir, sender).run()
+        assert progress["failed"] == 1
+        assert progress["sent"] == 7
+
+        sender.failing = set()
+        with patch.object(Customer, "load_from_db", return_value=customers[1]) as load_from_db:
+            progress = make_broadcast(tmpdir, sender).run()
+
+        load_from_db.assert_called_once_with("customer-1")
+        assert progress["sent"] == 1
+        assert [to for to, _ in sender.sent].count(failing) == 1
+        assert len(sender.sent) == 8
+
+        # Nothing is left to retry
+        assert make_broadcast(tmpdir, sender).run()["sent"] == 0
+
+    def test_checkpoint_dir_is_created(self, customers, tmpdir):
+        sender = FakeSender()
+        broadcast.Broadcast("alert", "Vote today!", max_rate=0, sender=sender,
+            checkpoint_dir=str(tmpdir.join("broadcasts"))).run()
+
+        assert len(sender.sent) == 8
+        assert tmpdir.join("broadcasts", "alert.checkpoint").check()
+
+    def test_failures_behind_a_dispatcher_are_retried(self, customers, tmpdir):
+        sender = FakeSender(failing=[customers[1][CFields.PHONE_NUMBER]])
+        dispatcher = outbound.OutboundDispatcher(sender, num_workers=1)
+        progress = make_broadcast(tmpdir, dispatcher).run()
+        dispatcher.stop()
+
+        assert progress["failed"] == 1
+        assert make_broadcast(tmpdir, sender).checkpoint.failed == {"customer-1": 0}
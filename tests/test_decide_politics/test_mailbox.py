@@ -0,0 +1,129 @@
+import decide_politics_base_test
+
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+import decide_politics.logic.mailbox as mailbox
+import decide_politics.logic.messaging as messaging
+from decide_politics.core.models import CFields
+from decide_politics.core.models import Customer
+
+
+def deliver_in_thread(mailboxes, customer_uuid, load_customer, handle):
+    def run():
+        with mailboxes.deliver(customer_uuid, load_customer) as customer:
+            handle(customer)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+class TestMailboxRegistry:
+    def test_messages_for_a_customer_are_serialized(self):
+        mailboxes = mailbox.MailboxRegistry()
+        loads = []
+        active = []
+        max_active = [0]
+        handled = []
+
+        def load_customer():
+            loads.append(1)
+            return dict(uuid="customer")
+
+        def handle(i):
+            def handle_message(customer):
+                active.append(i)
+                max_active[0] = max(max_active[0], len(active))
+                time.sleep(0.01)
+                handled.append(i)
+                active.remove(i)
+
+            return handle_message
+
+        threads = []
+        for i in range(5):
+            threads.append(deliver_in_thread(mailboxes, "customer", load_customer, handle(i)))
+            # Stagger the arrivals so the arrival order is known
+            time.sleep(0.002)
+
+        for thread in threads:
+            thread.join()
+
+        assert max_active[0] == 1
+        assert handled == list(range(5))
+        # Messages that arrived while another was in flight reused its customer
+        assert len(loads) == 1
+        assert len(mailboxes) == 0
+
+    def test_customers_are_handled_in_parallel(self):
+        mailboxes = mailbox.MailboxRegistry()
+        barrier = threading.Barrier(2, timeout=5)
+
+        threads = [deliver_in_thread(mailboxes, customer_uuid, dict, lambda customer: barrier.wait())
+            for customer_uuid in ("a", "b")]
+
+        for thread in threads:
+            thread.join()
+
+        assert not barrier.broken
+
+    def test_customer_is_reloaded_after_a_failure(self):
+        mailboxes = mailbox.MailboxRegistry()
+        loads = []
+        load_customer = lambda: loads.append(1) or dict()
+
+        with pytest.raises(ValueError):
+            with mailboxes.deliver("customer", load_customer):
+                # Queue a message behind the failing one
+                thread = deliver_in_thread(mailboxes, "customer", load_customer, lambda customer: None)
+                while mailboxes._mailboxes["customer"].pending < 2:
+                    time.sleep(0.001)
+
+                raise ValueError()
+
+        thread.join()
+
+        assert len(loads) == 2
+        assert len(mailboxes) == 0
+
+    def test_interrupted_wait_does_not_block_later_messages(self):
+        mailboxes = mailbox.MailboxRegistry()
+        entered = threading.Event()
+        release = threading.Event()
+        handled = []
+
+        first = deliver_in_thread(mailboxes, "customer", dict, lambda customer: entered.set() or release.wait())
+        assert entered.wait(timeout=5)
+
+        # A message that times out while it waits for the first one
+        condition = mailboxes._mailboxes["customer"].condition
+        with patch.object(condition, "wait_for", side_effect=TimeoutError):
+            with pytest.raises(TimeoutError):
+                with mailboxes.deliver("customer", dict):
+                    pass
+
+        third = deliver_in_thread(mailboxes, "customer", dict, handled.append)
+        release.set()
+        first.join()
+        third.join(timeout=5)
+
+        assert handled == [{}]
+        assert len(mailboxes) == 0
+
+
+class TestOnSmsRecieve:
+    def test_customer_is_loaded_once_delivered(self):
+        customer = Customer.create_new({CFields.PHONE_NUMBER: "+15419670010"})
+        snapshot = Customer.load_from_cache_data(dict(customer.item._data))
+        customer[CFields.ZIP_CODE] = "94110"
+
+        handled = []
+        with patch.object(Customer, "get_or_create_by_phone_number", return_value=(snapshot, False)), \
+                patch.object(Customer, "load_from_db", return_value=customer), \
+                patch.object(messaging, "on_message_recieve", lambda c, body: handled.append(c)):
+            messaging.on_sms_recieve("+15419670010", "HELLO")
+
+        assert handled[0][CFields.ZIP_CODE] == "94110"
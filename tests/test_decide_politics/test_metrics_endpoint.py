@@ -0,0 +1,48 @@
+import decide_politics_base_test
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+import decide_politics.logic.pipeline as pipeline
+import shared.metrics as metrics
+from decide_politics.flask import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+class TestMetricsEndpoint:
+    def test_requests_are_recorded_by_route(self, client):
+        client.get('/')
+        client.get('/does/not/exist')
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith("text/plain")
+
+        body = response.data.decode("utf-8")
+        assert 'decide_politics_http_requests_total{endpoint="/",method="GET",status="200"}' in body
+        assert 'decide_politics_http_requests_total{endpoint="unmatched",method="GET",status="404"}' in body
+        assert 'decide_politics_http_request_dynamodb_calls_bucket{endpoint="/",method="GET",le="0"}' in body
+
+    def test_component_stats_are_exported(self, client):
+        body = client.get('/metrics').data.decode("utf-8")
+        assert "decide_politics_customer_cache_size " in body
+
+    def test_request_state_is_cleared(self, client):
+        client.get('/')
+        assert metrics.registry.end_request() == {}
+
+    def test_pipeline_observes_the_dynamodb_calls_of_queued_messages(self, client):
+        labels = (("endpoint", "/sms/handle_sms"), ("method", "POST"))
+        histograms = metrics.registry._histograms[metrics.HTTP_REQUEST_DYNAMODB_CALLS]
+        count = histograms[labels].count if labels in histograms else 0
+
+        with patch.object(pipeline, "inbound", MagicMock()) as inbound:
+            response = client.post('/sms/handle_sms', data={"From": "+15419670010", "Body": "HELLO"})
+
+        assert response.status_code == 200
+        assert inbound.enqueue.call_args[1]["request_labels"] == labels
+        assert (histograms[labels].count if labels in histograms else 0) == count
@@ -0,0 +1,339 @@
+import decide_politics_base_test
+
+import pytest
+from unittest.mock import patch
+
+import decide_politics.core.models as models
+import decide_politics.core.storage as storage
+import shared.cache as cache
+from shared.common import Errors, DecidePoliticsException
+from decide_politics.core.models import CFields
+from decide_politics.core.models import Customer
+from decide_politics.core.models import ModelCache
+from decide_politics.core.models import VFields
+from decide_politics.core.models import Votes
+
+@pytest.fixture
+def dummy_customer():
+    Customer.CACHE.clear()
+
+    return Customer.create_new(attributes={
+        # Test number not connected to someones real phone
+        CFields.PHONE_NUMBER: "+15419670010"
+    })
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache:
+    def test_eviction(self):
+        lru = cache.LRUCache(max_size=2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+
+        # Touch "a" so that "b" is the least recently used
+        assert lru.get("a") == 1
+        lru.put("c", 3)
+
+        assert lru.get("b") is None
+        assert lru.get("c") == 3
+        assert lru.stats()["evictions"] == 1
+        assert lru.stats()["hits"] == 2
+        assert lru.stats()["misses"] == 1
+
+    def test_ttl(self):
+        clock = FakeClock()
+        lru = cache.LRUCache(max_size=2, ttl=10, clock=clock)
+        lru.put("a", 1)
+
+        clock.now = 9
+        assert lru.get("a") == 1
+
+        clock.now = 10
+        assert lru.get("a") is None
+        assert lru.stats()["expirations"] == 1
+
+
+class TestModelCache:
+    def test_get_by_index(self):
+        model_cache = ModelCache("uuid", index_fields=["phone_number"])
+        model_cache.put(dict(uuid="1", phone_number="+15419670010"))
+
+        assert model_cache.get_by("phone_number", "+15419670010")["uuid"] == "1"
+        assert model_cache.get_by("phone_number", "+15419670011") is None
+
+    def test_stale_index_entry(self):
+        model_cache = ModelCache("uuid", index_fields=["phone_number"])
+        model_cache.put(dict(uuid="1", phone_number="+15419670010"))
+        model_cache.put(dict(uuid="1", phone_number="+15419670011"))
+
+        assert model_cache.get_by("phone_number", "+15419670010") is None
+        assert model_cache.get_by("phone_number", "+15419670011")["uuid"] == "1"
+
+    def test_snapshots_are_copies(self):
+        model_cache = ModelCache("uuid")
+        model_cache.put(dict(uuid="1", zip_code="94110"))
+        model_cache.get("1")["zip_code"] = "10001"
+
+        assert model_cache.get("1")["zip_code"] == "94110"
+
+
+class TestCustomerCache:
+    def test_read_through(self, dummy_customer):
+        dummy_customer._cache_put()
+
+        customer = Customer.get_customer_by_phone_number("+15419670010")
+        assert customer[CFields.UUID] == dummy_customer[CFields.UUID]
+        assert not customer.item.needs_save()
+
+        customer = Customer.load_from_db(dummy_customer[CFields.UUID])
+        assert customer[CFields.PHONE_NUMBER] == "+15419670010"
+
+    def test_save_refreshes_cache(self, dummy_customer):
+        dummy_customer._cache_put()
+        dummy_customer[CFields.ZIP_CODE] = "94110"
+
+        with patch.object(Customer, "_update_item") as update_item:
+            assert dummy_customer.save()
+
+        customer = Customer.load_from_db(dummy_customer[CFields.UUID])
+        assert customer[CFields.ZIP_CODE] == "94110"
+
+    def test_delete_invalidates_cache(self, dummy_customer):
+        dummy_customer._cache_put()
+
+        with patch.object(models.engine, "delete_item"):
+            dummy_customer.delete()
+
+        assert Customer.CACHE.get(dummy_customer[CFields.UUID]) is None
+        assert Customer.CACHE.get_by(CFields.PHONE_NUMBER, "+15419670010") is None
+
+
+@pytest.fixture
+def memory_engine():
+    Customer.CACHE.clear()
+    engine = storage.MemoryEngine(models.SCHEMAS)
+    with patch.object(models, "engine", engine):
+        yield engine
+
+    Customer.CACHE.clear()
+
+
+class TestCustomerCreation:
+    def test_uuid_is_random(self, dummy_customer):
+        other_customer = Customer.create_new(attributes={
+            CFields.PHONE_NUMBER: "+15419670010"
+        })
+
+        assert dummy_customer[CFields.UUID] != other_customer[CFields.UUID]
+
+    def test_create_claims_the_phone_number(self, memory_engine, dummy_customer):
+        dummy_customer.create()
+        assert Customer.get_claimed_uuid("+15419670010") == dummy_customer[CFields.UUID]
+
+        other_customer = Customer.create_new(attributes={CFields.PHONE_NUMBER: "+15419670010"})
+        with pytest.raises(DecidePoliticsException) as e:
+            other_customer.create()
+        assert e.value.error_type == Errors.CUSTOMER_ALREADY_EXISTS
+        assert memory_engine.count(models.TableNames.CUSTOMERS) == 1
+
+    def test_get_or_create_lost_race(self, memory_engine, dummy_customer):
+        dummy_customer.create()
+        Customer.CACHE.clear()
+
+        # The phone number index hasn't caught up with the concurrent first message yet
+        with patch.object(Customer, "get_customer_by_phone_number", return_value=None):
+            customer, is_new_customer = Customer.get_or_create_by_phone_number("+15419670010")
+
+        assert customer[CFields.UUID] == dummy_customer[CFields.UUID]
+        assert not is_new_customer
+        assert memory_engine.count(models.TableNames.CUSTOMERS) == 1
+
+    def test_get_or_create_takes_over_an_unwritten_claim(self, memory_engine):
+        # The request that claimed the phone number failed before writing its customer
+        assert Customer.claim_phone_number("+15419670010", "claimed-uuid")
+
+        customer, is_new_customer = Customer.get_or_create_by_phone_number("+15419670010")
+
+        assert customer[CFields.UUID] == "claimed-uuid"
+        assert is_new_customer
+        assert Customer.load_from_db("claimed-uuid")[CFields.PHONE_NUMBER] == "+15419670010"
+
+    def test_delete_releases_the_phone_number(self, memory_engine, dummy_customer):
+        dummy_customer.create()
+        dummy_customer.delete()
+
+        assert Customer.get_claimed_uuid("+15419670010") is None
+        customer, is_new_customer = Customer.get_or_create_by_phone_number("+15419670010")
+        assert is_new_customer
+        assert customer[CFields.UUID] != dummy_customer[CFields.UUID]
+
+
+class TestDirtyTracking:
+    def test_new_item_is_dirty(self, dummy_customer):
+        assert dummy_customer.needs_save()
+
+    def test_save_writes_only_changed_attributes(self, dummy_customer):
+        customer = Customer.load_from_cache_data(dict(dummy_customer.item._data))
+        assert not customer.needs_save()
+
+        customer[CFields.ZIP_CODE] = "94110"
+        with patch.object(Customer, "_update_item") as update_item:
+            customer.save()
+
+        written_keys, expects = update_item.call_args[0]
+        assert written_keys == {CFields.ZIP_CODE}
+        assert expects == {CFields.ZIP_CODE: storage.ABSENT}
+        assert not customer.needs_save()
+
+    def test_save_rejects_empty_values(self, dummy_customer):
+        customer = Customer.load_from_cache_data(dict(dummy_customer.item._data))
+        customer[CFields.EMAIL] = ""
+
+        with patch.object(Customer, "_update_item") as update_item:
+            with pytest.raises(DecidePoliticsException):
+                customer.save()
+
+        assert not update_item.called
+
+
+class FakeBatchConnection:
+    """Answers batch requests, leaving the first key or write of each first request unprocessed"""
+    def __init__(self):
+        self.requests = []
+
+    def batch_get_item(self, request_items):
+        self.requests.append(request_items)
+        (table_name, request), = request_items.items()
+        keys = request["Keys"]
+
+        unprocessed = keys[:1] if len(self.requests) == 1 else []
+        items = [dict(key, version={"N": "1"}, vote_result={"S": "YES"}) for key in keys[len(unprocessed):]]
+
+        return {
+            "Responses": {table_name: items},
+            "UnprocessedKeys": {table_name: {"Keys": unprocessed}} if unprocessed else {},
+        }
+
+    def batch_write_item(self, request_items):
+        self.requests.append(request_items)
+        (table_name, write_requests), = request_items.items()
+
+        unprocessed = write_requests[:1] if len(self.requests) == 1 else []
+        return {"UnprocessedItems": {table_name: unprocessed} if unprocessed else {}}
+
+
+@pytest.fixture
+def batch_connection():
+    connection = FakeBatchConnection()
+    with patch.object(models, "engine", storage.DynamoDBEngine({Votes.TABLE_NAME: Votes.TABLE})), \
+            patch.object(Votes.TABLE, "connection", connection), patch("time.sleep"):
+        yield connection
+
+
+class TestBatchOperations:
+    def test_batch_load(self, batch_connection):
+        keys = [("customer-%d" % i, "bill-%d" % i) for i in range(150)]
+        votes = Votes.batch_load(keys + keys[:10])
+
+        assert len(votes) == 150
+        assert set((vote[VFields.CUSTOMER_UUID], vote[VFields.BILL_ID]) for vote in votes) == set(keys)
+        assert not any(vote.needs_save() for vote in votes)
+
+        # Two chunks plus a retry of the unprocessed key
+        assert [len(r[Votes.TABLE_NAME]["Keys"]) for r in batch_connection.requests] == [100, 1, 50]
+
+    def test_batch_writer(self, batch_connection):
+        votes = [Votes.create_new({
+            VFields.CUSTOMER_UUID: "customer-%d" % i,
+            VFields.BILL_ID: "bill",
+            VFields.VOTE_RESULT: "YES",
+        }) for i in range(30)]
+
+        with Votes.batch_writer() as batch:
+            for vote in votes:
+                batch.put(vote)
+            # Replaces the buffered put of the same key
+            batch.delete(votes[-1])
+
+        assert [len(r[Votes.TABLE_NAME]) for r in batch_connection.requests] == [25, 1, 5]
+        assert "DeleteRequest" in batch_connection.requests[-1][Votes.TABLE_NAME][-1]
+        assert not any(vote.needs_save() for vote in votes[:-1])
+
+
+class FakeQueryConnection:
+    """Serves the votes on one bill in pages, like a query of the bill index"""
+    def __init__(self, num_votes):
+        self.votes = [{
+            "customer_uuid": {"S": "customer-%03d" % i},
+            "bill_id": {"S": "bill"},
+            "version": {"N": "1"},
+            "vote_result": {"S": "YES"},
+        } for i in range(num_votes)]
+        self.requests = []
+
+    def query(self, table_name, **kwargs):
+        self.requests.append(kwargs)
+
+        start = 0
+        if kwargs.get("exclusive_start_key"):
+            start_key = kwargs["exclusive_start_key"]["customer_uuid"]
+            start = [v["customer_uuid"] for v in self.votes].index(start_key) + 1
+
+        page = self.votes[start : start + kwargs["limit"]]
+        if kwargs.get("attributes_to_get"):
+            page = [{k: v for k, v in vote.items() if k in kwargs["attributes_to_get"]} for vote in page]
+
+        response = {"Items": page}
+        if start + kwargs["limit"] < len(self.votes):
+            response["LastEvaluatedKey"] = {"customer_uuid": page[-1]["customer_uuid"], "bill_id": {"S": "bill"}}
+
+        return response
+
+
+@pytest.fixture
+def query_connection():
+    connection = FakeQueryConnection(25)
+    with patch.object(models, "engine", storage.DynamoDBEngine({Votes.TABLE_NAME: Votes.TABLE})), \
+            patch.object(Votes.TABLE, "connection", connection):
+        yield connection
+
+
+class TestQueries:
+    def test_votes_are_streamed_page_by_page(self, query_connection):
+        votes = Votes.votes_for_bill("bill", page_size=10)
+
+        # Nothing is requested until the stream is consumed
+        assert query_connection.requests == []
+        assert next(votes)[VFields.CUSTOMER_UUID] == "customer-000"
+        assert len(query_connection.requests) == 1
+
+        assert len(list(votes)) == 24
+        assert [r["limit"] for r in query_connection.requests] == [10, 10, 10]
+        assert query_connection.requests[0]["index_name"] == Votes.BILL_INDEX
+
+    def test_cursor_resumes_after_the_last_vote(self, query_connection):
+        votes = Votes.votes_for_bill("bill", page_size=10)
+        first = [next(votes) for _ in range(12)]
+
+        cursor = first[-1].get_cursor(Votes.BILL_INDEX)
+        rest = list(Votes.votes_for_bill("bill", cursor=cursor, page_size=10))
+
+        assert [v[VFields.CUSTOMER_UUID] for v in first + rest] == ["customer-%03d" % i for i in range(25)]
+
+    def test_projection_always_reads_the_key_and_version(self, query_connection):
+        vote = next(Votes.votes_for_customer("customer-000", attributes=[VFields.VOTE_RESULT]))
+
+        assert set(query_connection.requests[0]["attributes_to_get"]) == \
+            {VFields.CUSTOMER_UUID, VFields.BILL_ID, VFields.VERSION, VFields.VOTE_RESULT}
+        assert vote[VFields.VOTE_RESULT] == "YES"
+
+    def test_invalid_cursor(self, query_connection):
+        with pytest.raises(DecidePoliticsException):
+            next(Votes.votes_for_bill("bill", cursor="not a cursor"))
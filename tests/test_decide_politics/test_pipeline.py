@@ -0,0 +1,84 @@
+import decide_politics_base_test
+
+import pytest
+from unittest.mock import patch
+
+import decide_politics.logic.pipeline as pipeline
+import shared.metrics as metrics
+from shared.common import Errors, DecidePoliticsException
+
+
+class TestInboundPipeline:
+    def test_messages_from_a_phone_number_stay_in_order(self):
+        handled = []
+        inbound = pipeline.InboundPipeline(lambda *message: handled.append(message), num_workers=4)
+
+        for i in range(20):
+            inbound.enqueue("+15419670010", "m%02d" % i)
+            inbound.enqueue("+15419670011", "n%02d" % i)
+
+        assert inbound.flush(timeout=5)
+        assert [body for phone, body in handled if phone == "+15419670010"] == ["m%02d" % i for i in range(20)]
+        assert [body for phone, body in handled if phone == "+15419670011"] == ["n%02d" % i for i in range(20)]
+
+        stats = inbound.stats()
+        assert stats["processed"] == 40
+        assert stats["queue_depth"] == 0
+        assert stats["max_lag"] >= stats["mean_lag"] > 0
+
+        inbound.stop()
+
+    def test_failures_are_counted(self):
+        def fail(phone_number, message_body):
+            raise Exception("Processing failed")
+
+        inbound = pipeline.InboundPipeline(fail, num_workers=1)
+        inbound.enqueue("+15419670010", "HELLO")
+
+        assert inbound.flush(timeout=5)
+        assert inbound.stats()["failed"] == 1
+
+        inbound.stop()
+
+    def test_counters_add_up_across_workers(self):
+        def handle(phone_number, message_body):
+            if message_body.startswith("FAIL"):
+                raise Exception("Processing failed")
+
+        inbound = pipeline.InboundPipeline(handle, num_workers=8)
+        for i in range(2000):
+            inbound.enqueue("+1541967%04d" % (i % 64), "FAIL" if i % 4 == 0 else "HELLO")
+
+        assert inbound.flush(timeout=10)
+        stats = inbound.stats()
+        assert stats["received"] == 2000
+        assert stats["processed"] == 1500
+        assert stats["failed"] == 500
+
+        inbound.stop()
+
+    def test_dynamodb_calls_are_observed_under_the_request_labels(self):
+        def handle(phone_number, message_body):
+            metrics.registry.count_request_call("dynamodb")
+            metrics.registry.count_request_call("dynamodb")
+
+        inbound = pipeline.InboundPipeline(handle, num_workers=1)
+        labels = (("endpoint", "/sms/handle_sms"), ("method", "POST"), ("test", "pipeline"))
+        inbound.enqueue("+15419670010", "HELLO", request_labels=labels)
+
+        assert inbound.flush(timeout=5)
+        histogram = metrics.registry._histograms[metrics.HTTP_REQUEST_DYNAMODB_CALLS][labels]
+        assert (histogram.count, histogram.sum) == (1, 2)
+
+        inbound.stop()
+
+    def test_full_queue_is_rejected(self):
+        inbound = pipeline.InboundPipeline(lambda *message: None, num_workers=1, max_queue_size=1)
+
+        # Keep the workers from draining the queue
+        with patch.object(inbound._pool, "_start_workers"):
+            inbound.enqueue("+15419670010", "first")
+            with pytest.raises(DecidePoliticsException) as e:
+                inbound.enqueue("+15419670010", "second")
+
+        assert e.value.error_type is Errors.INBOUND_QUEUE_FULL
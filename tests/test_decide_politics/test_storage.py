@@ -0,0 +1,203 @@
+import decide_politics_base_test
+
+import pytest
+from unittest.mock import patch
+
+import decide_politics.core.models as models
+import decide_politics.core.storage as storage
+import decide_politics.logic.tallies as tallies
+from shared.common import Errors, DecidePoliticsException
+from decide_politics.core.models import CFields
+from decide_politics.core.models import Customer
+from decide_politics.core.models import TableNames
+from decide_politics.core.models import VFields
+from decide_politics.core.models import Votes
+
+
+@pytest.fixture
+def engine():
+    return storage.MemoryEngine(models.SCHEMAS)
+
+
+@pytest.fixture
+def memory_models(engine):
+    Customer.CACHE.clear()
+    with patch.object(models, "engine", engine):
+        yield engine
+
+    Customer.CACHE.clear()
+
+
+def put_votes(engine, customer_uuid, bill_ids):
+    for bill_id in bill_ids:
+        engine.put_item(TableNames.VOTES, {
+            VFields.CUSTOMER_UUID: customer_uuid,
+            VFields.BILL_ID: bill_id,
+            VFields.VOTE_RESULT: "yes",
+            "version": 1,
+        })
+
+
+class TestMemoryEngine:
+    def test_put_and_get(self, engine):
+        engine.put_item(TableNames.CUSTOMERS, {"uuid": "c1", "phone_number": "+15419670010"})
+
+        assert engine.get_item(TableNames.CUSTOMERS, {"uuid": "c1"}) == {"uuid": "c1", "phone_number": "+15419670010"}
+        assert engine.get_item(TableNames.CUSTOMERS, {"uuid": "c1"}, attributes=["uuid"]) == {"uuid": "c1"}
+        assert engine.get_item(TableNames.CUSTOMERS, {"uuid": "c2"}) is None
+
+    def test_items_are_copied(self, engine):
+        data = {"uuid": "c1", "zip_code": "94110"}
+        engine.put_item(TableNames.CUSTOMERS, data)
+        data["zip_code"] = "10001"
+        engine.get_item(TableNames.CUSTOMERS, {"uuid": "c1"})["zip_code"] = "10001"
+
+        assert engine.get_item(TableNames.CUSTOMERS, {"uuid": "c1"})["zip_code"] == "94110"
+
+    def test_conditional_writes(self, engine):
+        engine.put_item(TableNames.CUSTOMERS, {"uuid": "c1", "zip_code": "94110"}, expected={"uuid": storage.ABSENT})
+        with pytest.raises(storage.ConditionalCheckFailed):
+            engine.put_item(TableNames.CUSTOMERS, {"uuid": "c1"}, expected={"uuid": storage.ABSENT})
+
+        with pytest.raises(storage.ConditionalCheckFailed):
+            engine.update_item(TableNames.CUSTOMERS, {"uuid": "c1"}, {"zip_code": (storage.PUT, "10001")},
+                expected={"zip_code": "60601"})
+        engine.update_item(TableNames.CUSTOMERS, {"uuid": "c1"}, {"zip_code": (storage.PUT, "10001")},
+            expected={"zip_code": "94110"})
+
+        assert engine.get_item(TableNames.CUSTOMERS, {"uuid": "c1"})["zip_code"] == "10001"
+
+    def test_update_actions(self, engine):
+        key = {"bill_id": "hr1-114", "scope": "all"}
+        engine.update_item(TableNames.VOTE_TALLIES, key, {"count_yes": (storage.ADD, 2)})
+        engine.update_item(TableNames.VOTE_TALLIES, key, {"count_yes": (storage.ADD, -1), "note": (storage.PUT, "x")})
+        engine.update_item(TableNames.VOTE_TALLIES, key, {"note": (storage.DELETE, None)})
+
+        assert engine.get_item(TableNames.VOTE_TALLIES, key) == dict(key, count_yes=1)
+
+    def test_query_pages_in_range_key_order(self, engine):
+        put_votes(engine, "c1", ["s3", "hr2", "hr1", "s1"])
+        put_votes(engine, "c2", ["hr1"])
+
+        page = engine.query(TableNames.VOTES, limit=3, customer_uuid__eq="c1")
+        assert [item[VFields.BILL_ID] for item in page.items] == ["hr1", "hr2", "s1"]
+
+        page = engine.query(TableNames.VOTES, start_key=page.last_key, limit=3, customer_uuid__eq="c1")
+        assert [item[VFields.BILL_ID] for item in page.items] == ["s3"]
+        assert page.last_key is None
+
+    def test_query_conditions_and_indexes(self, engine):
+        put_votes(engine, "c1", ["hr1", "hr2", "s1"])
+        put_votes(engine, "c2", ["hr1"])
+
+        page = engine.query(TableNames.VOTES, customer_uuid__eq="c1", bill_id__beginswith="hr")
+        assert [item[VFields.BILL_ID] for item in page.items] == ["hr1", "hr2"]
+
+        page = engine.query(TableNames.VOTES, index=Votes.BILL_INDEX, limit=1, bill_id__eq="hr1")
+        assert page.items[0][VFields.CUSTOMER_UUID] == "c1"
+        page = engine.query(TableNames.VOTES, index=Votes.BILL_INDEX, start_key=page.last_key, bill_id__eq="hr1")
+        assert [item[VFields.CUSTOMER_UUID] for item in page.items] == ["c2"]
+
+        with pytest.raises(ValueError):
+            engine.query(TableNames.VOTES, bill_id__eq="hr1")
+
+    def test_scan_segments_cover_the_table_once(self, engine):
+        for i in range(50):
+            engine.put_item(TableNames.CUSTOMERS, {"uuid": "c{}".format(i), "zip_code": str(94100 + i % 2)})
+
+        scanned = []
+        for segment in range(4):
+            scanned.extend(item["uuid"] for item in engine.scan_items(
+                TableNames.CUSTOMERS, segment=segment, total_segments=4, limit=7))
+
+        assert sorted(scanned) == sorted("c{}".format(i) for i in range(50))
+
+    def test_scan_limit_applies_before_filters(self, engine):
+        for i in range(10):
+            engine.put_item(TableNames.CUSTOMERS, {"uuid": "c{}".format(i), "zip_code": str(94100 + i % 2)})
+
+        page = engine.scan(TableNames.CUSTOMERS, limit=4, zip_code__eq="94100")
+        assert len(page.items) == 2
+        assert page.last_key == {"uuid": "c3"}
+
+        items = list(engine.scan_items(TableNames.CUSTOMERS, limit=4, zip_code__eq="94100"))
+        assert len(items) == 5
+
+    def test_batch_operations_and_count(self, engine):
+        assert engine.batch_write(TableNames.CUSTOMERS, [
+            (storage.PUT_REQUEST, {"uuid": "c1"}),
+            (storage.PUT_REQUEST, {"uuid": "c2"}),
+        ]) == []
+        engine.batch_write(TableNames.CUSTOMERS, [(storage.DELETE_REQUEST, {"uuid": "c1"})])
+
+        items, unprocessed = engine.batch_get(TableNames.CUSTOMERS, [{"uuid": "c1"}, {"uuid": "c2"}])
+        assert items == [{"uuid": "c2"}]
+        assert unprocessed == []
+        assert engine.count(TableNames.CUSTOMERS) == 1
+
+
+class TestModelsOnMemoryEngine:
+    def test_customer_round_trip(self, memory_models):
+        customer, is_new_customer = Customer.get_or_create_by_phone_number("+15419670010")
+        assert is_new_customer
+
+        Customer.CACHE.clear()
+        loaded = Customer.get_customer_by_phone_number("+15419670010")
+        assert loaded[CFields.UUID] == customer[CFields.UUID]
+
+        loaded[CFields.ZIP_CODE] = "94110"
+        assert loaded.save()
+
+        Customer.CACHE.clear()
+        assert Customer.load_from_db(customer[CFields.UUID])[CFields.ZIP_CODE] == "94110"
+
+        loaded.delete()
+        with pytest.raises(DecidePoliticsException):
+            Customer.load_from_db(customer[CFields.UUID])
+
+    def test_duplicate_create_fails(self, memory_models):
+        customer, _ = Customer.get_or_create_by_phone_number("+15419670010")
+        duplicate = Customer.load_from_data(dict(customer.item._data))
+
+        with pytest.raises(DecidePoliticsException) as e:
+            duplicate.create()
+        assert e.value.error_type == Customer.ITEM_ALREADY_EXISTS_EX
+
+    def test_stale_save_fails(self, memory_models):
+        customer, _ = Customer.get_or_create_by_phone_number("+15419670010")
+        Customer.CACHE.clear()
+        first = Customer.load_from_db(customer[CFields.UUID])
+        second = Customer.load_from_db(customer[CFields.UUID])
+
+        first[CFields.ZIP_CODE] = "94110"
+        first.save()
+
+        second[CFields.ZIP_CODE] = "10001"
+        with pytest.raises(DecidePoliticsException) as e:
+            second.save()
+        assert e.value.error_type == Errors.CONSISTENCY_ERROR
+
+    def test_query_with_cursor(self, memory_models):
+        put_votes(memory_models, "c1", ["hr{}".format(i) for i in range(5)])
+
+        votes = Votes.votes_for_customer("c1", page_size=2)
+        assert [vote[VFields.BILL_ID] for vote in votes] == ["hr{}".format(i) for i in range(5)]
+
+    def test_batch_load_and_write(self, memory_models):
+        with models.BatchWriter(Votes) as batch:
+            for i in range(30):
+                batch.put(Votes.load_from_data({
+                    VFields.CUSTOMER_UUID: "c1",
+                    VFields.BILL_ID: "hr{}".format(i),
+                    VFields.VOTE_RESULT: "yes",
+                    "version": 1,
+                }))
+
+        keys = [("c1", "hr{}".format(i)) for i in range(30)]
+        assert len(Votes.batch_load(keys)) == 30
+
+    def test_tallies(self, memory_models):
+        tallies.update_tally("hr1-114", tallies.ALL_SCOPE, {"yes": 2, "no": 1})
+        tallies.update_tally("hr1-114", tallies.ALL_SCOPE, {"yes": -1})
+
+        assert tallies.get_tally("hr1-114") == {"yes": 1, "no": 1}
@@ -0,0 +1,123 @@
+import decide_politics_base_test
+
+import pytest
+from unittest.mock import patch
+
+import decide_politics.core.models as models
+import decide_politics.core.storage as storage
+import decide_politics.logic.tallies as tallies
+from shared.common import Errors, DecidePoliticsException
+from decide_politics.core.models import VFields
+from decide_politics.core.models import Votes
+
+
+class FakeTallyConnection:
+    """Applies ADD updates to in-memory counters"""
+    def __init__(self):
+        self.counts = {}
+
+    def update_item(self, table_name, key, attribute_updates, **kwargs):
+        counts = self.counts.setdefault((key["bill_id"]["S"], key["scope"]["S"]), {})
+        for attribute, update in attribute_updates.items():
+            assert update["Action"] == "ADD"
+            counts[attribute] = counts.get(attribute, 0) + int(update["Value"]["N"])
+
+
+@pytest.fixture
+def tally_connection():
+    connection = FakeTallyConnection()
+    engine = storage.DynamoDBEngine({models.TableNames.VOTE_TALLIES: models.vote_tallies})
+    with patch.object(models, "engine", engine), patch.object(models.vote_tallies, "connection", connection):
+        yield connection
+
+
+@pytest.fixture
+def memory_engine():
+    engine = storage.MemoryEngine(models.SCHEMAS)
+    with patch.object(models, "engine", engine):
+        yield engine
+
+
+class TestRecordVote:
+    def test_first_vote_is_counted_in_every_scope(self, memory_engine):
+        assert tallies.record_vote("c1", "hr1-114", "yes", zip_code="94110")
+
+        assert tallies.get_tally("hr1-114") == {"yes": 1}
+        assert tallies.get_tally("hr1-114", "zip:94110") == {"yes": 1}
+
+    def test_recording_the_same_vote_is_idempotent(self, memory_engine):
+        tallies.record_vote("c1", "hr1-114", "yes")
+        assert not tallies.record_vote("c1", "hr1-114", "yes")
+
+        assert tallies.get_tally("hr1-114") == {"yes": 1}
+
+    def test_changed_vote_moves_the_count(self, memory_engine):
+        tallies.record_vote("c1", "hr1-114", "yes", zip_code="94110")
+        tallies.record_vote("c2", "hr1-114", "yes")
+        # The zip code of the first vote is kept
+        assert tallies.record_vote("c1", "hr1-114", "no", zip_code="10001")
+
+        assert tallies.get_tally("hr1-114") == {"yes": 1, "no": 1}
+        assert tallies.get_tally("hr1-114", "zip:94110") == {"no": 1}
+        assert tallies.get_tally("hr1-114", "zip:10001") == {}
+
+    def test_lost_race_is_retried_from_the_winning_vote(self, memory_engine):
+        # A concurrent request creates the same vote after it was read
+        tallies.record_vote("c1", "hr1-114", "no")
+        load_from_db = Votes.load_from_db
+        with patch.object(Votes, "load_from_db", side_effect=[
+            DecidePoliticsException(Errors.VOTE_DOES_NOT_EXIST),
+            load_from_db("c1", "hr1-114"),
+        ]):
+            assert tallies.record_vote("c1", "hr1-114", "yes")
+
+        assert tallies.get_tally("hr1-114") == {"yes": 1}
+
+
+class TestVotesWrites:
+    def test_direct_writes_update_the_tallies(self, memory_engine):
+        vote = Votes.create_new({VFields.CUSTOMER_UUID: "c1", VFields.BILL_ID: "hr1-114", VFields.VOTE_RESULT: "yes"})
+        vote.create()
+        assert tallies.get_tally("hr1-114") == {"yes": 1}
+
+        first = Votes.load_from_db("c1", "hr1-114")
+        second = Votes.load_from_db("c1", "hr1-114")
+        first[VFields.VOTE_RESULT] = "no"
+        first.save()
+        assert tallies.get_tally("hr1-114") == {"no": 1}
+
+        # The second copy is stale, so it isn't written and doesn't move the count again
+        second[VFields.VOTE_RESULT] = "abstain"
+        with pytest.raises(DecidePoliticsException):
+            second.save()
+        assert tallies.get_tally("hr1-114") == {"no": 1}
+
+
+class TestUpdateTally:
+    def test_counts_are_added_atomically(self, tally_connection):
+        tallies.update_tally("hr1-114", tallies.ALL_SCOPE, {"yes": 2, "no": -1, "abstain": 0})
+
+        assert tally_connection.counts == {("hr1-114", "all"): {"count_yes": 2, "count_no": -1}}
+
+
+class TestGetTally:
+    def test_missing_tally_is_empty(self, memory_engine):
+        assert tallies.get_tally("hr1-114") == {}
+
+
+class TestRebuildTallies:
+    def test_votes_with_and_without_a_zip_code(self, memory_engine):
+        for customer_uuid, vote_result, zip_code in (("c1", "yes", "94110"), ("c2", "yes", None), ("c3", "no", None)):
+            vote = {VFields.CUSTOMER_UUID: customer_uuid, VFields.BILL_ID: "hr1-114", VFields.VOTE_RESULT: vote_result}
+            if zip_code is not None:
+                vote[VFields.ZIP_CODE] = zip_code
+            memory_engine.put_item(models.TableNames.VOTES, vote)
+
+        # Drifted and stale tallies are replaced
+        tallies.update_tally("hr1-114", tallies.ALL_SCOPE, {"yes": 5})
+        tallies.update_tally("hr1-114", "zip:10001", {"no": 1})
+
+        assert tallies.rebuild_tallies(total_segments=2) == 2
+        assert tallies.get_tally("hr1-114") == {"yes": 2, "no": 1}
+        assert tallies.get_tally("hr1-114", "zip:94110") == {"yes": 1}
+        assert tallies.get_tally("hr1-114", "zip:10001") == {}
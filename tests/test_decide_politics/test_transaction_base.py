@@ -35,6 +35,84 @@ class TestStateNode:
         assert new_state_node != state_node_begin
         assert is_success
 
+    def test_declarative_triggers(self, dummy_customer):
+        state_node = tb.StateNode("0")
+        keyword_node, prefix_node, long_prefix_node, regex_node, default_node = \
+            [tb.StateNode(str(i)) for i in range(1, 6)]
+
+        state_node.register_keyword("VOTE", keyword_node)
+        state_node.register_prefix("VOTE ", prefix_node)
+        state_node.register_prefix("VOTE HR", long_prefix_node)
+        state_node.register_regex("[0-9]+$", regex_node)
+        state_node.register_default(default_node)
+
+        def target_of(message):
+            return state_node.handle_trigger_event(dummy_customer, tb.TriggerData(message=message))[1]
+
+        assert target_of("VOTE") == keyword_node
+        assert target_of("VOTE S123") == prefix_node
+        assert target_of("VOTE HR123") == long_prefix_node
+        assert target_of("1234") == regex_node
+        assert target_of("HELLO") == default_node
+        assert target_of(None) == default_node
+
+    def test_no_trigger(self, dummy_customer):
+        state_node = tb.StateNode("0")
+        state_node.register_keyword("EXIT", None)
+
+        assert state_node.handle_trigger_event(dummy_customer, tb.TriggerData(message="EXIT")) == (True, None)
+        assert state_node.handle_trigger_event(dummy_customer, tb.TriggerData(message="ACK")) == (False, None)
+
+    def test_conflicting_triggers(self):
+        state_node = tb.StateNode("0")
+        state_node.register_keyword("ACK", None)
+        state_node.register_prefix("ACK ", None)
+        state_node.register_regex("[0-9]+$", None)
+        state_node.register_default(None)
+
+        with pytest.raises(ValueError):
+            state_node.register_keyword("ACK", state_node)
+        with pytest.raises(ValueError):
+            state_node.register_prefix("ACK ", state_node)
+        with pytest.raises(ValueError):
+            state_node.register_regex("[0-9]+$", state_node)
+        with pytest.raises(ValueError):
+            state_node.register_default(state_node)
+
+    def test_keywords_that_other_triggers_match_are_rejected(self):
+        state_node = tb.StateNode("0")
+        state_node.register_keyword("VOTE", None)
+        state_node.register_prefix("ACK ", None)
+        state_node.register_regex("[0-9]+$", None)
+
+        with pytest.raises(ValueError):
+            state_node.register_keyword("ACK 1", state_node)
+        with pytest.raises(ValueError):
+            state_node.register_keyword("123", state_node)
+        with pytest.raises(ValueError):
+            state_node.register_prefix("VO", state_node)
+        with pytest.raises(ValueError):
+            state_node.register_regex("V", state_node)
+
+    def test_precedence_of_overlapping_triggers(self, dummy_customer):
+        state_node = tb.StateNode("0")
+        short_prefix_node, long_prefix_node, first_regex_node, second_regex_node = \
+            [tb.StateNode(str(i)) for i in range(1, 5)]
+
+        state_node.register_regex("VOTE [0-9]+$", first_regex_node)
+        state_node.register_regex("VOTE", second_regex_node)
+        state_node.register_prefix("VOTE H", short_prefix_node)
+        state_node.register_prefix("VOTE HR", long_prefix_node)
+
+        def target_of(message):
+            return state_node.handle_trigger_event(dummy_customer, tb.TriggerData(message=message))[1]
+
+        # Longer prefixes first, then prefixes, then regular expressions in registration order
+        assert target_of("VOTE HR1") == long_prefix_node
+        assert target_of("VOTE H1") == short_prefix_node
+        assert target_of("VOTE 12") == first_regex_node
+        assert target_of("VOTES") == second_regex_node
+
 
 class TestTransactionBase:
 
@@ -5,6 +5,7 @@ from unittest.mock import patch
 
 from decide_politics.core.models import CFields
 from decide_politics.core.models import Customer
+from decide_politics.transactions import router
 from decide_politics.transactions import transaction_base as tb
 from decide_politics.transactions.transaction_manager import TransactionManager
 
@@ -15,10 +16,10 @@ def dummy_customer():
         CFields.PHONE_NUMBER: "+15419670010"
     })
 
-@pytest.fixture
-def dummy_transaction():
+def make_dummy_transaction():
     class DummyTransactionBase(tb.TransactionBase):
         ID = 'dummy_id'
+        COMMANDS = ('DUMMY',)
 
         STATE_NODES = {
             'begin': tb.StateNode('begin'),
@@ -36,12 +37,14 @@ def dummy_transaction():
 
     return DummyTransactionBase()
 
+@pytest.fixture
+def dummy_transaction():
+    return make_dummy_transaction()
+
 
 class TestTransactionManager:
-    @patch('decide_politics.transactions.transaction_manager.TransactionManager.COMMAND_TO_TRANSACTION_MAP',
-        dict(DUMMY=dummy_transaction()))
-    @patch('decide_politics.transactions.transaction_manager.TransactionManager.TRANSACTION_ID_TO_TRANSACTION_MAP',
-        {dummy_transaction().ID: dummy_transaction()})
+    @patch('decide_politics.transactions.transaction_manager.TransactionManager.ROUTER',
+        router.CommandRouter([make_dummy_transaction()]))
     def test_general(self, dummy_customer, dummy_transaction):
         TransactionManager.handle_message(dummy_customer, "DUMMY")
 
@@ -52,3 +55,50 @@ class TestTransactionManager:
 
         assert dummy_customer[CFields.CUR_TRANSACTION_ID] == dummy_transaction.ID
         assert dummy_customer[CFields.TRANSACTION_STATE_ID] == "end"
+
+
+class TestCommandRouter:
+    class DummyTransaction:
+        def __init__(self, transaction_id, *commands):
+            self.ID = transaction_id
+            self.COMMANDS = commands
+
+    def test_route(self):
+        vote = self.DummyTransaction("vote", "VOTE", "V")
+        vote_info = self.DummyTransaction("vote_info", "VOTE INFO")
+        command_router = router.CommandRouter([vote, vote_info])
+
+        route = command_router.route("VOTE HR1234 YES")
+        assert route.transaction is vote
+        assert route.command == "VOTE"
+        assert route.args == ["HR1234", "YES"]
+
+        route = command_router.route("VOTE INFO HR1234")
+        assert route.transaction is vote_info
+        assert route.args == ["HR1234"]
+
+        assert command_router.route("V  HR1234").args == ["HR1234"]
+        assert command_router.route("VOTES") is None
+        assert command_router.route("") is None
+        assert command_router.get_transaction("vote_info") is vote_info
+
+    def test_conflicting_commands(self):
+        command_router = router.CommandRouter([self.DummyTransaction("vote", "VOTE")])
+
+        with pytest.raises(ValueError):
+            command_router.register(self.DummyTransaction("other_vote", "VOTE"))
+        with pytest.raises(ValueError):
+            command_router.register(self.DummyTransaction("vote", "OTHER"))
+
+    def test_rejected_transaction_routes_no_command(self):
+        command_router = router.CommandRouter([self.DummyTransaction("vote", "VOTE INFO")])
+
+        with pytest.raises(ValueError):
+            command_router.register(self.DummyTransaction("other_vote", "VOTE", "VOTE INFO"))
+        with pytest.raises(ValueError):
+            command_router.register(self.DummyTransaction("other_vote", "V", "V"))
+
+        assert command_router.route("VOTE HR1234") is None
+        assert command_router.route("V HR1234") is None
+        assert command_router.route("VOTE INFO HR1234").transaction.ID == "vote"
+        assert len(command_router) == 1
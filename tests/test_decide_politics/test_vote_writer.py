@@ -0,0 +1,164 @@
+import decide_politics_base_test
+
+import pytest
+from unittest.mock import patch
+
+import decide_politics.logic.tallies as tallies
+import decide_politics.logic.vote_writer as vote_writer
+from shared.common import Errors, DecidePoliticsException
+from decide_politics.core.models import VFields
+from decide_politics.core.models import Votes
+
+
+class FakeBatch:
+    """Writes each vote as it's put, failing once `fail_after` votes were written"""
+    def __init__(self, stored, fail_after=None):
+        self.stored = stored
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def put(self, vote):
+        if self.fail_after is not None and len(self.stored["puts"]) >= self.fail_after:
+            raise DecidePoliticsException(Errors.BATCH_INCOMPLETE)
+
+        data = dict(vote.item._data)
+        self.stored["puts"].append(data)
+        self.stored["votes"][(data[VFields.CUSTOMER_UUID], data[VFields.BILL_ID])] = data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def storage():
+    """Stores written votes and tally changes in memory"""
+    stored = {"votes": {}, "puts": [], "tallies": {}}
+
+    def batch_load(keys):
+        return [Votes.load_from_cache_data(dict(stored["votes"][key])) for key in keys if key in stored["votes"]]
+
+    def update_tally(bill_id, scope, deltas):
+        counts = stored["tallies"].setdefault((bill_id, scope), {})
+        for result, delta in deltas.items():
+            counts[result] = counts.get(result, 0) + delta
+
+    with patch.object(Votes, "batch_load", side_effect=batch_load), \
+            patch.object(Votes, "batch_writer", lambda: FakeBatch(stored)), \
+            patch.object(tallies, "update_tally", side_effect=update_tally):
+        yield stored
+
+
+@pytest.fixture
+def writer():
+    writer = vote_writer.BufferedVoteWriter(max_batch_size=100, flush_interval=1.0, clock=FakeClock())
+    with patch.object(writer, "_start_flusher"):
+        yield writer
+
+
+class TestBufferedVoteWriter:
+    def test_last_vote_in_the_window_wins(self, storage, writer):
+        writer.record("c1", "hr1", "YES", zip_code="94110")
+        writer.record("c2", "hr1", "YES")
+        writer.record("c1", "hr1", "NO", zip_code="94110")
+
+        assert writer.flush() == 2
+        assert [(p[VFields.CUSTOMER_UUID], p[VFields.VOTE_RESULT]) for p in storage["puts"]] == \
+            [("c1", "NO"), ("c2", "YES")]
+        assert storage["tallies"] == {
+            ("hr1", "all"): {"NO": 1, "YES": 1},
+            ("hr1", "zip:94110"): {"NO": 1},
+        }
+
+        stats = writer.stats()
+        assert stats["coalesced"] == 1
+        assert stats["batches"] == 1
+        assert stats["last_batch_size"] == 2
+
+    def test_changed_votes_move_the_tally_and_unchanged_votes_are_skipped(self, storage, writer):
+        storage["votes"][("c1", "hr1")] = {
+            VFields.CUSTOMER_UUID: "c1", VFields.BILL_ID: "hr1", VFields.VOTE_RESULT: "YES", VFields.VERSION: 1,
+        }
+        storage["votes"][("c2", "hr1")] = {
+            VFields.CUSTOMER_UUID: "c2", VFields.BILL_ID: "hr1", VFields.VOTE_RESULT: "YES", VFields.VERSION: 1,
+        }
+
+        writer.record("c1", "hr1", "NO")
+        writer.record("c2", "hr1", "YES")
+
+        assert writer.flush() == 1
+        assert storage["tallies"] == {("hr1", "all"): {"NO": 1, "YES": -1}}
+        assert writer.stats()["unchanged"] == 1
+
+    def test_failed_flush_is_retried_without_overwriting_newer_votes(self, storage, writer):
+        writer.record("c1", "hr1", "YES")
+        writer.record("c2", "hr1", "YES")
+
+        with patch.object(Votes, "batch_load", side_effect=OSError):
+            assert writer.flush() == 0
+
+        writer.record("c1", "hr1", "NO")
+        assert writer.flush() == 2
+        assert {p[VFields.CUSTOMER_UUID]: p[VFields.VOTE_RESULT] for p in storage["puts"]} == \
+            {"c1": "NO", "c2": "YES"}
+
+    def test_votes_written_before_a_failed_flush_are_counted_by_the_retry(self, storage, writer):
+        writer.record("c1", "hr1", "YES")
+        writer.record("c2", "hr1", "YES")
+        writer.record("c3", "hr1", "YES")
+
+        with patch.object(Votes, "batch_writer", lambda: FakeBatch(storage, fail_after=2)):
+            assert writer.flush() == 0
+        assert len(storage["votes"]) == 2
+        assert storage["tallies"] == {}
+
+        writer.record("c1", "hr1", "NO")
+        assert writer.flush() == 3
+        assert storage["tallies"] == {("hr1", "all"): {"YES": 2, "NO": 1}}
+        assert writer.stats()["unsettled"] == 0
+
+    def test_failed_tally_update_does_not_retry_the_votes(self, storage, writer):
+        writer.record("c1", "hr1", "YES", zip_code="94110")
+
+        with patch.object(tallies, "update_tally", side_effect=OSError):
+            assert writer.flush() == 1
+
+        assert writer.flush() == 0
+        assert len(storage["puts"]) == 1
+
+    def test_flush_is_due_after_the_interval_or_a_full_batch(self, storage, writer):
+        writer.record("c1", "hr1", "YES")
+        assert not writer._is_due()
+
+        writer._clock.now += 1.0
+        assert writer._is_due()
+
+        writer.flush()
+        for i in range(100):
+            writer.record("c%d" % i, "hr2", "YES")
+        assert writer._is_due()
+
+    def test_stop_writes_pending_votes(self, storage):
+        writer = vote_writer.BufferedVoteWriter(flush_interval=60)
+        writer.record("c1", "hr1", "YES")
+        writer.stop()
+
+        assert len(storage["puts"]) == 1
+
+    def test_votes_recorded_after_stop_are_written(self, storage):
+        writer = vote_writer.BufferedVoteWriter(flush_interval=60)
+        writer.stop()
+        writer.record("c1", "hr1", "YES")
+
+        assert len(storage["puts"]) == 1
+        assert writer.stats()["pending"] == 0
+        assert writer._flusher is None
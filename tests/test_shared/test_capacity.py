@@ -0,0 +1,112 @@
+import shared_base_test
+
+import json
+import logging
+import pytest
+
+import shared.capacity as capacity
+import shared.metrics as metrics
+import shared.service as service
+
+
+@pytest.fixture
+def registry():
+    return metrics.MetricsRegistry(prefix="test")
+
+
+@pytest.fixture
+def tracker(registry):
+    return capacity.CapacityTracker(registry, log_threshold=5)
+
+
+def consumed_units(registry):
+    return {dict(labels)["operation"]: units
+        for labels, units in registry._counters[capacity.CONSUMED_CAPACITY].items()}
+
+
+class FakeConnection:
+    def __init__(self, response):
+        self.response = response
+        self.bodies = []
+
+    def make_request(self, action, body):
+        self.bodies.append(body)
+        return self.response
+
+
+class TestCapacityTracker:
+    def test_request_capacity(self, tracker):
+        body = tracker.request_capacity("GetItem", json.dumps({"TableName": "Customers"}))
+        assert json.loads(body) == {"ReturnConsumedCapacity": "TOTAL", "TableName": "Customers"}
+
+        assert tracker.request_capacity("DescribeTable", '{"TableName": "Customers"}') == '{"TableName": "Customers"}'
+
+    def test_record_is_attributed_to_the_innermost_operation(self, tracker, registry):
+        response = {"ConsumedCapacity": {"TableName": "Customers", "CapacityUnits": 1.0}}
+
+        with tracker.operation("Customer", "get_or_create_by_phone_number"):
+            with tracker.operation("Customer", "create"):
+                tracker.record("PutItem", response)
+            tracker.record("Query", response)
+        tracker.record("UpdateItem", response)
+
+        labels = [dict(labels) for labels in registry._counters[capacity.CONSUMED_CAPACITY]]
+        assert dict(table="Customers", kind="write", endpoint=capacity.BACKGROUND_ENDPOINT,
+            model="Customer", operation="create") in labels
+        assert consumed_units(registry) == {"create": 1.0, "get_or_create_by_phone_number": 1.0, "UpdateItem": 1.0}
+
+    def test_batch_responses_are_counted_per_table(self, tracker, registry):
+        tracker.record("BatchWriteItem", {"ConsumedCapacity": [
+            {"TableName": "Votes", "CapacityUnits": 25.0},
+            {"TableName": "Tallies", "CapacityUnits": 2.0},
+        ]})
+
+        tables = {dict(labels)["table"]: units
+            for labels, units in registry._counters[capacity.CONSUMED_CAPACITY].items()}
+        assert tables == {"Votes": 25.0, "Tallies": 2.0}
+
+    def test_responses_without_capacity_are_ignored(self, tracker, registry):
+        tracker.record("GetItem", {"Item": {}})
+        assert capacity.CONSUMED_CAPACITY not in registry._counters
+
+    def test_requests_over_the_threshold_are_logged(self, tracker, registry, caplog):
+        tracker.begin_request("/sms/handle_sms")
+        with tracker.operation("Customer", "save"):
+            tracker.record("UpdateItem", {"ConsumedCapacity": {"TableName": "Customers", "CapacityUnits": 2.0}})
+        assert tracker.end_request() == 2.0
+        assert not caplog.records
+
+        tracker.begin_request("/sms/handle_sms")
+        with tracker.operation("Votes", "batch_load"):
+            tracker.record("BatchGetItem", {"ConsumedCapacity": [{"TableName": "Votes", "CapacityUnits": 6.0}]})
+        with caplog.at_level(logging.WARNING):
+            assert tracker.end_request() == 6.0
+        assert "Votes.batch_load=6.0" in caplog.text
+
+        labels = dict(next(iter(registry._counters[capacity.CONSUMED_CAPACITY])))
+        assert labels["endpoint"] == "/sms/handle_sms"
+        assert 'test_http_request_consumed_capacity_units_count{endpoint="/sms/handle_sms"} 2' in registry.render()
+
+    def test_model_operation(self, monkeypatch, tracker, registry):
+        monkeypatch.setattr(capacity, "tracker", tracker)
+
+        class Model:
+            @classmethod
+            @capacity.model_operation
+            def load(cls):
+                tracker.record("GetItem", {"ConsumedCapacity": {"TableName": "T", "CapacityUnits": 0.5}})
+
+        Model.load()
+        labels = dict(next(iter(registry._counters[capacity.CONSUMED_CAPACITY])))
+        assert (labels["model"], labels["operation"]) == ("Model", "load")
+
+
+class TestInstrumentedConnection:
+    def test_requests_ask_for_and_record_capacity(self, monkeypatch, tracker, registry):
+        monkeypatch.setattr(capacity, "tracker", tracker)
+        response = {"Item": {}, "ConsumedCapacity": {"TableName": "Customers", "CapacityUnits": 0.5}}
+        connection = service._instrument_dynamodb(FakeConnection(response))
+
+        assert connection.make_request("GetItem", '{"TableName": "Customers"}') is response
+        assert json.loads(connection.bodies[0])["ReturnConsumedCapacity"] == "TOTAL"
+        assert consumed_units(registry) == {"GetItem": 0.5}
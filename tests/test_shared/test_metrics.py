@@ -0,0 +1,99 @@
+import shared_base_test
+
+import pytest
+
+import shared.metrics as metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.MetricsRegistry(prefix="test")
+
+
+class TestHistogram:
+    def test_samples_are_counted_in_the_first_bucket_they_fit(self):
+        histogram = metrics.Histogram((1, 2, 5))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+
+        assert histogram.counts == [2, 1, 1, 1]
+        assert list(histogram.cumulative_counts()) == [2, 3, 4, 5]
+        assert histogram.count == 5
+        assert histogram.sum == 16
+
+
+class TestMetricsRegistry:
+    def test_render_counters_and_histograms(self, registry):
+        labels = (("endpoint", "/sms/handle_sms"), ("method", "POST"))
+        registry.inc("requests_total", labels)
+        registry.inc("requests_total", labels)
+        registry.observe("calls", 2, labels, buckets=(1, 3))
+
+        assert registry.render().splitlines() == [
+            '# TYPE test_requests_total counter',
+            'test_requests_total{endpoint="/sms/handle_sms",method="POST"} 2',
+            '# TYPE test_calls histogram',
+            'test_calls_bucket{endpoint="/sms/handle_sms",method="POST",le="1"} 0',
+            'test_calls_bucket{endpoint="/sms/handle_sms",method="POST",le="3"} 1',
+            'test_calls_bucket{endpoint="/sms/handle_sms",method="POST",le="+Inf"} 1',
+            'test_calls_sum{endpoint="/sms/handle_sms",method="POST"} 2.0',
+            'test_calls_count{endpoint="/sms/handle_sms",method="POST"} 1',
+        ]
+
+    def test_label_values_are_escaped(self, registry):
+        registry.inc("total", (("path", 'a"b\\c\n'),))
+        assert 'test_total{path="a\\"b\\\\c\\n"} 1' in registry.render()
+
+    def test_time_call_records_latency_and_errors(self, registry):
+        with registry.time_call("dynamodb", "GetItem"):
+            pass
+
+        with pytest.raises(ValueError):
+            with registry.time_call("dynamodb", "GetItem"):
+                raise ValueError()
+
+        rendered = registry.render()
+        assert 'test_dependency_duration_seconds_count{dependency="dynamodb",operation="GetItem"} 2' in rendered
+        assert 'test_dependency_errors_total{dependency="dynamodb",operation="GetItem"} 1' in rendered
+
+    def test_calls_are_counted_per_request(self, registry):
+        # Outside of a request nothing is counted
+        with registry.time_call("dynamodb", "Query"):
+            pass
+
+        registry.begin_request()
+        for _ in range(3):
+            with registry.time_call("dynamodb", "Query"):
+                pass
+        with registry.time_call("twilio", "send_chunk"):
+            pass
+
+        assert registry.end_request() == {"dynamodb": 3, "twilio": 1}
+        assert registry.end_request() == {}
+
+    def test_stats_sources_are_gauges(self, registry):
+        registry.register_stats("pool", lambda: dict(
+            delayed=2,
+            sent={"+18554164150": 3, "+18554164151": 4},
+            phone_number_index=dict(hits=5),
+            name="ignored",
+        ))
+
+        assert registry.render().splitlines() == [
+            '# TYPE test_pool_delayed gauge',
+            'test_pool_delayed 2',
+            '# TYPE test_pool_phone_number_index_hits gauge',
+            'test_pool_phone_number_index_hits 5',
+            '# TYPE test_pool_sent gauge',
+            'test_pool_sent{key="+18554164150"} 3',
+            'test_pool_sent{key="+18554164151"} 4',
+        ]
+
+    def test_failing_stats_source_is_skipped(self, registry):
+        def broken():
+            raise RuntimeError()
+
+        registry.register_stats("broken", broken)
+        registry.register_stats("working", lambda: dict(size=1))
+
+        assert registry.render().splitlines() == ['# TYPE test_working_size gauge', 'test_working_size 1']
@@ -0,0 +1,113 @@
+import shared_base_test
+
+import threading
+import pytest
+from unittest.mock import patch
+
+import shared.outbound as outbound
+import shared.workers as workers
+from shared.common import Errors, DecidePoliticsException
+
+
+class RetryableError(Exception):
+    pass
+
+
+class FakeSender:
+    """Records sent chunks and fails the first `failures` attempts of every chunk"""
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = {}
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def is_connected(self):
+        return True
+
+    def split_msg(self, body):
+        return [body[i : i + 4] for i in range(0, len(body), 4)]
+
+    def is_retryable(self, exception):
+        return isinstance(exception, RetryableError)
+
+    def send_chunk(self, to, body, from_):
+        with self.lock:
+            attempt = self.attempts.get((to, body), 0)
+            self.attempts[(to, body)] = attempt + 1
+            if attempt < self.failures:
+                raise RetryableError()
+
+            self.sent.append((to, body))
+
+
+class TestOutboundDispatcher:
+    def test_messages_to_a_recipient_stay_in_order(self):
+        sender = FakeSender()
+        dispatcher = outbound.OutboundDispatcher(sender, num_workers=4)
+
+        for i in range(20):
+            dispatcher.send_msg("+15419670010", "m%02d" % i)
+            dispatcher.send_msg("+15419670011", "n%02d" % i)
+
+        assert dispatcher.flush(timeout=5)
+        assert [body for to, body in sender.sent if to == "+15419670010"] == ["m%02d" % i for i in range(20)]
+        assert [body for to, body in sender.sent if to == "+15419670011"] == ["n%02d" % i for i in range(20)]
+        assert dispatcher.stats()["sent"] == 40
+
+        dispatcher.stop()
+
+    def test_counters_add_up_across_workers(self):
+        sender = FakeSender()
+        dispatcher = outbound.OutboundDispatcher(sender, num_workers=8, max_queue_size=5000)
+
+        for i in range(2000):
+            dispatcher.send_msg("+1541967%04d" % (i % 64), "m%03d" % (i % 1000))
+
+        assert dispatcher.flush(timeout=10)
+        assert dispatcher.stats()["sent"] == len(sender.sent) == 2000
+
+        dispatcher.stop()
+
+    @patch("time.sleep")
+    def test_retries(self, sleep):
+        sender = FakeSender(failures=2)
+        dispatcher = outbound.OutboundDispatcher(sender, num_workers=1, max_retries=2)
+
+        _send_inline(dispatcher, "+15419670010", "hello world")
+
+        assert [body for to, body in sender.sent] == ["hell", "o wo", "rld"]
+        assert dispatcher.stats()["retried"] == 6
+
+    @patch("time.sleep")
+    def test_gives_up_after_max_retries(self, sleep):
+        sender = FakeSender(failures=3)
+        dispatcher = outbound.OutboundDispatcher(sender, num_workers=1, max_retries=2)
+
+        _send_inline(dispatcher, "+15419670010", "hello world")
+
+        # The rest of the message is dropped with the failed chunk
+        assert sender.sent == []
+        assert dispatcher.stats()["failed"] == 1
+
+    def test_backpressure(self):
+        dispatcher = outbound.OutboundDispatcher(FakeSender(), num_workers=1, max_queue_size=1,
+            enqueue_timeout=0)
+
+        # Keep the workers from draining the queue
+        with patch.object(dispatcher._pool, "_start_workers"):
+            dispatcher.send_msg("+15419670010", "first")
+            with pytest.raises(DecidePoliticsException) as e:
+                dispatcher.send_msg("+15419670010", "second")
+
+        assert e.value.error_type is Errors.OUTBOUND_QUEUE_FULL
+        assert dispatcher.stats()["rejected"] == 1
+
+
+def _send_inline(dispatcher, to, body):
+    """Sends a message on the calling thread instead of a worker"""
+    with patch.object(dispatcher._pool, "_start_workers"):
+        dispatcher.send_msg(to, body)
+
+    for work_queue in dispatcher._pool._queues:
+        work_queue.put(workers._STOP)
+        dispatcher._pool._run_worker(work_queue)
@@ -0,0 +1,78 @@
+import shared_base_test
+
+import greenlet
+import os
+import time
+from unittest.mock import patch
+
+import shared.config as config
+import shared.profiler as profiler
+
+
+def busy_wait(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def waiting_in_io():
+    greenlet.getcurrent().parent.switch()
+
+
+class TestSamplingProfiler:
+    def test_should_profile(self):
+        sampler = profiler.SamplingProfiler("profiles", token="secret")
+        assert sampler.should_profile("secret")
+        assert not sampler.should_profile("guess")
+        assert not sampler.should_profile()
+
+        assert profiler.SamplingProfiler("profiles", sample_rate=1.0).should_profile()
+        assert not profiler.SamplingProfiler("profiles").should_profile("secret")
+
+    def test_writes_collapsed_stacks_tagged_with_the_transaction(self, tmpdir):
+        sampler = profiler.SamplingProfiler(str(tmpdir), interval=0.001)
+
+        session = sampler.start("/sms/handle_sms")
+        sampler.tag("transaction", "WelcomeTransaction")
+        busy_wait(0.1)
+        path = sampler.stop(session)
+
+        assert os.path.dirname(path) == str(tmpdir)
+        assert os.path.basename(path).endswith("_sms_handle_sms_WelcomeTransaction_1.collapsed")
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == session.num_samples
+        assert any("test_profiler.py:busy_wait" in line.split(";")[-1] for line in lines)
+
+        assert sampler.stats() == dict(active=0, profiled=1)
+
+    def test_no_samples_writes_nothing(self, tmpdir):
+        sampler = profiler.SamplingProfiler(str(tmpdir), interval=60)
+        assert sampler.stop(sampler.start("/")) is None
+        assert not tmpdir.listdir()
+
+    def test_tag_without_a_session_does_nothing(self, tmpdir):
+        profiler.SamplingProfiler(str(tmpdir)).tag("transaction", "WelcomeTransaction")
+
+
+class TestProfileSession:
+    def test_samples_a_waiting_greenlet(self):
+        waiting = greenlet.greenlet(waiting_in_io)
+        waiting.switch()
+
+        session = profiler.ProfileSession("/", thread_id=None, greenlet=waiting)
+        session.sample({})
+
+        (codes, count), = session.stacks.items()
+        assert codes[-1].co_name == "waiting_in_io"
+        assert count == 1
+
+        waiting.switch()
+
+    def test_configured_output_dir_is_created_in_the_data_dir(self, tmpdir):
+        with patch.dict(config.store, {"data_dir": str(tmpdir), "profiler": {"enabled": True, "output_dir": "profiles"}}):
+            sampler = profiler._create_profiler()
+
+        assert sampler.output_dir == str(tmpdir.join("profiles"))
+        assert tmpdir.join("profiles").check(dir=True)
@@ -0,0 +1,149 @@
+import shared_base_test
+
+import requests
+
+import shared.response_cache as response_cache
+import shared.service as service
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Answers every request with the number of requests sent so far"""
+    def __init__(self):
+        self.requests = []
+        self.fail = False
+
+    def request(self, method, url, params, data, timeout):
+        if self.fail:
+            raise requests.exceptions.ConnectionError()
+
+        self.requests.append((method, url, params))
+        return FakeResponse({"results": len(self.requests)})
+
+
+def make_sunlight(clock):
+    sunlight = service.SunlightFoundationService(
+        "key",
+        response_cache=response_cache.ResponseCache(max_size=10, clock=clock),
+        default_ttl=10,
+        stale_ttl=100,
+        ttls={"legislators": 1000},
+    )
+    sunlight.session = FakeSession()
+
+    return sunlight
+
+
+class TestResponseCache:
+    def test_get_returns_age_and_value(self):
+        clock = FakeClock()
+        cache = response_cache.ResponseCache(clock=clock)
+
+        assert cache.get("a") is None
+        cache.put("a", {"b": 1})
+        clock.now += 5
+        assert cache.get("a") == (5, {"b": 1})
+
+    def test_disk_cache_survives_restarts(self, tmpdir):
+        clock = FakeClock()
+        path = str(tmpdir.join("cache.sqlite"))
+        response_cache.ResponseCache(disk_path=path, clock=clock).put("a", [1, 2])
+
+        cache = response_cache.ResponseCache(disk_path=path, clock=clock)
+        assert cache.get("a") == (0, [1, 2])
+        assert cache.stats()["disk_hits"] == 1
+
+    def test_expired_rows_are_pruned(self, tmpdir):
+        clock = FakeClock()
+        path = str(tmpdir.join("cache.sqlite"))
+        cache = response_cache.ResponseCache(disk_path=path, max_age=1000, clock=clock)
+        cache.put("old", 1)
+        clock.now += 900
+        cache.put("new", 2)
+
+        # Pruned when the file is opened
+        clock.now += 200
+        cache = response_cache.ResponseCache(disk_path=path, max_age=1000, clock=clock)
+        assert cache.stats()["pruned"] == 1
+        assert cache.get("old") is None
+        assert cache.get("new") == (200, 2)
+
+        # And periodically as responses are put
+        clock.now += 1000
+        cache.put("newest", 3)
+        assert cache.stats()["pruned"] == 2
+
+
+class TestSunlightCaching:
+    CONGRESS = service.SunlightFoundationService.SunlightAPIs.CONGRESS
+
+    def test_fresh_responses_are_cached(self):
+        sunlight = make_sunlight(FakeClock())
+
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "bills", query="tax") == {"results": 1}
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "/bills/", query="tax") == {"results": 1}
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "bills", query="farm") == {"results": 2}
+
+        # The api key is sent but isn't part of the cache key
+        assert sunlight.session.requests[0][2] == {"query": "tax", "apikey": "key"}
+
+    def test_cache_can_be_bypassed(self):
+        sunlight = make_sunlight(FakeClock())
+
+        sunlight.send_api_request(self.CONGRESS, "GET", "bills", page=1)
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "bills", use_cache=False, page=1) == {"results": 2}
+
+        # use_cache isn't sent as a query parameter
+        assert sunlight.session.requests[1][2] == {"page": 1, "apikey": "key"}
+
+    def test_ttl_is_per_endpoint(self):
+        clock = FakeClock()
+        sunlight = make_sunlight(clock)
+
+        sunlight.send_api_request(self.CONGRESS, "GET", "bills")
+        sunlight.send_api_request(self.CONGRESS, "GET", "legislators")
+        clock.now += 500
+
+        # Bills are past their TTL and stale window, legislators are still fresh
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "bills") == {"results": 3}
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "legislators") == {"results": 2}
+
+    def test_stale_response_is_served_while_refreshing(self):
+        clock = FakeClock()
+        sunlight = make_sunlight(clock)
+
+        sunlight.send_api_request(self.CONGRESS, "GET", "bills")
+        clock.now += 50
+
+        refreshes = []
+        sunlight._refresh_in_background = lambda *args: refreshes.append(args)
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "bills") == {"results": 1}
+        assert len(refreshes) == 1
+
+    def test_stale_response_is_served_when_the_api_is_down(self):
+        clock = FakeClock()
+        sunlight = make_sunlight(clock)
+
+        sunlight.send_api_request(self.CONGRESS, "GET", "bills")
+        clock.now += 500
+        sunlight.session.fail = True
+
+        assert sunlight.send_api_request(self.CONGRESS, "GET", "bills") == {"results": 1}
@@ -0,0 +1,106 @@
+import shared_base_test
+
+import pytest
+from unittest.mock import patch
+
+import shared.rate_limit as rate_limit
+import shared.sender_pool as sender_pool
+import shared.service as service
+from shared.common import Errors, DecidePoliticsException
+
+NUMBERS = ["+18554164150", "+18554164151", "+18554164152"]
+
+
+class SimulatedClock:
+    """A clock that only moves when something sleeps"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return SimulatedClock()
+
+
+@pytest.fixture
+def mock_twilio():
+    mock_twilio = service.MockTwillioService()
+    with patch.object(mock_twilio, "send_chunk") as send_chunk:
+        yield mock_twilio
+
+
+def make_pool(mock_twilio, clock, **kwargs):
+    return sender_pool.SenderPool(mock_twilio, NUMBERS, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestTokenBucket:
+    def test_refills_at_rate_up_to_capacity(self, clock):
+        bucket = rate_limit.TokenBucket(rate=2, capacity=3, clock=clock)
+        assert all(bucket.try_acquire() for _ in range(3))
+        assert not bucket.try_acquire()
+        assert bucket.time_until_available() == 0.5
+
+        clock.now += 10
+        assert bucket.available() == 3
+
+
+class TestSenderPool:
+    def test_recipients_always_hear_from_the_same_number(self, mock_twilio, clock):
+        pool = make_pool(mock_twilio, clock, rate_per_number=100, burst=100)
+        recipients = ["+1541967%04d" % i for i in range(30)]
+        for _ in range(2):
+            for to in recipients:
+                pool.send_msg(to, "Hello!")
+
+        from_numbers = {}
+        for call in mock_twilio.send_chunk.call_args_list:
+            to, _, from_ = call[0]
+            from_numbers.setdefault(to, set()).add(from_)
+
+        assert all(len(numbers) == 1 for numbers in from_numbers.values())
+        # Every number gets some of the recipients
+        assert set.union(*from_numbers.values()) == set(NUMBERS)
+
+    def test_adding_a_number_only_moves_its_recipients(self, mock_twilio, clock):
+        pool = make_pool(mock_twilio, clock)
+        bigger_pool = sender_pool.SenderPool(mock_twilio, NUMBERS + ["+18554164153"], clock=clock)
+
+        for i in range(100):
+            to = "+1541967%04d" % i
+            assert bigger_pool.get_number(to) in (pool.get_number(to), "+18554164153")
+
+    def test_waits_for_a_token(self, mock_twilio, clock):
+        pool = make_pool(mock_twilio, clock, rate_per_number=1, burst=1, max_wait=5)
+        pool.send_msg("+15419670010", "one")
+        pool.send_msg("+15419670010", "two")
+
+        assert clock.now == 1.0
+        assert pool.stats()["delayed"] == 1
+
+    def test_rejects_when_no_token_is_available_in_time(self, mock_twilio, clock):
+        pool = make_pool(mock_twilio, clock, rate_per_number=0.1, burst=1, max_wait=5)
+        pool.send_msg("+15419670010", "one")
+
+        with pytest.raises(DecidePoliticsException) as e:
+            pool.send_msg("+15419670010", "two")
+
+        assert e.value.error_type is Errors.SENDER_RATE_LIMITED
+        assert pool.is_retryable(e.value)
+        assert clock.now == 0.0
+
+    def test_falls_back_to_other_numbers_when_not_strict(self, mock_twilio, clock):
+        pool = make_pool(mock_twilio, clock, rate_per_number=0.1, burst=1, max_wait=0, strict_sticky=False)
+        for _ in range(3):
+            pool.send_msg("+15419670010", "hi")
+
+        assert sorted(call[0][2] for call in mock_twilio.send_chunk.call_args_list) == NUMBERS
+        assert pool.stats()["fallbacks"] == 2
+
+        with pytest.raises(DecidePoliticsException):
+            pool.send_msg("+15419670010", "hi")
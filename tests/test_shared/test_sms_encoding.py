@@ -0,0 +1,97 @@
+import shared_base_test
+
+import shared.config as config
+import shared.service as service
+import shared.sms_encoding as sms_encoding
+
+
+class TestCountSegments:
+    def test_gsm7_single_segment(self):
+        assert sms_encoding.count_segments("a" * 160) == 1
+        assert sms_encoding.count_segments("a" * 161) == 2
+
+    def test_gsm7_multiple_segments(self):
+        assert sms_encoding.count_segments("a" * 306) == 2
+        assert sms_encoding.count_segments("a" * 307) == 3
+
+    def test_extension_characters_take_two_septets(self):
+        assert sms_encoding.count_segments("{" * 80) == 1
+        assert sms_encoding.count_segments("{" * 81) == 2
+
+    def test_escape_sequences_are_not_split(self):
+        # 152 septets fit in the first segment, the escape sequence moves to the next
+        assert sms_encoding.count_segments("a" * 152 + "€" + "a" * 152) == 3
+
+    def test_ucs2(self):
+        assert sms_encoding.count_segments("é" * 10 + "中" * 60) == 1
+        assert sms_encoding.count_segments("中" * 71) == 2
+
+    def test_empty(self):
+        assert sms_encoding.count_segments("") == 0
+
+
+class TestEncode:
+    def test_smart_quotes_are_transliterated(self):
+        encoded = sms_encoding.encode("It’s “HR 1” — vote now…")
+        assert encoded.encoding == sms_encoding.GSM7
+        assert encoded.chunks == ["It's \"HR 1\" - vote now..."]
+        assert encoded.segments == 1
+
+    def test_transliteration_can_be_disabled(self):
+        encoded = sms_encoding.encode("It’s", transliterate_text=False)
+        assert encoded.encoding == sms_encoding.UCS2
+        assert encoded.chunks == ["It’s"]
+
+    def test_emoji_is_sent_as_ucs2(self):
+        body = "Vote “yes” \U0001F5F3"
+        encoded = sms_encoding.encode(body)
+        assert encoded.encoding == sms_encoding.UCS2
+        # Transliterating wouldn't make it GSM-7, so the original characters are kept
+        assert encoded.chunks == [body]
+
+    def test_short_message_is_one_chunk(self):
+        encoded = sms_encoding.encode("Welcome to DecidePolitics!")
+        assert encoded.chunks == ["Welcome to DecidePolitics!"]
+        assert encoded.segments == 1
+
+    def test_long_message_splits_at_whitespace_into_full_chunks(self):
+        words = ["word{}".format(i) for i in range(1000)]
+        body = " ".join(words)
+        encoded = sms_encoding.encode(body)
+
+        assert "".join(encoded.chunks) == body
+        assert len(encoded.chunks) > 1
+        for chunk in encoded.chunks:
+            assert len(chunk) <= config.MAX_TWILIO_MSG_SIZE
+            assert sms_encoding.count_segments(chunk) <= sms_encoding.MAX_SEGMENTS_PER_CHUNK
+
+        # Every chunk but the last ends at a word boundary
+        for chunk in encoded.chunks[:-1]:
+            assert chunk.endswith(" ")
+
+    def test_long_word_is_split(self):
+        encoded = sms_encoding.encode("a" * 2000)
+        assert [len(chunk) for chunk in encoded.chunks] == [1530, 470]
+        assert encoded.segments == 10 + 4
+
+    def test_fewer_segments_than_fixed_size_chunks(self):
+        body = "a" * 1600
+        assert sms_encoding.encode(body).segments == sms_encoding.count_segments(body)
+
+    def test_twilio_service_uses_encoder(self):
+        assert service.TwilioService.split_msg("It’s") == ["It's"]
+
+
+class TestCheckTemplates:
+    def test_reports_each_template(self):
+        report = sms_encoding.check_templates({
+            "welcome": "Welcome to DecidePolitics!",
+            "quoted": "“Hi”",
+            "emoji": "Hi \U0001F44B",
+            "long": "a" * 200,
+        })
+
+        assert report["welcome"] == sms_encoding.EncodedMessage(sms_encoding.GSM7, ["Welcome to DecidePolitics!"], 1)
+        assert report["quoted"].encoding == sms_encoding.GSM7
+        assert report["emoji"].encoding == sms_encoding.UCS2
+        assert report["long"].segments == 2
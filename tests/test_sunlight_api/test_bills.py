@@ -0,0 +1,69 @@
+import sunlight_api_base_test
+
+import pytest
+from unittest.mock import patch
+
+import sunlight_api.bills as bills
+
+
+def make_bill_json(i):
+    return {
+        "bill_id": "hr{}-114".format(i),
+        "congress": 114,
+        "chamber": "house",
+        "official_title": "To do thing {}".format(i),
+        "short_title": None,
+        "urls": {"congress": "https://congress.gov/{}".format(i)},
+        "history": {"active": True},
+    }
+
+
+@pytest.fixture
+def pages():
+    """Serves 5 bills, 2 per page, and records the requested pages"""
+    requested = []
+
+    def fetch_page(params, page, use_cache=True):
+        requested.append(page)
+        start = (page - 1) * params["per_page"]
+        return [make_bill_json(i) for i in range(start, min(start + params["per_page"], 5))]
+
+    with patch.object(bills, "_fetch_page", fetch_page):
+        yield requested
+
+
+class TestIterBills:
+    @pytest.mark.parametrize("prefetch", [True, False])
+    def test_walks_every_page(self, pages, prefetch):
+        result = list(bills.iter_bills(page_size=2, prefetch=prefetch))
+
+        assert [b.bill_id for b in result] == ["hr{}-114".format(i) for i in range(5)]
+        assert pages == [1, 2, 3]
+
+    def test_bills_are_compact(self, pages):
+        b = next(bills.iter_bills(page_size=2))
+
+        assert b.title == "To do thing 0"
+        assert b.url == "https://congress.gov/0"
+        assert not hasattr(b, "__dict__")
+
+    def test_stops_fetching_when_closed(self, pages):
+        stream = bills.iter_bills(page_size=2, prefetch=False)
+        next(stream)
+        stream.close()
+
+        assert pages == [1]
+
+    def test_updated_since_is_sent_as_a_filter(self):
+        with patch.object(bills, "_fetch_page", return_value=[]) as fetch_page:
+            assert list(bills.iter_bills(updated_since="2016-01-01", congress=114)) == []
+
+        params = fetch_page.call_args[0][0]
+        assert params["last_action_at__gte"] == "2016-01-01"
+        assert params["congress"] == 114
+
+    def test_pages_can_skip_the_response_cache(self):
+        with patch.object(bills, "_fetch_page", return_value=[]) as fetch_page:
+            list(bills.iter_bills(use_cache=False, prefetch=False))
+
+        assert fetch_page.call_args[0][2] is False
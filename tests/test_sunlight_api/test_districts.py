@@ -0,0 +1,88 @@
+import sunlight_api_base_test
+
+import os
+import pytest
+from unittest.mock import patch
+
+import shared.config as config
+
+import sunlight_api.districts as districts
+
+ZIP_ROWS = [
+    {"zip": "94110", "state": "CA", "district": "12"},
+    {"zip": "94110", "state": "CA", "district": "14"},
+    {"zip": "97401", "state": "OR", "district": "4"},
+]
+
+LEGISLATOR_ROWS = [
+    {"first_name": "Nancy", "last_name": "Pelosi", "type": "rep", "state": "CA", "district": "12"},
+    {"first_name": "Jackie", "last_name": "Speier", "type": "rep", "state": "CA", "district": "14"},
+    {"first_name": "Dianne", "last_name": "Feinstein", "type": "sen", "state": "CA", "district": ""},
+    {"first_name": "Peter", "last_name": "DeFazio", "type": "rep", "state": "OR", "district": "4"},
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def path(tmpdir):
+    path = str(tmpdir.join("districts.bin"))
+    districts.build_table(ZIP_ROWS, LEGISLATOR_ROWS, path)
+
+    return path
+
+
+class TestDistrictTable:
+    def test_zip_code_spanning_districts(self, path):
+        table = districts.DistrictTable(path)
+
+        assert table.get_districts("94110") == [("CA", 12), ("CA", 14)]
+        assert [l.last_name for l in table.get_legistlators("94110-1234")] == \
+            ["Pelosi", "Feinstein", "Speier"]
+
+    def test_unknown_zip_codes(self, path):
+        table = districts.DistrictTable(path)
+
+        assert table.get_legistlators("10001") == []
+        assert table.get_legistlators("99999") == []
+        assert table.get_legistlators(None) == []
+        assert table.get_legistlators("") == []
+
+
+class TestDistrictLookup:
+    def test_reloads_a_replaced_file(self, path):
+        clock = FakeClock()
+        lookup = districts.DistrictLookup(path, reload_interval=60, clock=clock)
+        assert [l.last_name for l in lookup.get_legistlators("97401")] == ["DeFazio"]
+
+        rows = [dict(row, last_name="Hoyle") if row["state"] == "OR" else row for row in LEGISLATOR_ROWS]
+        districts.build_table(ZIP_ROWS, rows, path)
+
+        # Not checked again until the interval passes
+        assert [l.last_name for l in lookup.get_legistlators("97401")] == ["DeFazio"]
+        clock.now += 60
+        assert [l.last_name for l in lookup.get_legistlators("97401")] == ["Hoyle"]
+
+    def test_keeps_the_previous_table_when_the_new_file_is_bad(self, path):
+        lookup = districts.DistrictLookup(path, reload_interval=0)
+
+        with open(path + ".new", "wb") as f:
+            f.write(b"not a table" * 10)
+        os.replace(path + ".new", path)
+
+        assert not lookup.reload_if_changed()
+        assert [l.last_name for l in lookup.get_legistlators("97401")] == ["DeFazio"]
+
+    def test_configured_path_is_in_the_data_dir(self, tmpdir):
+        districts.build_table(ZIP_ROWS, LEGISLATOR_ROWS, str(tmpdir.join("districts.bin")))
+
+        with patch.dict(config.store, {"data_dir": str(tmpdir), "districts": {"path": "districts.bin"}}):
+            lookup = districts._create_district_lookup()
+
+        assert lookup.path == str(tmpdir.join("districts.bin"))
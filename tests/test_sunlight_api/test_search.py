@@ -0,0 +1,90 @@
+import sunlight_api_base_test
+
+import os
+import pytest
+
+import sunlight_api.models.bill as bill
+import sunlight_api.search as search
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_bill(bill_id, title, summary=None, keywords=()):
+    return bill.Bill({"bill_id": bill_id, "official_title": title, "summary_short": summary, "keywords": keywords})
+
+
+@pytest.fixture
+def index():
+    index = search.BillIndex()
+    index.add_bill(make_bill("hr1", "Affordable Health Care Act", keywords=["Health", "Insurance"]))
+    index.add_bill(make_bill("hr2", "Farm subsidies", summary="Support for rural health clinics"))
+    index.add_bill(make_bill("hr3", "Highway funding"))
+
+    return index
+
+
+class TestBillIndex:
+    def test_ranks_better_matches_first(self, index):
+        assert [bill_id for bill_id, _ in index.search("HEALTH")] == ["hr1", "hr2"]
+        assert index.search("health", k=1)[0][0] == "hr1"
+        assert index.search("the act") == []
+
+    def test_bills_are_replaced_and_removed(self, index):
+        index.add_bill(make_bill("hr3", "Highway health and safety"))
+        assert "hr3" in [bill_id for bill_id, _ in index.search("health")]
+        assert index.search("funding") == []
+
+        index.remove_bill("hr1")
+        assert {bill_id for bill_id, _ in index.search("health insurance")} == {"hr2", "hr3"}
+        assert index.search("insurance") == []
+        assert len(index) == 2
+
+    def test_mapped_index_matches_the_in_memory_index(self, index, tmpdir):
+        path = str(tmpdir.join("bills.index"))
+        index.save(path)
+        mapped = search.MappedBillIndex(path)
+
+        assert len(mapped) == 3
+        for query in ("health", "health care", "highway", "rural farm", "nothing"):
+            assert mapped.search(query) == pytest.approx(index.search(query))
+
+    def test_empty_index_can_be_saved(self, tmpdir):
+        path = str(tmpdir.join("bills.index"))
+        search.BillIndex().save(path)
+
+        assert search.MappedBillIndex(path).search("health") == []
+
+
+class TestBillIndexLookup:
+    def test_reloads_a_replaced_file(self, index, tmpdir):
+        path = str(tmpdir.join("bills.index"))
+        index.save(path)
+        clock = FakeClock()
+        lookup = search.BillIndexLookup(path, reload_interval=60, clock=clock)
+        assert lookup.search("highway")[0][0] == "hr3"
+
+        index.add_bill(make_bill("hr4", "Highway safety and highway funding"))
+        index.save(path)
+
+        # Not checked again until the interval passes
+        assert len(lookup.search("highway")) == 1
+        clock.now += 60
+        assert [bill_id for bill_id, _ in lookup.search("highway")] == ["hr4", "hr3"]
+
+    def test_keeps_the_previous_index_when_the_new_file_is_bad(self, index, tmpdir):
+        path = str(tmpdir.join("bills.index"))
+        index.save(path)
+        lookup = search.BillIndexLookup(path, reload_interval=0)
+
+        with open(path + ".new", "wb") as f:
+            f.write(b"not an index" * 10)
+        os.replace(path + ".new", path)
+
+        assert not lookup.reload_if_changed()
+        assert lookup.search("highway")[0][0] == "hr3"
@@ -0,0 +1,72 @@
+import sunlight_api_base_test
+
+import sqlite3
+from unittest.mock import patch
+
+import sunlight_api.bills as bills
+import sunlight_api.models.bill as bill
+import sunlight_api.sync as sync
+from sunlight_api.catalog import BillCatalog
+
+
+def make_bill(i, last_action_at):
+    return bill.Bill({
+        "bill_id": "hr{}-114".format(i),
+        "congress": 114,
+        "official_title": "To do thing {}".format(i),
+        "last_action_at": last_action_at,
+    })
+
+
+class TestBillSync:
+    def test_bills_are_upserted_and_the_high_water_mark_advances(self):
+        bill_catalog = BillCatalog(":memory:")
+        upstream = [make_bill(0, "2016-01-01"), make_bill(1, "2016-02-01"), make_bill(2, None)]
+
+        with patch.object(bills, "iter_bills", return_value=iter(upstream)) as iter_bills:
+            assert sync.sync_bills(bill_catalog, batch_size=2) == 3
+
+        iter_bills.assert_called_once_with(updated_since=None, use_cache=False)
+        assert len(bill_catalog) == 3
+        assert bill_catalog.get_high_water_mark() == "2016-02-01"
+
+        stored = bill_catalog.get_bill("hr1-114")
+        assert stored.to_row() == upstream[1].to_row()
+        assert stored.congress == 114
+
+    def test_sync_resumes_from_the_high_water_mark(self):
+        bill_catalog = BillCatalog(":memory:")
+        bill_catalog.upsert_bills([make_bill(0, "2016-01-01")], "2016-01-01")
+
+        updated = make_bill(0, "2016-03-01")
+        with patch.object(bills, "iter_bills", return_value=iter([updated])) as iter_bills:
+            sync.sync_bills(bill_catalog)
+
+        iter_bills.assert_called_once_with(updated_since="2016-01-01", use_cache=False)
+        assert len(bill_catalog) == 1
+        assert bill_catalog.get_bill("hr0-114").last_action_at == "2016-03-01"
+        assert bill_catalog.get_high_water_mark() == "2016-03-01"
+
+    def test_recent_bills_are_latest_first(self):
+        bill_catalog = BillCatalog(":memory:")
+        bill_catalog.upsert_bills([make_bill(0, "2016-01-01"), make_bill(1, "2016-02-01")])
+
+        assert [b.bill_id for b in bill_catalog.get_recent_bills(1)] == ["hr1-114"]
+
+    def test_older_catalogs_are_migrated(self, tmpdir):
+        path = str(tmpdir.join("bills.sqlite"))
+        db = sqlite3.connect(path)
+        with db:
+            db.execute("CREATE TABLE bills (bill_id TEXT PRIMARY KEY, congress, title, last_action_at)")
+            db.execute("INSERT INTO bills (bill_id, congress, last_action_at) VALUES ('hr0-114', 114, '2016-01-01')")
+            db.execute("CREATE TABLE sync_state (name TEXT PRIMARY KEY, value TEXT)")
+            db.execute("INSERT INTO sync_state VALUES (?, '2016-01-01')", (BillCatalog.HIGH_WATER_MARK,))
+        db.close()
+
+        bill_catalog = BillCatalog(path)
+        assert bill_catalog.get_bill("hr0-114").summary is None
+        assert bill_catalog.get_high_water_mark() is None
+
+        bill_catalog.upsert_bills([make_bill(1, "2016-02-01")], "2016-02-01")
+        assert bill_catalog.get_bill("hr1-114").congress == 114
+        assert BillCatalog(path).get_high_water_mark() == "2016-02-01"